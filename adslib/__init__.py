@@ -1,6 +1,16 @@
-from . import credentialstore
-from . import access_load
-from . import access_store
-from . import assess
-from . import address
-from . import load_from_osm
\ No newline at end of file
+import importlib
+
+# The submodules are imported on first access, so that `import adslib` does not load their dependencies
+__submodules__ = ['credentialstore', 'access_load', 'access_store', 'assess', 'address', 'load_from_osm', 'config',
+                  'query_cache', 'osm_cache', 'osm_extract', 'spatial', 'sketch', 'pipeline', 'instrument', 'benchmark',
+                  'feature_store', 'atomic', 'lazy']
+
+__all__ = ['credentialstore', 'access_load', 'access_store', 'assess', 'address', 'load_from_osm']
+
+def __getattr__(name):
+    if name in __submodules__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + __submodules__)
@@ -1,4 +1,71 @@
+import math
+import time
 import pymysql
+from concurrent.futures import ThreadPoolExecutor
+from .query_cache import cached_query
+from .access_store import prices_coordinates_fresh, postcode_coordinates_fresh
+from .instrument import instrumented, get_recorder
+from .lazy import LazyModule
+
+# numpy and pandas are only imported when a sample or a DataFrame is first built, so that importing the queries stays cheap
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# The fixed categories of the coded Price Paid columns, so that chunks share the same categorical dtype
+__CATEGORIES__ = {'property_type': ['D', 'S', 'T', 'F', 'O'], 'tenure_type': ['F', 'L', 'U'], 'new_build_flag': ['Y', 'N']}
+
+''' Private method returning the SQL random number expression, seeded if a seed is given
+    :param seed: An integer seed or None
+    :return: The SQL expression
+'''
+def __random_expression__(seed):
+    return 'RAND()' if seed is None else 'RAND(%d)' % int(seed)
+
+''' Private method to draw a uniformly random sample of rows from a table or a join.
+    With 'rand' sampling, all matching rows are sorted by a random number, which is exact but sorts the full result.
+    With 'bernoulli' sampling, the matching rows are first counted, and each row is kept with a probability chosen
+    so that about `oversampling` times the required number of rows survive. Only the surviving rows are then sorted.
+    If too few rows survive, the sample is drawn again with a higher rate. Each subset of rows is equally likely in both cases.
+    :param conn: A pymysql connection to a database
+    :param source: The FROM clause of the query
+    :param conditions: A list of conditions on the rows of the source
+    :param args: The parameters of the query
+    :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' or 'bernoulli'
+    :param seed: An integer seed, making the sample reproducible, or None
+    :param oversampling: The expected ratio between the rows kept by the Bernoulli filter and the required rows
+    :param columns: The selected columns
+    :return: A sequence of rows
+'''
+@instrumented('sql_sample')
+def __sample__(conn, source, conditions, args, limit, sampling = 'rand', seed = None, oversampling = 1.5, columns = '*'):
+    cur = conn.cursor()
+    where = lambda conditions: ' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''
+    args = dict(args, limit = limit)
+    if sampling == 'rand':
+        cur.execute('SELECT ' + columns + ' FROM ' + source + where(conditions) + ' ORDER BY ' + __random_expression__(seed) + ' LIMIT %(limit)s', args)
+        return cur.fetchall()
+    if sampling != 'bernoulli':
+        raise ValueError("Unknown sampling strategy '%s', expected 'rand' or 'bernoulli'." % sampling)
+
+    cur.execute('SELECT COUNT(*) FROM ' + source + where(conditions), args)
+    total = cur.fetchone()[0]
+    if total == 0:
+        return ()
+    rate = min(1, oversampling * limit / total)
+    attempt = 0
+    while True:
+        # Each attempt uses different seeds, so that a failed attempt is not repeated
+        filter_seed = None if seed is None else seed + 2 * attempt
+        order_seed = None if seed is None else seed + 2 * attempt + 1
+        query = ('SELECT ' + columns + ' FROM ' + source + where(conditions + [__random_expression__(filter_seed) + ' < %(rate)s']) +
+                 ' ORDER BY ' + __random_expression__(order_seed) + ' LIMIT %(limit)s')
+        cur.execute(query, dict(args, rate = rate))
+        rows = cur.fetchall()
+        if len(rows) >= min(limit, total) or rate >= 1:
+            return rows
+        rate = min(1, rate * 2)
+        attempt += 1
 
 ''' Takes the columns of a table
     :param conn: A pymysql connection to a database
@@ -10,68 +77,155 @@ def get_table_columns(conn, table_name):
     cur.execute('SHOW COLUMNS FROM %s ORDER BY RAND()'%table_name)
     return cur.fetchall()
 
-''' Fetches a random sample from the table
+''' Private method to sample rows by drawing random values of an integer primary key.
+    Keys are drawn uniformly without replacement from the range of the key, and the drawn keys that exist are kept,
+    so gaps in the key only cost additional draws. The result is a uniformly random sample, which never sorts the table.
     :param conn: A pymysql connection to a database
     :param table_name: The name of the table queried
+    :param key: The integer primary key of the table
     :param limit: The amount of rows to be sampled
+    :param seed: An integer seed, making the sample reproducible, or None
     :return: A sequence of rows
 '''
-def get_row_sample(conn, table_name, limit = 100):
+@instrumented('sql_sample')
+def __sample_by_key__(conn, table_name, key, limit, seed = None):
     cur = conn.cursor()
-    cur.execute('SELECT * FROM %s ORDER BY RAND() LIMIT %s'%(table_name, limit))
-    return cur.fetchall()
+    cur.execute('SELECT MIN(%s), MAX(%s), COUNT(*) FROM %s' % (key, key, table_name))
+    lowest, highest, total = cur.fetchone()
+    if total == 0:
+        return ()
+    key_range = highest - lowest + 1
+    generator = np.random.default_rng(seed)
+    if limit >= total:
+        # The sample is the whole table, in a random order
+        cur.execute('SELECT * FROM %s' % table_name)
+        rows = cur.fetchall()
+        return tuple(rows[position] for position in generator.permutation(len(rows)))
+    rows = []
+    # The keys already looked up. Keys are drawn with replacement and repeated ones skipped, so that the keys are
+    # looked up in a uniformly random order without materializing the whole range
+    tried = set()
+    while len(rows) < limit and len(tried) < key_range:
+        # Draw enough keys to find the missing rows, given the density of the key, in rounds of bounded size
+        draws = min(int(np.ceil((limit - len(rows)) * key_range / total * 1.2)) + 10, 10000)
+        keys = []
+        for k in generator.integers(lowest, highest + 1, draws).tolist():
+            if k not in tried:
+                tried.add(k)
+                keys.append(k)
+        if len(keys) == 0:
+            continue
+        cur.execute('SELECT * FROM %s WHERE %s IN (%s)' % (table_name, key, ', '.join(['%s'] * len(keys))), keys)
+        columns = [column[0] for column in cur.description]
+        found = {row[columns.index(key)]: row for row in cur.fetchall()}
+        rows += [found[k] for k in keys if k in found]
+    return tuple(rows[:limit])
+
+''' Fetches a random sample from the table
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the table queried
+    :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort the table randomly, 'bernoulli' to pre-filter the rows randomly,
+        or 'key' to draw random values of an integer primary key
+    :param seed: An integer seed, making the sample reproducible, or None
+    :param key: The integer primary key used by 'key' sampling
+    :return: A sequence of rows
+'''
+@cached_query(lambda params: params['table_name'])
+def get_row_sample(conn, table_name, limit = 100, sampling = 'rand', seed = None, key = 'db_id'):
+    if sampling == 'key':
+        return __sample_by_key__(conn, table_name, key, limit, seed = seed)
+    return __sample__(conn, table_name, [], {}, limit, sampling = sampling, seed = seed)
 
 ''' Fetches a random sample from the table
     :param conn: A pymysql connection to a database
     :param area: The first characters of a postcode
     :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort all matching rows randomly, or 'bernoulli' to pre-filter them randomly
+    :param seed: An integer seed, making the sample reproducible, or None
     :return: A sequence of rows
 '''
-def get_postcode_data_for_area(conn, area, limit = 100):
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM `postcode_data` WHERE postcode LIKE %(area)s ORDER BY RAND() LIMIT %(limit)s', \
-        {'area': area + '%', 'limit': limit})
-    return cur.fetchall()
+@cached_query('postcode_data')
+def get_postcode_data_for_area(conn, area, limit = 100, sampling = 'rand', seed = None):
+    return __sample__(conn, '`postcode_data`', ['postcode LIKE %(area)s'], {'area': area + '%'}, limit,
+                      sampling = sampling, seed = seed)
+
+''' Private method building the FROM clause of the price queries. When the materialized `prices_coordinates` table
+    built by `access_store.build_prices_coordinates` exists and is up to date with the source tables, it is queried directly.
+    Otherwise, for instance after `pp_data` has been reloaded, the filtered transactions are joined with the filtered postcodes.
+    The selected columns are the same in both cases.
+    :param conn: A pymysql connection to a database
+    :param price_conditions: A list of conditions on the transactions
+    :param postcode_conditions: A list of conditions on the postcodes
+    :param postcode_table: The table of postcodes to be joined, `postcode_data` or the spatially indexed `postcode_coordinates`
+    :return: The FROM clause, the conditions to be applied to it and the selected columns
+'''
+def __price_coord_source__(conn, price_conditions, postcode_conditions, postcode_table = 'postcode_data'):
+    price_columns = 'price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county'
+    postcode_columns = 'postcode, country, lattitude, longitude'
+    if prices_coordinates_fresh(conn):
+        conditions = list(dict.fromkeys(price_conditions + postcode_conditions))
+        return '`prices_coordinates`', conditions, price_columns + ', ' + postcode_columns
+    where = lambda conditions: ' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''
+    source = ('(SELECT ' + price_columns + ' FROM `pp_data`' + where(price_conditions) + ''') pp
+            INNER JOIN 
+            (SELECT ''' + postcode_columns + ' FROM `' + postcode_table + '`' + where(postcode_conditions) + ''') pc
+            ON pp.postcode = pc.postcode''')
+    return source, [], '*'
+
+''' Private method returning the conditions selecting the postcodes inside a coordinate box.
+    With the spatial index, the box is looked up through the SPATIAL index on the `coordinates` column.
+    The index is ignored if `postcode_data` has been reloaded since it was created, as its postcodes would be outdated.
+    :param conn: A pymysql connection to a database
+    :param use_spatial_index: Whether to use the spatial index
+    :return: The conditions, using the 'north', 'south', 'east', 'west' and 'box' parameters, and the table of postcodes to be joined
+'''
+def __box_conditions__(conn, use_spatial_index):
+    if use_spatial_index and postcode_coordinates_fresh(conn):
+        return ['MBRIntersects(ST_GeomFromText(%(box)s), coordinates)'], 'postcode_coordinates'
+    return ['lattitude BETWEEN %(south)s AND %(north)s', 'longitude BETWEEN %(west)s AND %(east)s'], 'postcode_data'
+
+''' Private method to build the parameters describing a coordinate box
+    :return: A dictionary with the edges of the box and its WKT polygon
+'''
+def __box_parameters__(north, east, south, west):
+    # The edges may be NumPy scalars or Decimals, whose repr is not valid WKT
+    north, east, south, west = float(north), float(east), float(south), float(west)
+    polygon = 'POLYGON((%.10f %.10f, %.10f %.10f, %.10f %.10f, %.10f %.10f, %.10f %.10f))' % (west, south, east, south, east, north, west, north, west, south)
+    return {'north': north, 'south': south, 'west': west, 'east': east, 'box': polygon}
+
+''' Private method to build the parameters describing a year range
+    :return: A dictionary with the first and last dates of the range
+'''
+def __year_parameters__(start_year, end_year):
+    return {'start_date': str(start_year) + '/1/1', 'end_date': str(end_year) + '/12/31'}
 
 ''' Fetches a random sample from the table within a given postcode area
     :param conn: A pymysql connection to a database
     :param area: The first characters of a postcode
     :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort all matching rows randomly, or 'bernoulli' to pre-filter them randomly
+    :param seed: An integer seed, making the sample reproducible, or None
     :return: A sequence of rows
 '''
-def get_price_coord_data_for_area(conn, area, limit = 100):
-    cur = conn.cursor()
-    query = '''SELECT * FROM 
-            (SELECT price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county  FROM `pp_data`
-            WHERE postcode LIKE %(area)s) pp
-            INNER JOIN 
-            (SELECT postcode, country, lattitude, longitude FROM `postcode_data`
-            WHERE postcode LIKE %(area)s) pc
-            ON pp.postcode = pc.postcode 
-            ORDER BY RAND()
-            LIMIT %(limit)s'''
-    cur.execute(query, {'area': area + '%', 'limit': limit})
-    return cur.fetchall()
+@cached_query('pp_data', 'postcode_data', 'prices_coordinates')
+def get_price_coord_data_for_area(conn, area, limit = 100, sampling = 'rand', seed = None):
+    source, conditions, columns = __price_coord_source__(conn, ['postcode LIKE %(area)s'], ['postcode LIKE %(area)s'])
+    return __sample__(conn, source, conditions, {'area': area + '%'}, limit, sampling = sampling, seed = seed, columns = columns)
 
 ''' Fetches a random sample from the table in a given year range
     :param conn: A pymysql connection to a database
     :param start_year: The first possible year for the query
     :param end_year: The last possible year for the query
     :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort all matching rows randomly, or 'bernoulli' to pre-filter them randomly
+    :param seed: An integer seed, making the sample reproducible, or None
     :return: A sequence of rows
 '''
-def get_price_coord_data_between_years(conn, start_year = 1995, end_year = 2022, limit = 100):
-    cur = conn.cursor()
-    query = '''SELECT * FROM 
-            (SELECT price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county FROM `pp_data`
-            WHERE date_of_transfer BETWEEN %(start_date)s AND %(end_date)s) pp
-            INNER JOIN 
-            (SELECT postcode, country, lattitude, longitude FROM `postcode_data`) pc
-            ON pp.postcode = pc.postcode
-            ORDER BY RAND()
-            LIMIT %(limit)s''' 
-    cur.execute(query, {'start_date': str(start_year) + '/1/1', 'end_date': str(end_year) + '/12/31', 'limit': limit})
-    return cur.fetchall()
+@cached_query('pp_data', 'postcode_data', 'prices_coordinates')
+def get_price_coord_data_between_years(conn, start_year = 1995, end_year = 2022, limit = 100, sampling = 'rand', seed = None):
+    source, conditions, columns = __price_coord_source__(conn, ['date_of_transfer BETWEEN %(start_date)s AND %(end_date)s'], [])
+    return __sample__(conn, source, conditions, __year_parameters__(start_year, end_year), limit, sampling = sampling, seed = seed, columns = columns)
 
 ''' Fetches a random sample from the table in a given year range inside a postcode area
     :param conn: A pymysql connection to a database
@@ -79,24 +233,16 @@ def get_price_coord_data_between_years(conn, start_year = 1995, end_year = 2022,
     :param start_year: The first possible year for the query
     :param end_year: The last possible year for the query
     :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort all matching rows randomly, or 'bernoulli' to pre-filter them randomly
+    :param seed: An integer seed, making the sample reproducible, or None
     :return: A sequence of rows
 '''
-def get_price_coord_data_between_years_for_area(conn, area, start_year = 1995, end_year = 2022, limit = 100):
-    cur = conn.cursor()
-    query = '''SELECT * FROM 
-            (SELECT price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county 
-            FROM `pp_data`
-            WHERE postcode LIKE %(area)s AND
-            date_of_transfer BETWEEN %(start_date)s AND %(end_date)s) pp
-            INNER JOIN 
-            (SELECT postcode, country, lattitude, longitude 
-            FROM `postcode_data`
-            WHERE postcode LIKE %(area)s) pc
-            ON pp.postcode = pc.postcode
-            ORDER BY RAND()
-            LIMIT %(limit)s'''
-    cur.execute(query, {'area': area + '%', 'start_date': str(start_year) + '/1/1', 'end_date': str(end_year) + '/12/31', 'limit': limit})
-    return cur.fetchall()
+@cached_query('pp_data', 'postcode_data', 'prices_coordinates')
+def get_price_coord_data_between_years_for_area(conn, area, start_year = 1995, end_year = 2022, limit = 100, sampling = 'rand', seed = None):
+    source, conditions, columns = __price_coord_source__(conn, ['postcode LIKE %(area)s', 'date_of_transfer BETWEEN %(start_date)s AND %(end_date)s'],
+                                                         ['postcode LIKE %(area)s'])
+    args = dict(__year_parameters__(start_year, end_year), area = area + '%')
+    return __sample__(conn, source, conditions, args, limit, sampling = sampling, seed = seed, columns = columns)
 
 ''' Fetches a random sample from the table in a given year range inside a coordinate box
     :param conn: A pymysql connection to a database
@@ -107,21 +253,248 @@ def get_price_coord_data_between_years_for_area(conn, area, start_year = 1995, e
     :param start_year: The first possible year for the query
     :param end_year: The last possible year for the query
     :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort all matching rows randomly, or 'bernoulli' to pre-filter them randomly
+    :param seed: An integer seed, making the sample reproducible, or None
+    :param use_spatial_index: Whether to look up the box in the spatial index created by `access_store.create_spatial_index`, if it is up to date
+    :return: A sequence of rows
+'''
+@cached_query('pp_data', 'postcode_data', 'postcode_coordinates', 'prices_coordinates')
+def get_price_coord_data_between_years_for_coordinate_area(conn, north, east, south, west, start_year = 1995, end_year = 2022, limit = 100, sampling = 'rand', seed = None, use_spatial_index = False):
+    box_conditions, postcode_table = __box_conditions__(conn, use_spatial_index)
+    source, conditions, columns = __price_coord_source__(conn, ['date_of_transfer BETWEEN %(start_date)s AND %(end_date)s'],
+                                                         box_conditions, postcode_table = postcode_table)
+    args = dict(__box_parameters__(north, east, south, west), **__year_parameters__(start_year, end_year))
+    return __sample__(conn, source, conditions, args, limit, sampling = sampling, seed = seed, columns = columns)
+
+''' Fetches a random sample from the table in a given year range within a given distance of a point.
+    The box around the circle is looked up first, and the distance is then checked with the haversine formula.
+    :param conn: A pymysql connection to a database
+    :param latitude: The latitude of the center point
+    :param longitude: The longitude of the center point
+    :param radius: The maximum distance in metres
+    :param start_year: The first possible year for the query
+    :param end_year: The last possible year for the query
+    :param limit: The amount of rows to be sampled
+    :param sampling: The sampling strategy - 'rand' to sort all matching rows randomly, or 'bernoulli' to pre-filter them randomly
+    :param seed: An integer seed, making the sample reproducible, or None
+    :param use_spatial_index: Whether to look up the box in the spatial index created by `access_store.create_spatial_index`, if it is up to date
     :return: A sequence of rows
 '''
-def get_price_coord_data_between_years_for_coordinate_area(conn, north, east, south, west, start_year = 1995, end_year = 2022, limit = 100):
+@cached_query('pp_data', 'postcode_data', 'postcode_coordinates', 'prices_coordinates')
+def get_price_coord_data_between_years_within_radius(conn, latitude, longitude, radius, start_year = 1995, end_year = 2022, limit = 100, sampling = 'rand', seed = None, use_spatial_index = False):
+    earth_radius = 6371009
+    delta_lat = math.degrees(radius / earth_radius)
+    delta_lon = delta_lat / math.cos(math.radians(latitude))
+    box_conditions, postcode_table = __box_conditions__(conn, use_spatial_index)
+    source, conditions, columns = __price_coord_source__(conn, ['date_of_transfer BETWEEN %(start_date)s AND %(end_date)s'],
+                                                         box_conditions, postcode_table = postcode_table)
+    distance = '''%(earth_radius)s * 2 * ASIN(SQRT(POW(SIN(RADIANS(lattitude - %(latitude)s) / 2), 2)
+            + COS(RADIANS(%(latitude)s)) * COS(RADIANS(lattitude)) * POW(SIN(RADIANS(longitude - %(longitude)s) / 2), 2)))
+            <= %(radius)s'''
+    args = dict(__box_parameters__(latitude + delta_lat, longitude + delta_lon, latitude - delta_lat, longitude - delta_lon),
+                latitude = latitude, longitude = longitude, radius = radius, earth_radius = earth_radius,
+                **__year_parameters__(start_year, end_year))
+    return __sample__(conn, source, conditions + [distance], args, limit, sampling = sampling, seed = seed, columns = columns)
+
+# The SQL expressions of the groups for which outlier bounds can be computed in the database
+__GROUP_EXPRESSIONS__ = {None: "'all'",
+                         'property_type': 'property_type',
+                         'tenure_type': 'tenure_type',
+                         'postcode_area': "REGEXP_SUBSTR(postcode, '^[A-Z]+')",
+                         'postcode_district': "SUBSTRING_INDEX(postcode, ' ', 1)"}
+
+''' Computes outlier bounds by the interquartile range method inside the database, so that only the bounds are transferred.
+    The quartiles are exact, computed with PERCENTILE_CONT, which interpolates in the same way as np.quantile.
+    :param conn: A pymysql connection to a database
+    :param column: The numeric column of `pp_data` to compute the bounds for
+    :param group_by: None for global bounds, or one of 'property_type', 'tenure_type', 'postcode_area' and 'postcode_district'
+    :param start_year: The first year of the transactions considered, or None
+    :param end_year: The last year of the transactions considered, or None
+    :return: A DataFrame with the 'group', 'first_quartile', 'third_quartile', 'lower_bound' and 'upper_bound' of each group
+'''
+@cached_query('pp_data')
+@instrumented('sql_outlier_bounds', counter = 'groups')
+def get_outlier_bounds(conn, column = 'price', group_by = None, start_year = None, end_year = None):
+    if group_by not in __GROUP_EXPRESSIONS__:
+        raise ValueError("Unknown group '%s', expected one of %s." % (group_by, list(__GROUP_EXPRESSIONS__)))
+    # The column is part of the query text, so it has to be one of the columns of the table
+    columns = [row[0] for row in get_table_columns(conn, 'pp_data')]
+    if column not in columns:
+        raise ValueError("Unknown column '%s', expected one of %s." % (column, sorted(columns)))
+    conditions = []
+    args = {}
+    if start_year is not None:
+        conditions.append('date_of_transfer >= %(start_date)s')
+        args['start_date'] = str(start_year) + '/1/1'
+    if end_year is not None:
+        conditions.append('date_of_transfer <= %(end_date)s')
+        args['end_date'] = str(end_year) + '/12/31'
+    where = ' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''
+    query = '''SELECT DISTINCT grp,
+            PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY value) OVER (PARTITION BY grp),
+            PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY value) OVER (PARTITION BY grp)
+            FROM (SELECT ''' + __GROUP_EXPRESSIONS__[group_by] + ''' AS grp, `''' + column + '''` AS value FROM `pp_data`''' + where + ''') t'''
     cur = conn.cursor()
-    query = '''SELECT * FROM 
-            (SELECT price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county 
-            FROM `pp_data`
-            WHERE date_of_transfer BETWEEN %(start_date)s AND %(end_date)s) pp
-            INNER JOIN 
-            (SELECT postcode, country, lattitude, longitude 
-            FROM `postcode_data`
-            WHERE lattitude BETWEEN %(south)s AND %(north)s
-            AND longitude BETWEEN %(west)s AND %(east)s) pc
-            ON pp.postcode = pc.postcode
-            ORDER BY RAND()
-            LIMIT %(limit)s'''
-    cur.execute(query, {'north': north, 'south': south, 'west': west, 'east': east, 'start_date': str(start_year) + '/1/1', 'end_date': str(end_year) + '/12/31', 'limit': limit})
-    return cur.fetchall()
+    cur.execute(query, args)
+    bounds = pd.DataFrame.from_records(list(cur.fetchall()), columns = ['group', 'first_quartile', 'third_quartile'])
+    cur.close()
+    bounds[['first_quartile', 'third_quartile']] = bounds[['first_quartile', 'third_quartile']].astype(float)
+    iqr = bounds.third_quartile - bounds.first_quartile
+    bounds['lower_bound'] = bounds.first_quartile - 1.5 * iqr
+    bounds['upper_bound'] = bounds.third_quartile + 1.5 * iqr
+    return bounds
+
+''' Private method to convert fetched rows into a DataFrame with proper dtypes:
+    parsed dates, numeric prices and coordinates, and categorical codes
+    :param rows: A sequence of rows
+    :param columns: The names of the columns
+    :return: A DataFrame
+'''
+def __typed_frame__(rows, columns):
+    frame = pd.DataFrame.from_records(list(rows), columns = columns)
+    frame = frame.loc[:, ~frame.columns.duplicated()]
+    if 'date_of_transfer' in frame.columns:
+        frame['date_of_transfer'] = pd.to_datetime(frame['date_of_transfer'])
+    if 'price' in frame.columns:
+        frame['price'] = pd.to_numeric(frame['price'])
+    for column in ['lattitude', 'longitude']:
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column]).astype(float)
+    for column, categories in __CATEGORIES__.items():
+        if column in frame.columns:
+            frame[column] = pd.Categorical(frame[column], categories = categories)
+    return frame
+
+''' Runs a query on a server-side cursor, yielding the result in DataFrames of a fixed number of rows,
+    so that only one chunk is held in memory at a time
+    :param conn: A pymysql connection to a database
+    :param query: The query to be run
+    :param args: The parameters of the query
+    :param chunk_size: The number of rows in each DataFrame
+    :return: A generator of typed DataFrames
+'''
+def iter_query_frames(conn, query, args = None, chunk_size = 10000):
+    cur = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        start = time.perf_counter()
+        cur.execute(query, args)
+        columns = [column[0] for column in cur.description]
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+            frame = __typed_frame__(rows, columns)
+            # The time spent by the consumer between chunks is not counted
+            recorder = get_recorder()
+            if recorder is not None:
+                recorder.record('sql_stream', time.perf_counter() - start, rows = len(frame),
+                                bytes = int(frame.memory_usage(index = False).sum()))
+            yield frame
+            start = time.perf_counter()
+    finally:
+        # The rest of the result has to be consumed before the connection can be used again
+        cur.close()
+
+''' Runs a query on a server-side cursor and concatenates the typed chunks into a single DataFrame
+    :param conn: A pymysql connection to a database
+    :param query: The query to be run
+    :param args: The parameters of the query
+    :param chunk_size: The number of rows fetched at a time
+    :return: A typed DataFrame
+'''
+def read_query_frame(conn, query, args = None, chunk_size = 10000):
+    frames = list(iter_query_frames(conn, query, args, chunk_size = chunk_size))
+    if len(frames) == 0:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index = True)
+
+''' Streams all transactions in a given year range, optionally inside a postcode area, joined with their coordinates
+    :param conn: A pymysql connection to a database
+    :param start_year: The first possible year for the query
+    :param end_year: The last possible year for the query
+    :param area: The first characters of a postcode, or None for the whole country
+    :param chunk_size: The number of rows in each DataFrame
+    :return: A generator of typed DataFrames
+'''
+def iter_price_coord_data_between_years(conn, start_year = 1995, end_year = 2022, area = None, chunk_size = 10000):
+    area_condition = '' if area is None else ' AND postcode LIKE %(area)s'
+    if prices_coordinates_fresh(conn):
+        query = '''SELECT price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type,
+                locality, town_city, district, county, country, lattitude, longitude FROM `prices_coordinates`
+                WHERE date_of_transfer BETWEEN %(start_date)s AND %(end_date)s''' + area_condition
+    else:
+        query = '''SELECT pp.price, pp.date_of_transfer, pp.postcode, pp.property_type, pp.new_build_flag, pp.tenure_type,
+                pp.locality, pp.town_city, pp.district, pp.county, pc.country, pc.lattitude, pc.longitude FROM 
+                (SELECT price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county 
+                FROM `pp_data`
+                WHERE date_of_transfer BETWEEN %(start_date)s AND %(end_date)s''' + area_condition + ''') pp
+                INNER JOIN 
+                (SELECT postcode, country, lattitude, longitude 
+                FROM `postcode_data`''' + area_condition.replace(' AND', ' WHERE') + ''') pc
+                ON pp.postcode = pc.postcode'''
+    args = __year_parameters__(start_year, end_year)
+    if area is not None:
+        args['area'] = area + '%'
+    return iter_query_frames(conn, query, args, chunk_size = chunk_size)
+
+''' Loads all transactions in a given year range, optionally inside a postcode area, as a single typed DataFrame,
+    while only buffering one chunk of raw rows at a time
+    :param conn: A pymysql connection to a database
+    :param start_year: The first possible year for the query
+    :param end_year: The last possible year for the query
+    :param area: The first characters of a postcode, or None for the whole country
+    :param chunk_size: The number of rows fetched at a time
+    :return: A typed DataFrame
+'''
+@cached_query('pp_data', 'postcode_data', 'prices_coordinates')
+def get_price_coord_frame_between_years(conn, start_year = 1995, end_year = 2022, area = None, chunk_size = 10000):
+    frames = list(iter_price_coord_data_between_years(conn, start_year, end_year, area = area, chunk_size = chunk_size))
+    if len(frames) == 0:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index = True)
+
+''' Runs a query function for many sets of arguments concurrently, each on its own connection from a pool,
+    and merges the results
+    :param pool: A ConnectionPool
+    :param function: A function from this module taking a connection as its first argument
+    :param argument_list: A list of argument tuples, passed after the connection
+    :param max_workers: The maximum number of queries running at the same time
+    :param keyword_arguments: Keyword arguments passed to every call
+    :return: A sequence of rows, in the order of the argument list
+'''
+def fetch_in_parallel(pool, function, argument_list, max_workers = 4, **keyword_arguments):
+    def run(arguments):
+        with pool.connection() as conn:
+            return function(conn, *arguments, **keyword_arguments)
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        results = list(executor.map(run, argument_list))
+    return tuple(row for result in results for row in result)
+
+''' Fetches a random sample for each of several postcode areas concurrently
+    :param pool: A ConnectionPool
+    :param areas: A list of postcode areas
+    :param limit: The amount of rows to be sampled per area
+    :param max_workers: The maximum number of queries running at the same time
+    :param sampling: The sampling strategy - 'rand' or 'bernoulli'
+    :param seed: An integer seed, making the samples reproducible, or None
+    :return: A sequence of rows, in the order of the areas
+'''
+def get_price_coord_data_for_areas(pool, areas, limit = 100, max_workers = 4, sampling = 'rand', seed = None):
+    return fetch_in_parallel(pool, get_price_coord_data_for_area, [(area,) for area in areas], max_workers = max_workers,
+                             limit = limit, sampling = sampling, seed = seed)
+
+''' Fetches a random sample for each combination of postcode area and year range concurrently
+    :param pool: A ConnectionPool
+    :param areas: A list of postcode areas
+    :param year_ranges: A list of (start_year, end_year) tuples
+    :param limit: The amount of rows to be sampled per area and year range
+    :param max_workers: The maximum number of queries running at the same time
+    :param sampling: The sampling strategy - 'rand' or 'bernoulli'
+    :param seed: An integer seed, making the samples reproducible, or None
+    :return: A sequence of rows, ordered by area and then by year range
+'''
+def get_price_coord_data_between_years_for_areas(pool, areas, year_ranges = [(1995, 2022)], limit = 100, max_workers = 4,
+                                                 sampling = 'rand', seed = None):
+    argument_list = [(area, start_year, end_year) for area in areas for start_year, end_year in year_ranges]
+    return fetch_in_parallel(pool, get_price_coord_data_between_years_for_area, argument_list, max_workers = max_workers,
+                             limit = limit, sampling = sampling, seed = seed)
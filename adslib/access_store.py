@@ -1,5 +1,19 @@
+import os
+import time
+import queue
+import threading
+import weakref
 import pymysql
-import pandas as pd
+from contextlib import contextmanager
+from .query_cache import bump_table_version
+from .instrument import instrumented
+from .lazy import LazyModule
+
+# pandas is only needed by the chunked insertion, and is not imported along with the queries of `access_load`
+pd = LazyModule('pandas')
+
+# The tables known to exist, or not, for each connection
+__known_tables__ = weakref.WeakKeyDictionary()
 
 """ Create a database connection to the MariaDB database
         specified by the host url and database name.
@@ -25,36 +39,374 @@ def create_connection(user, password, host, database, port=3306):
         print(f"Error connecting to the MariaDB Server: {e}")
     return conn
 
-''' Stores the contents of a csv file in a table
+''' A pool of connections to the MariaDB database, which can be shared between threads.
+    Connections are checked with a ping before being handed out, which reconnects them if they were dropped,
+    and a connection is closed rather than reused if any exception was raised while it was in use, since it may be left
+    in the middle of a transaction or with unread results.
+    :param user: username
+    :param password: password
+    :param host: host url
+    :param database: database
+    :param port: port number
+    :param size: The maximum number of connections open at the same time
+    :param connection_factory: A function creating a new connection, by default connecting with pymysql
+'''
+class ConnectionPool:
+    def __init__(self, user, password, host, database, port = 3306, size = 4, connection_factory = None):
+        self.size = size
+        if connection_factory is None:
+            connection_factory = lambda: pymysql.connect(user = user, passwd = password, host = host, port = port,
+                                                         local_infile = 1, db = database)
+        self.__connection_factory__ = connection_factory
+        self.__idle__ = queue.LifoQueue()
+        self.__available__ = threading.BoundedSemaphore(size)
+
+    ''' Borrows a connection from the pool for the duration of a with block, waiting if all connections are in use
+        :return: A context manager yielding a healthy connection
+    '''
+    @contextmanager
+    def connection(self):
+        self.__available__.acquire()
+        try:
+            try:
+                conn = self.__idle__.get_nowait()
+                conn.ping(reconnect = True)
+            except queue.Empty:
+                conn = self.__connection_factory__()
+            try:
+                yield conn
+            except BaseException:
+                # The connection may be in an unknown state, so it is not reused
+                conn.close()
+                raise
+            self.__idle__.put(conn)
+        finally:
+            self.__available__.release()
+
+    ''' Closes all idle connections
+    '''
+    def close(self):
+        while True:
+            try:
+                self.__idle__.get_nowait().close()
+            except queue.Empty:
+                break
+
+''' Checks whether the server accepts LOAD DATA LOCAL INFILE statements
+    :param conn: A pymysql connection to a database
+    :return: True if the 'local_infile' server variable is enabled
+'''
+def local_infile_available(conn):
+    cur = conn.cursor()
+    cur.execute("SHOW GLOBAL VARIABLES LIKE 'local_infile'")
+    row = cur.fetchone()
+    cur.close()
+    return row is not None and str(row[1]).upper() in ('ON', '1')
+
+''' Private method to load a csv file with a single LOAD DATA LOCAL INFILE statement.
+    Values are transformed in the same way as the chunked insertion: empty fields are stored as empty strings and '\\N' as '0'.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the table
+    :param file_location: The location of the file to be stored
+    :param column_list: The columns to be filled, in the order of the file
+    :return: The number of inserted rows
+'''
+def __load_data_infile__(conn, table_name, file_location, column_list):
+    with open(file_location, 'rb') as file:
+        line_terminator = '\\r\\n' if file.readline().endswith(b'\r\n') else '\\n'
+    variables = ['@c%d' % i for i in range(len(column_list))]
+    assignments = ', '.join('%s = IFNULL(%s, \'0\')' % (column, variable) for column, variable in zip(column_list, variables))
+    query = ('LOAD DATA LOCAL INFILE %s INTO TABLE ' + table_name +
+             """ FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES TERMINATED BY '""" + line_terminator + "'" +
+             ' IGNORE 1 LINES (' + ', '.join(variables) + ') SET ' + assignments)
+    cur = conn.cursor()
+    rows = cur.execute(query, (os.path.abspath(file_location),))
+    conn.commit()
+    cur.close()
+    return rows
+
+''' Private method creating the table recording the progress of the chunked insertions, if it does not exist yet
+    :param cur: A cursor of a pymysql connection
+    :param progress_table: The name of the table
+'''
+def __create_progress_table__(cur, progress_table):
+    cur.execute('CREATE TABLE IF NOT EXISTS `' + progress_table + '''` (table_name varchar(64) NOT NULL,
+                   source_file varchar(1024) NOT NULL, committed_rows bigint(20) unsigned NOT NULL)''')
+
+''' Private method reading the number of rows of a file committed by a previous chunked insertion into a table
+    :param conn: A pymysql connection to a database
+    :param progress_table: The table recording the progress of the insertions
+    :param table_name: The name of the table
+    :param source_file: The absolute location of the file
+    :return: The number of committed rows, 0 if there is no unfinished insertion
+'''
+def __committed_rows__(conn, progress_table, table_name, source_file):
+    cur = conn.cursor()
+    __create_progress_table__(cur, progress_table)
+    cur.execute('SELECT committed_rows FROM `' + progress_table + '` WHERE table_name = %s AND source_file = %s',
+                (table_name, source_file))
+    row = cur.fetchone()
+    cur.close()
+    return 0 if row is None else int(row[0])
+
+''' Private method to insert a csv file in chunks, committing after each one. The number of committed rows is updated
+    in the progress table in the same transaction as the rows, so that it always matches the rows in the table.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the table
+    :param file_location: The location of the file to be stored
+    :param column_list: The columns to be filled, in the order of the file
+    :param batch_size: The number of rows inserted and committed at a time
+    :param progress_table: The table recording the number of committed rows
+    :param committed: The number of rows already committed by a previous run, which are skipped
+    :return: The number of rows inserted by this run
+'''
+def __insert_in_chunks__(conn, table_name, file_location, column_list, batch_size, progress_table, committed = 0):
+    template = '%s, ' * (len(column_list) - 1) + '%s'
+    query = 'INSERT INTO ' + table_name + ' (' + ', '.join(column_list) + ') VALUES (' + template + ')'
+    progress = {'table_name': table_name, 'source_file': os.path.abspath(file_location)}
+    where = ' WHERE table_name = %(table_name)s AND source_file = %(source_file)s'
+
+    start = time.time()
+    inserted = 0
+    cur = conn.cursor()
+    __create_progress_table__(cur, progress_table)
+    if committed == 0:
+        cur.execute('DELETE FROM `' + progress_table + '`' + where, progress)
+        cur.execute('INSERT INTO `' + progress_table + '` VALUES (%(table_name)s, %(source_file)s, 0)', progress)
+        conn.commit()
+    chunks = pd.read_csv(file_location, chunksize = batch_size, skiprows = lambda line: 0 < line <= committed)
+    try:
+        for chunk in chunks:
+            list_of_rows = list(chunk.fillna('').replace('\\N', '0').itertuples(index = False, name = None))
+            cur.executemany(query, list_of_rows)
+            inserted += len(list_of_rows)
+            cur.execute('UPDATE `' + progress_table + '` SET committed_rows = %(rows)s' + where, dict(progress, rows = committed + inserted))
+            conn.commit()
+            print("Committed %s lines in %s (%.0f rows/sec)" % (committed + inserted, table_name, inserted / max(time.time() - start, 1e-9)))
+        cur.execute('DELETE FROM `' + progress_table + '`' + where, progress)
+        conn.commit()
+    except BaseException:
+        # The rows of the failed chunk are not kept, as the progress table does not count them
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return inserted
+
+''' Stores the contents of a csv file in a table.
+    If the server allows it, the file is loaded with LOAD DATA LOCAL INFILE. Otherwise it is read and inserted in chunks,
+    committing after each one, so that memory use is bounded. The number of committed rows is recorded in a progress table
+    of the database, in the same transaction as the rows, which allows a failed load to be resumed from the last committed chunk.
     :param conn: A pymysql connection to a database
     :param table_name: The name of the table
     :param file_location: The location of the file to be stored
     :param reset: Whether to delete all previous entries from the table before insertion
+    :param method: 'auto' to use LOAD DATA LOCAL INFILE when available, 'infile' to require it, or 'chunked' to always insert in chunks
+    :param batch_size: The number of rows inserted and committed at a time by the chunked insertion
+    :param resume: Whether to continue a previously failed chunked insertion of the file, instead of starting over
+    :param progress_table: The table recording the progress of the chunked insertions
+    :return: A dictionary with the number of inserted rows, the time taken and the rows inserted per second
 '''
-def save_local_data_in_table(conn, table_name, file_location, reset = True):
-    if reset:
+@instrumented(size = lambda stats: stats['rows'])
+def save_local_data_in_table(conn, table_name, file_location, reset = True, method = 'auto', batch_size = 100000,
+                             resume = False, progress_table = 'load_progress'):
+    committed = 0
+    if resume:
+        committed = __committed_rows__(conn, progress_table, table_name, os.path.abspath(file_location))
+
+    if reset and committed == 0:
         cur = conn.cursor()
         cur.execute('DELETE FROM ' + table_name)
         conn.commit()
         print("Deleted table entries")
         cur.close()
 
-    cur = conn.cursor()
-    data_to_insert = pd.read_csv(file_location).fillna('').replace('\\N', '0')
-
-    list_of_rows = list(data_to_insert.to_records(index=False))
-    list_of_rows = [tuple(i) for i in list_of_rows]
-
     cur = conn.cursor()
     cur.execute('SHOW COLUMNS FROM ' + table_name) 
     cols = cur.fetchall()
-    
+    cur.close()
     column_list = list(zip(*cols))[0][:-1]
-    number_of_columns = len(column_list)
-    template = '%s, ' * (number_of_columns - 1) + '%s'
-    
-    query = 'INSERT INTO ' + table_name + ' ' + str(column_list).replace("'", '') + ' VALUES (' + template + ')'
-    cur.executemany(query, list_of_rows)
-    print("Inserted %s lines in %s"% (len(list_of_rows), table_name))
+
+    start = time.time()
+    rows = None
+    if committed == 0 and method in ('auto', 'infile') and (method == 'infile' or local_infile_available(conn)):
+        try:
+            rows = __load_data_infile__(conn, table_name, file_location, column_list)
+        except pymysql.err.MySQLError as e:
+            if method == 'infile':
+                raise
+            conn.rollback()
+            print(f"LOAD DATA LOCAL INFILE failed, inserting in chunks instead: {e}")
+    if rows is None:
+        rows = __insert_in_chunks__(conn, table_name, file_location, column_list, batch_size, progress_table, committed)
+
+    bump_table_version(table_name)
+
+    elapsed = time.time() - start
+    print("Inserted %s lines in %s" % (rows, table_name))
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / max(elapsed, 1e-9)}
+
+''' Creates a table holding the coordinates of every postcode as a POINT, with a SPATIAL index on it.
+    It is kept separate from `postcode_data`, so that the columns of that table are unchanged, and is used by the
+    coordinate queries in `access_load` when they are called with use_spatial_index = True.
+    The range of the `db_id` keys of the source table is recorded in a `<table_name>_state` table. Once the source table
+    is reloaded, the queries ignore the index (see `postcode_coordinates_fresh`) until it is created again.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the created table
+    :param source_table: The table containing the postcode coordinates
+'''
+@instrumented(size = None)
+def create_spatial_index(conn, table_name = 'postcode_coordinates', source_table = 'postcode_data'):
+    start = time.time()
+    __known_tables__.clear()
+    state = __key_range__(conn, source_table)
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS `' + table_name + '`')
+    cur.execute('''CREATE TABLE `''' + table_name + '''` ENGINE = InnoDB AS
+                   SELECT postcode, country, lattitude, longitude, POINT(longitude, lattitude) AS coordinates
+                   FROM `''' + source_table + '''`
+                   WHERE lattitude IS NOT NULL AND longitude IS NOT NULL''')
+    cur.execute('ALTER TABLE `' + table_name + '` MODIFY coordinates POINT NOT NULL')
+    cur.execute('ALTER TABLE `' + table_name + '` ADD SPATIAL INDEX coordinates_index (coordinates), ADD INDEX postcode_index (postcode)')
+    __write_state__(cur, table_name, state)
+    conn.commit()
+    cur.close()
+    __known_tables__.clear()
+
+    bump_table_version(table_name)
+    print("Created spatial index %s in %s" % (table_name, time.time() - start))
+
+''' Checks whether a table exists in the database of a connection. The answer is remembered for the connection,
+    so that queries choosing between tables do not check it every time.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the table
+    :return: Whether the table exists
+'''
+def table_exists(conn, table_name):
+    known = __known_tables__.setdefault(conn, {})
+    if table_name not in known:
+        cur = conn.cursor()
+        cur.execute('SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', (table_name,))
+        known[table_name] = cur.fetchone()[0] > 0
+        cur.close()
+    return known[table_name]
+
+''' Private method reading the range of the keys assigned by the loader to a table, through its primary key.
+    Reloading a table with `save_local_data_in_table` changes the range, since new rows get new auto-increment keys.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the table
+    :return: A dictionary with the lowest and highest `db_id` of the table
+'''
+def __key_range__(conn, table_name):
+    cur = conn.cursor()
+    cur.execute('SELECT MIN(db_id), MAX(db_id) FROM `' + table_name + '`')
+    min_id, max_id = cur.fetchone()
+    cur.close()
+    return {'min_id': min_id, 'max_id': max_id}
+
+''' Private method reading the range of the keys of `pp_data` and `postcode_data`
+    :param conn: A pymysql connection to a database
+    :return: A dictionary with the lowest and highest `db_id` of `pp_data` and the highest of `postcode_data`
+'''
+def __source_state__(conn):
+    prices, postcodes = __key_range__(conn, 'pp_data'), __key_range__(conn, 'postcode_data')
+    return {'pp_min_id': prices['min_id'], 'pp_max_id': prices['max_id'], 'postcode_max_id': postcodes['max_id']}
+
+''' Private method reading the state of the source tables recorded when a derived table was last refreshed
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the derived table
+    :param columns: The columns of the state
+    :return: The recorded state, or None if there is none
+'''
+def __recorded_state__(conn, table_name, columns = ('pp_min_id', 'pp_max_id', 'postcode_max_id')):
+    if not table_exists(conn, table_name) or not table_exists(conn, table_name + '_state'):
+        return None
+    cur = conn.cursor()
+    cur.execute('SELECT ' + ', '.join(columns) + ' FROM `' + table_name + '_state`')
+    row = cur.fetchone()
+    cur.close()
+    if row is None:
+        return None
+    return dict(zip(columns, row))
+
+''' Private method replacing the recorded state of the source tables of a derived table
+    :param cur: A cursor of the connection, whose transaction is committed by the caller
+    :param table_name: The name of the derived table
+    :param state: A dictionary from the name of each column of the state to its value
+'''
+def __write_state__(cur, table_name, state):
+    cur.execute('DROP TABLE IF EXISTS `' + table_name + '_state`')
+    cur.execute('CREATE TABLE `' + table_name + '_state` (' + ', '.join(column + ' bigint(20) unsigned' for column in state) + ')')
+    cur.execute('INSERT INTO `' + table_name + '_state` VALUES (' + ', '.join('%(' + column + ')s' for column in state) + ')', state)
+
+''' Checks whether the spatial index table built by `create_spatial_index` is up to date with its source table,
+    by comparing the range of the keys of the source with the one recorded when the index was created
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the spatial index table
+    :param source_table: The table containing the postcode coordinates
+    :return: Whether the table exists and holds the current postcodes
+'''
+def postcode_coordinates_fresh(conn, table_name = 'postcode_coordinates', source_table = 'postcode_data'):
+    recorded = __recorded_state__(conn, table_name, columns = ('min_id', 'max_id'))
+    return recorded is not None and recorded == __key_range__(conn, source_table)
+
+''' Checks whether the materialized table built by `build_prices_coordinates` is up to date with `pp_data` and `postcode_data`,
+    by comparing the range of their keys with the one recorded at the last refresh. Both lookups use the primary keys.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the materialized table
+    :return: Whether the table exists and contains every row of the join
+'''
+def prices_coordinates_fresh(conn, table_name = 'prices_coordinates'):
+    recorded = __recorded_state__(conn, table_name)
+    return recorded is not None and recorded == __source_state__(conn)
+
+''' Materializes the join of `pp_data` and `postcode_data` into a single table, which the `access_load` price queries use
+    instead of joining the tables while it is up to date (see `prices_coordinates_fresh`). It is indexed on the date of
+    transfer, the postcode (serving postcode prefix lookups), the coordinates and, with a SPATIAL index, the coordinates as a POINT.
+    The range of the `db_id` keys of the source tables is recorded in a `<table_name>_state` table. A refresh appends the
+    transactions with a key above the recorded one, whatever their date of transfer. If `pp_data` has lost rows, or
+    `postcode_data` has changed, since the last refresh, the table is rebuilt instead.
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the materialized table
+    :param incremental: Whether to append the new transactions to an existing table, instead of rebuilding it
+    :return: A dictionary with the number of added rows, the previous `pp_data` key watermark and the time taken
+'''
+@instrumented(size = lambda stats: stats['rows'])
+def build_prices_coordinates(conn, table_name = 'prices_coordinates', incremental = True):
+    start = time.time()
+    __known_tables__.clear()
+    selection = '''SELECT pp.price, pp.date_of_transfer, pp.postcode, pp.property_type, pp.new_build_flag, pp.tenure_type,
+                   pp.locality, pp.town_city, pp.district, pp.county, pc.country, pc.lattitude, pc.longitude,
+                   POINT(pc.longitude, pc.lattitude) AS coordinates, pp.db_id AS pp_db_id
+                   FROM `pp_data` pp INNER JOIN `postcode_data` pc ON pp.postcode = pc.postcode'''
+    state = __source_state__(conn)
+    recorded = __recorded_state__(conn, table_name) if incremental else None
+    watermark = None
+    if recorded is not None and recorded['pp_min_id'] == state['pp_min_id'] and recorded['postcode_max_id'] == state['postcode_max_id']:
+        watermark = recorded['pp_max_id']
+
+    cur = conn.cursor()
+    if watermark is None:
+        cur.execute('DROP TABLE IF EXISTS `' + table_name + '`')
+        cur.execute('CREATE TABLE `' + table_name + '` ENGINE = InnoDB AS ' + selection)
+        rows = cur.rowcount
+        cur.execute('''ALTER TABLE `''' + table_name + '''` MODIFY coordinates POINT NOT NULL,
+                       ADD db_id bigint(20) unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                       ADD INDEX date_index (date_of_transfer),
+                       ADD INDEX postcode_index (postcode),
+                       ADD INDEX coordinate_index (lattitude, longitude),
+                       ADD SPATIAL INDEX coordinates_index (coordinates)''')
+    else:
+        columns = 'price, date_of_transfer, postcode, property_type, new_build_flag, tenure_type, locality, town_city, district, county, country, lattitude, longitude, coordinates, pp_db_id'
+        cur.execute('INSERT INTO `' + table_name + '` (' + columns + ') ' + selection + ' WHERE pp.db_id > %(watermark)s',
+                    {'watermark': watermark})
+        rows = cur.rowcount
+    __write_state__(cur, table_name, state)
     conn.commit()
+    cur.close()
+    __known_tables__.clear()
 
+    bump_table_version(table_name)
+    elapsed = time.time() - start
+    print("Added %s lines to %s in %s" % (rows, table_name, elapsed))
+    return {'rows': rows, 'watermark': watermark, 'seconds': elapsed}
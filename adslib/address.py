@@ -1,14 +1,94 @@
 import numpy as np
+import pandas as pd
+import scipy.sparse
 import statsmodels.api as sm
+from statsmodels.base.elastic_net import RegularizedResults
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.model_selection import train_test_split, KFold
 
+from .instrument import instrumented
+
+# The dataset shared by the fits running in a worker process
+__worker_data__ = None
+
 ''' Define the default loss function as Mean-Squared Error.
     :param predictions: Predictions made by model
     :param target: Ground truth for the target variable
-    :return: Mean-Squared error of predictions vs target
+    :return: Mean-Squared error of predictions vs target, or one error per column if the predictions are a matrix
 '''
 def mse(predictions, target):
-    return sum((predictions - target)**2 / len(predictions))
+    predictions = np.asarray(predictions, dtype = float)
+    target = np.asarray(target, dtype = float)
+    if predictions.ndim > target.ndim:
+        target = target[:, None]
+    return np.mean((predictions - target)**2, axis = 0)
+
+''' Private method converting a matrix, which can be a SciPy sparse matrix, into a dense array of floats
+    :param matrix: The matrix
+    :return: A NumPy array
+'''
+def __dense__(matrix):
+    if scipy.sparse.issparse(matrix):
+        return matrix.toarray().astype(float)
+    return np.asarray(matrix, dtype = float)
+
+''' Private method converting the features into a matrix supporting row indexing and products,
+    keeping SciPy sparse matrices sparse
+    :param features: An array, DataFrame or SciPy sparse matrix
+    :return: A NumPy array or a SciPy CSR matrix
+'''
+def __design_matrix__(features):
+    if scipy.sparse.issparse(features):
+        return scipy.sparse.csr_matrix(features, dtype = float)
+    return np.asarray(features, dtype = float)
+
+''' Solves a ridge regression for many penalties at once from its sufficient statistics,
+    using a single eigendecomposition of the Gram matrix. The solution is the same as the one of statsmodels'
+    `fit_regularized` with L1_wt = 0, which minimises the residual sum of squares divided by the number of observations
+    plus alpha times the squared norm of the parameters.
+    :param gram: The Gram matrix of the features, X^T X
+    :param moment: The product of the features and the target, X^T y
+    :param nobs: The number of observations
+    :param alphas: A list of penalty coefficients
+    :return: A matrix with the parameters for each penalty in its rows
+'''
+def ridge_path(gram, moment, nobs, alphas):
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    projected = eigenvectors.T @ moment
+    return (projected / (eigenvalues + nobs * np.asarray(alphas, dtype = float)[:, None])) @ eigenvectors.T
+
+''' Private method computing the validation scores of ridge regressions for every fold and penalty.
+    The Gram matrix of the whole dataset is computed once, and the statistics of each fold are obtained by subtracting
+    the contribution of its validation rows, so no fold is fitted from scratch.
+    :param features: The features used for cross-validation
+    :param target: The target used for cross-validation
+    :param folds: A list of (fit_index, val_index) pairs
+    :param alphas: A list of penalty coefficients
+    :param loss: The loss function to be used for evaluation
+    :return: A matrix with the score of each fold in its rows and of each penalty in its columns
+'''
+def __ridge_fold_scores__(features, target, folds, alphas, loss):
+    gram = __dense__(features.T @ features)
+    moment = np.asarray(features.T @ target, dtype = float)
+    scores = []
+    for fit_index, val_index in folds:
+        X_val = features[val_index]
+        y_val = target[val_index]
+        params = ridge_path(gram - __dense__(X_val.T @ X_val), moment - X_val.T @ y_val, len(fit_index), alphas)
+        predictions = X_val @ params.T
+        scores.append([loss(predictions[:, i], y_val) for i in range(len(alphas))])
+    return np.array(scores)
+
+''' Private method fitting a ridge regression in closed form, returning the same results object as statsmodels.
+    The statsmodels model holds a dense copy of the features.
+    :param features: The features
+    :param target: The target
+    :param alpha: The penalty coefficient
+    :return: The RegularizedResults of the fit
+'''
+def __ridge_fit__(features, target, alpha):
+    params = ridge_path(__dense__(features.T @ features), np.asarray(features.T @ target, dtype = float), len(target), [alpha])[0]
+    return RegularizedResults(sm.OLS(target, __dense__(features)), params)
     
 ''' Train and validate the model through k-fold cross-validation.
     :param features: The features of the dataset
@@ -18,38 +98,152 @@ def mse(predictions, target):
     :param number_of_splits: Specifies the number of iterations k for the k-fold cross-validation method
     :param alpha: The penalty coefficient for the regularization
     :L1_wt: The parameter used for describing the elastic net - 0 means we have a Ridge Regression, while 1 means we are using a Lasso Regularisation
+    :param random_state: A seed making the split into the cross-validation and test sets deterministic, or None for a random split
     :return: A result summary from the validation and test, including the trained model
 ''' 
-def cross_validation_train(features, target, split_fractions, loss = mse,  number_of_splits = 5, alpha = 0, L1_wt = 0):
+@instrumented(size = None)
+def cross_validation_train(features, target, split_fractions, loss = mse,  number_of_splits = 5, alpha = 0, L1_wt = 0, random_state = None):
     assert len(split_fractions) == 3, "'split_fractions' parameter should contain 3 numbers, ['fit_fraction', 'validation_fraction', 'test_fraction']."
     assert sum(split_fractions) == 1, "Fractions should add up to 1."
     
     # Split dataset in 2 sub-datasets - one for cross-validation, and one for testing
-    X_fit_val , X_test, y_fit_val, y_test = train_test_split(features, target, test_size=split_fractions[2])
+    X_fit_val , X_test, y_fit_val, y_test = train_test_split(features, target, test_size=split_fractions[2], random_state=random_state)
+    if scipy.sparse.issparse(X_fit_val) and L1_wt != 0:
+        X_fit_val , X_test = __dense__(X_fit_val), __dense__(X_test)
     
     kfold = KFold(n_splits=number_of_splits)
-    scores = []
-    
-    # Perform k-fold cross-validation
-    for fit_index, val_index in kfold.split(X_fit_val):
-        X_fit = X_fit_val[fit_index]
-        X_val = X_fit_val[val_index]
-        y_fit = y_fit_val[fit_index]
-        y_val = y_fit_val[val_index]
+    folds = list(kfold.split(X_fit_val))
+
+    # Ridge and OLS folds are solved in closed form from the sufficient statistics of the whole dataset
+    if L1_wt == 0:
+        X_fit_val , y_fit_val = __design_matrix__(X_fit_val), np.asarray(y_fit_val, dtype = float)
+        scores = __ridge_fold_scores__(X_fit_val, y_fit_val, folds, [alpha], loss)[:, 0]
+        test_fit = __ridge_fit__(X_fit_val, y_fit_val, alpha)
+    else:
+        scores = []
         
-        model = sm.OLS(y_fit, X_fit)
+        # Perform k-fold cross-validation
+        for fit_index, val_index in folds:
+            X_fit = X_fit_val[fit_index]
+            X_val = X_fit_val[val_index]
+            y_fit = y_fit_val[fit_index]
+            y_val = y_fit_val[val_index]
+            
+            model = sm.OLS(y_fit, X_fit)
+            
+            fit = model.fit_regularized(alpha = alpha, L1_wt = L1_wt)
+            scores.append(loss(fit.predict(X_val), y_val))
         
-        fit = model.fit_regularized(alpha = alpha, L1_wt = L1_wt)
-        scores.append(loss(fit.predict(X_val), y_val))
-    
-    # Fit on test model
-    test_model = sm.OLS(y_fit_val, X_fit_val)
-    test_fit = test_model.fit_regularized(alpha = alpha, L1_wt = L1_wt)
+        # Fit on test model
+        test_model = sm.OLS(y_fit_val, X_fit_val)
+        test_fit = test_model.fit_regularized(alpha = alpha, L1_wt = L1_wt)
     
     # Report results
     results = {}
     results['validation_scores'] = np.array(scores)
-    results['test_score'] = loss(test_fit.predict(X_test), y_test)
+    results['test_score'] = loss(test_fit.predict(__dense__(X_test)), y_test)
 
     return results, test_fit
 
+
+''' Private method storing the dataset in a worker process, so that it is only sent once per worker
+    :param features: The features used for cross-validation
+    :param target: The target used for cross-validation
+'''
+def __init_worker__(features, target):
+    global __worker_data__
+    __worker_data__ = (features, target)
+
+''' Private method fitting one fold for a sequence of penalties with the same L1_wt.
+    The penalties are visited from the largest to the smallest, and each fit starts from the parameters of the previous one.
+    :param fit_index: The indices of the rows used for fitting
+    :param val_index: The indices of the rows used for validation
+    :param alphas: The penalty coefficients, in decreasing order
+    :param L1_wt: The elastic net parameter
+    :param loss: The loss function to be used for evaluation
+    :param warm_start: Whether to start each fit from the parameters of the previous one
+    :return: A list with the validation score for each penalty
+'''
+def __fit_alpha_path__(fit_index, val_index, alphas, L1_wt, loss, warm_start):
+    features, target = __worker_data__
+    model = sm.OLS(target[fit_index], features[fit_index])
+    scores = []
+    params = None
+    for alpha in alphas:
+        # The ridge solution is closed-form, so only the elastic net iterations benefit from a starting point
+        fit = model.fit_regularized(alpha = alpha, L1_wt = L1_wt, start_params = params if warm_start and L1_wt > 0 else None)
+        params = fit.params
+        scores.append(loss(fit.predict(features[val_index]), target[val_index]))
+    return scores
+
+''' Searches for the penalty coefficients minimising the mean validation loss of an elastic net, through k-fold cross-validation.
+    The fits for each fold and L1_wt are spread over a pool of processes, and run along the path of decreasing penalties,
+    warm-starting each fit from the previous one. Ridge fits (L1_wt = 0) are all solved in closed form instead. The splits only depend on the seed, and the best model is refitted
+    on all non-test data.
+    :param features: The features of the dataset
+    :param target: Ground truth for the target variable
+    :param split_fractions: A list of 3 number, describing the proportions of the training, validation and test sets
+    :param alphas: A list of penalty coefficients to be tried
+    :param L1_wts: A list of elastic net parameters to be tried
+    :param loss: The loss function to be used for evaluation. It has to be defined at module level, so that it can be sent to the workers
+    :param number_of_splits: Specifies the number of iterations k for the k-fold cross-validation method
+    :param max_workers: The number of worker processes, 1 to fit everything in the current process, or None for one per CPU
+    :param random_state: A seed making the split into the cross-validation and test sets deterministic
+    :param warm_start: Whether to start each fit from the parameters found for the previous, larger penalty
+    :return: A result summary with a table of the score of every fold and parameter pair, the best parameters and their test score,
+        and the model refitted with the best parameters
+'''
+@instrumented(size = None)
+def grid_search_train(features, target, split_fractions, alphas, L1_wts = [0], loss = mse, number_of_splits = 5, max_workers = None,
+                      random_state = 0, warm_start = True):
+    assert len(split_fractions) == 3, "'split_fractions' parameter should contain 3 numbers, ['fit_fraction', 'validation_fraction', 'test_fraction']."
+    assert sum(split_fractions) == 1, "Fractions should add up to 1."
+
+    X_fit_val , X_test, y_fit_val, y_test = train_test_split(__design_matrix__(features), np.asarray(target, dtype = float),
+                                                             test_size=split_fractions[2], random_state=random_state)
+    folds = list(KFold(n_splits=number_of_splits).split(X_fit_val))
+    alphas = sorted(alphas, reverse = True)
+    rows = []
+
+    # The ridge path of every fold is solved in closed form in the current process
+    if 0 in L1_wts:
+        ridge_scores = __ridge_fold_scores__(X_fit_val, y_fit_val, folds, alphas, loss)
+        rows += [{'alpha': alpha, 'L1_wt': 0, 'fold': fold, 'score': ridge_scores[fold, i]}
+                 for fold in range(len(folds)) for i, alpha in enumerate(alphas)]
+
+    jobs = [(fold, L1_wt) for fold in range(len(folds)) for L1_wt in L1_wts if L1_wt != 0]
+    if len(jobs) > 0 and scipy.sparse.issparse(X_fit_val):
+        X_fit_val , X_test = __dense__(X_fit_val), __dense__(X_test)
+    arguments = [(folds[fold][0], folds[fold][1], alphas, L1_wt, loss, warm_start) for fold, L1_wt in jobs]
+    if len(jobs) == 0:
+        paths = []
+    elif max_workers == 1:
+        __init_worker__(X_fit_val, y_fit_val)
+        paths = [__fit_alpha_path__(*job_arguments) for job_arguments in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers = max_workers, initializer = __init_worker__, initargs = (X_fit_val, y_fit_val)) as executor:
+            paths = list(executor.map(__fit_alpha_path__, *zip(*arguments)))
+    rows += [{'alpha': alpha, 'L1_wt': L1_wt, 'fold': fold, 'score': score}
+             for (fold, L1_wt), path in zip(jobs, paths) for alpha, score in zip(alphas, path)]
+
+    scores = pd.DataFrame(rows)
+    scores = scores.sort_values(['L1_wt', 'alpha', 'fold']).reset_index(drop = True)
+    mean_scores = scores.groupby(['alpha', 'L1_wt'])['score'].mean()
+    best_alpha, best_L1_wt = mean_scores.idxmin()
+
+    # Fit on test model
+    if best_L1_wt == 0:
+        test_fit = __ridge_fit__(X_fit_val, y_fit_val, best_alpha)
+    else:
+        test_model = sm.OLS(y_fit_val, __dense__(X_fit_val))
+        test_fit = test_model.fit_regularized(alpha = best_alpha, L1_wt = best_L1_wt)
+
+    # Report results
+    results = {}
+    results['scores'] = scores
+    results['best_alpha'] = best_alpha
+    results['best_L1_wt'] = best_L1_wt
+    results['validation_scores'] = scores[(scores.alpha == best_alpha) & (scores.L1_wt == best_L1_wt)].score.to_numpy()
+    results['test_score'] = loss(test_fit.predict(__dense__(X_test)), y_test)
+
+    return results, test_fit
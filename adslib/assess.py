@@ -1,62 +1,312 @@
 import numpy as np
 import pandas as pd
+import scipy.sparse
 
-''' Computes the eigenvector decomposition for a given dataset.
-    :param data: Numpy array, containing our data, with columns as the dimensions.
+from .sketch import KLLSketch
+
+''' Private method to merge the statistics of two sets of rows with Chan's parallel algorithm
+    :param first: A (count, mean, scatter) tuple, where the scatter is the sum of outer products of the deviations from the mean
+    :param second: A (count, mean, scatter) tuple
+    :return: The (count, mean, scatter) tuple of the union of the rows
+'''
+def __merge_statistics__(first, second):
+    count_a, mean_a, scatter_a = first
+    count_b, mean_b, scatter_b = second
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    scatter = scatter_a + scatter_b + np.outer(delta, delta) * count_a * count_b / count
+    return count, mean, scatter
+
+''' Private method computing the statistics of a chunk of rows
+    :param chunk: A 2-D array
+    :param dtype: The floating point type of the products
+    :return: A (count, mean, scatter) tuple, in double precision
+'''
+def __chunk_statistics__(chunk, dtype):
+    chunk = np.asarray(chunk, dtype = dtype)
+    mean = chunk.mean(axis = 0, dtype = np.float64)
+    deviations = chunk - mean.astype(dtype)
+    return len(chunk), mean, (deviations.T @ deviations).astype(np.float64)
+
+''' Private method finding the largest eigenvalues of a symmetric matrix with a randomized subspace iteration
+    :param matrix: A symmetric positive semi-definite matrix
+    :param n_components: The number of eigenpairs
+    :param random_state: A seed for the random projection
+    :param oversampling: The number of additional directions in the subspace, improving accuracy
+    :param power_iterations: The number of subspace iterations
+    :return: The eigenvalues and eigenvectors
+'''
+def __randomized_eigh__(matrix, n_components, random_state = None, oversampling = 10, power_iterations = 4):
+    generator = np.random.default_rng(random_state)
+    size = min(len(matrix), n_components + oversampling)
+    basis, _ = np.linalg.qr(matrix @ generator.standard_normal((len(matrix), size)))
+    for _ in range(power_iterations):
+        basis, _ = np.linalg.qr(matrix @ basis)
+    eigen_values, eigen_vectors = np.linalg.eigh(basis.T @ matrix @ basis)
+    return eigen_values, basis @ eigen_vectors
+
+''' Computes the eigenvector decomposition of a dataset given as a sequence of chunks of rows, such as a generator of
+    DataFrames, without holding the full dataset in memory. The mean, variance and covariance are accumulated chunk by chunk.
+    :param chunks: An iterable of 2-D arrays or DataFrames with the same columns
+    :param n_components: The number of principal components to be returned, or None for all of them
+    :param dtype: The floating point type used for the products within a chunk - np.float32 halves memory use and is faster,
+        while the statistics are always merged in double precision
+    :param method: 'full' to compute all eigenpairs, or 'randomized' to only approximate the top n_components ones
+    :param random_state: A seed for the randomized solver
     :return: The eigen-representation, alongside the mean and standard deviation computed per column
 '''
-def compute_pca(data):
-    # Normalize the data before computing the covariance matrix
-    # Normalization
-    data_means = np.mean(data, axis = 0)
-    data_std = np.std(data, axis = 0)
-    data_norm = (data - data_means)/data_std
-    cov_mat = np.cov(data_norm , rowvar = False)
-    eigen_values , eigen_vectors = np.linalg.eigh(cov_mat)
-    
-    sorted_idx = np.argsort(eigen_values)[::-1]
+def compute_pca_streaming(chunks, n_components = None, dtype = np.float64, method = 'full', random_state = None):
+    statistics = None
+    columns = None
+    for chunk in chunks:
+        if isinstance(chunk, pd.DataFrame):
+            columns = chunk.columns
+        if len(chunk) == 0:
+            continue
+        chunk_statistics = __chunk_statistics__(chunk, dtype)
+        statistics = chunk_statistics if statistics is None else __merge_statistics__(statistics, chunk_statistics)
+    if statistics is None:
+        raise ValueError("Cannot compute the PCA of an empty dataset.")
+
+    # The covariance of the normalized data, as computed by np.cov of the standardized rows
+    count, data_means, scatter = statistics
+    data_std = np.sqrt(np.diag(scatter) / count)
+    cov_mat = scatter / (count - 1) / np.outer(data_std, data_std)
+
+    n_components = len(cov_mat) if n_components is None else n_components
+    if method == 'randomized':
+        eigen_values , eigen_vectors = __randomized_eigh__(cov_mat, n_components, random_state = random_state)
+    elif method == 'full':
+        eigen_values , eigen_vectors = np.linalg.eigh(cov_mat)
+    else:
+        raise ValueError("Unknown method '%s', expected 'full' or 'randomized'." % method)
+
+    sorted_idx = np.argsort(eigen_values)[::-1][:n_components]
     sorted_eigenvalues = eigen_values[sorted_idx]
     sorted_eigenvectors = eigen_vectors[:,sorted_idx]
-    
+
+    if columns is not None:
+        data_means = pd.Series(data_means, index = columns)
+        data_std = pd.Series(data_std, index = columns)
     return sorted_eigenvalues, sorted_eigenvectors, data_means, data_std
 
+''' Computes the eigenvector decomposition for a given dataset.
+    The data is processed in chunks of rows, so no normalized copy of the full dataset is made.
+    :param data: Numpy array, containing our data, with columns as the dimensions.
+    :param n_components: The number of principal components to be returned, or None for all of them
+    :param dtype: The floating point type used for the computation, np.float64 or np.float32
+    :param method: 'full' to compute all eigenpairs, or 'randomized' to only approximate the top n_components ones
+    :param chunk_size: The number of rows processed at a time
+    :param random_state: A seed for the randomized solver
+    :return: The eigen-representation, alongside the mean and standard deviation computed per column
+'''
+def compute_pca(data, n_components = None, dtype = np.float64, method = 'full', chunk_size = 100000, random_state = None):
+    chunks = (data[start:start + chunk_size] for start in range(0, len(data), chunk_size))
+    return compute_pca_streaming(chunks, n_components = n_components, dtype = dtype, method = method, random_state = random_state)
+
+
+''' Computes the bounds outside which values are considered outliers by the interquartile range method
+    :param df: The DataFrame containing our data
+    :param list_of_features: A list of features to compute the bounds for
+    :return: A dictionary from feature to a (lower_bound, upper_bound) tuple
+'''
+def outlier_bounds(df, list_of_features):
+    bounds = {}
+    for feature in list_of_features:
+        quantiles = np.quantile(df[feature], [0.25, 0.75])
+        # Calculate the allowed range
+        bounds[feature] = __iqr_bounds__(quantiles[0], quantiles[1])
+    return bounds
+
+''' Private method computing the interquartile range bounds from the quartiles
+    :param first_quartile: The 0.25 quantile
+    :param third_quartile: The 0.75 quantile
+    :return: A (lower_bound, upper_bound) tuple
+'''
+def __iqr_bounds__(first_quartile, third_quartile):
+    iqr = third_quartile - first_quartile
+    return (first_quartile - 1.5*iqr, third_quartile + 1.5*iqr)
+
+''' Summarizes features over a sequence of chunks of rows with quantile sketches, without holding all rows in memory.
+    Sketches built on different partitions, for example in parallel, can be combined with `KLLSketch.merge`.
+    :param chunks: An iterable of DataFrames
+    :param list_of_features: A list of features to be summarized
+    :param k: The accuracy parameter of the sketches, see `sketch.KLLSketch` for the error bound
+    :param random_state: A seed for the sketches
+    :return: A dictionary from feature to KLLSketch
+'''
+def sketch_features(chunks, list_of_features, k = 200, random_state = None):
+    sketches = {feature: KLLSketch(k = k, random_state = random_state) for feature in list_of_features}
+    for chunk in chunks:
+        for feature in list_of_features:
+            sketches[feature].update(chunk[feature].to_numpy(dtype = float))
+    return sketches
+
+''' Computes approximate outlier bounds by the interquartile range method from quantile sketches.
+    The quartiles are within the rank error of the sketches, about 1% of the rows for k = 200.
+    :param sketches: A dictionary from feature to KLLSketch
+    :return: A dictionary from feature to a (lower_bound, upper_bound) tuple, which can be passed to `remove_outliers`
+'''
+def outlier_bounds_from_sketches(sketches):
+    return {feature: __iqr_bounds__(*sketch.quantile([0.25, 0.75])) for feature, sketch in sketches.items()}
+
+''' Computes approximate outlier bounds by the interquartile range method over a sequence of chunks of rows
+    :param chunks: An iterable of DataFrames
+    :param list_of_features: A list of features to compute the bounds for
+    :param k: The accuracy parameter of the sketches, see `sketch.KLLSketch` for the error bound
+    :param random_state: A seed for the sketches
+    :return: A dictionary from feature to a (lower_bound, upper_bound) tuple, which can be passed to `remove_outliers`
+'''
+def outlier_bounds_streaming(chunks, list_of_features, k = 200, random_state = None):
+    return outlier_bounds_from_sketches(sketch_features(chunks, list_of_features, k = k, random_state = random_state))
 
 ''' Removes outliers, based on the interquartile range method along multiple features
     :param df: The DataFrame containing our data
     :param list_of_features: A list of features to consider removing outliers on
+    :param bounds: Previously computed bounds, as returned by `outlier_bounds`, or None to compute them from the data
     :return: Cleaned up data
 '''
-def remove_outliers(df, list_of_features):
+def remove_outliers(df, list_of_features, bounds = None):
+    bounds = outlier_bounds(df, list_of_features) if bounds is None else bounds
     conditions = np.full(len(df), True)
     for feature in list_of_features:
-        quantiles = np.quantile(df[feature], [0.25, 0.75])
-        iqr = quantiles[1] - quantiles[0]
-        # Calculate the allowed range
-        lower_bound = quantiles[0] - 1.5*iqr
-        upper_bound = quantiles[1] + 1.5*iqr
+        lower_bound, upper_bound = bounds[feature]
         # Add the new condition to the global one
         conditions = conditions & ((df[feature] <= upper_bound) & (df[feature] >= lower_bound))
     return df[conditions]
 
+''' Removes outliers of a feature using separate bounds for each group of rows, such as the ones computed in the database
+    by `access_load.get_outlier_bounds`. Rows of groups without bounds are kept.
+    :param df: The DataFrame containing our data
+    :param feature: The feature to consider removing outliers on
+    :param groups: A Series with the group of each row, with the same index as the DataFrame
+    :param bounds: A DataFrame with 'group', 'lower_bound' and 'upper_bound' columns
+    :return: Cleaned up data
+'''
+def remove_outliers_by_group(df, feature, groups, bounds):
+    bounds = bounds.set_index('group')
+    lower_bound = groups.map(bounds['lower_bound']).fillna(-np.inf)
+    upper_bound = groups.map(bounds['upper_bound']).fillna(np.inf)
+    return df[(df[feature] >= lower_bound) & (df[feature] <= upper_bound)]
+
 ''' One-Hot encodes a particular feature.
+    The encoding columns are joined to the data in a single concatenation, so that the result is not fragmented
+    for features with many values. The input DataFrame is left unchanged.
     :param df: The DataFrame containing our data
     :param feature: The feature to encode
-    :return: The DataFrame with the new columns, corresponding to the encoding
+    :param categories: The values to be encoded, or None to use all values in the data
+    :return: A new DataFrame, with the columns of the data followed by the columns of the encoding
 '''
-def do_one_hot_encoding(df, feature):
+def do_one_hot_encoding(df, feature, categories = None):
+    categories = df[feature].unique() if categories is None else categories
     # For each feature value, creates a new column with the encoding
-    for feature_type in df[feature].unique():
-        encoding_name = 'is_' + str(feature) + '_' + str(feature_type)
-        df[encoding_name] = np.where(df[feature] == feature_type, 1, 0)
-    return df
+    encoding = pd.DataFrame({'is_' + str(feature) + '_' + str(feature_type): np.where(df[feature] == feature_type, 1, 0)
+                             for feature_type in categories}, index = df.index)
+    return pd.concat([df.drop(columns = [column for column in encoding.columns if column in df.columns]), encoding], axis = 1)
 
 ''' Imputes missing value based on median
     :param df: The DataFrame containing our data
     :param list_of_features: A list of features to consider for imputation
+    :param means: A dictionary of previously computed means for each feature, or None to compute them from the data
     :return: The DataFrame with the required values imputed
 '''
-def mean_imputer(df, list_of_features):
+def mean_imputer(df, list_of_features, means = None):
     for feature in list_of_features:
-        mean = df[feature].mean()
+        mean = df[feature].mean() if means is None else means[feature]
         df[feature] = np.where(df[feature].isna(), mean, df[feature])
-    return df
\ No newline at end of file
+    return df
+
+''' A preprocessing pipeline, which learns the imputation means, the outlier bounds and the one-hot encoded categories
+    once from training data, and applies them unchanged to any later data, such as a test set or chunks of a larger dataset.
+    The output is a design matrix, which can be passed to `address.cross_validation_train`.
+    :param numeric_features: The features used as they are, after imputing missing values with their mean
+    :param categorical_features: The features to be one-hot encoded. Values not seen during fitting get no encoding column
+    :param outlier_features: The features on which rows with outliers, by the interquartile range method, are removed
+    :param sparse: Whether to output a SciPy CSR matrix, which stores the one-hot encoding compactly, or a dense NumPy array
+    :param dtype: The type of the design matrix
+    :param add_constant: Whether to add a constant column, as the first column of the design matrix
+'''
+class Preprocessor:
+    def __init__(self, numeric_features, categorical_features = [], outlier_features = [], sparse = True, dtype = np.float64,
+                 add_constant = False):
+        self.numeric_features = list(numeric_features)
+        self.categorical_features = list(categorical_features)
+        self.outlier_features = list(outlier_features)
+        self.sparse = sparse
+        self.dtype = dtype
+        self.add_constant = add_constant
+        self.means = None
+        self.bounds = None
+        self.categories = None
+
+    ''' Learns the means, the outlier bounds and the categories. The bounds are computed after imputation,
+        and the categories after removing outliers, as in the transformation.
+        :param df: The DataFrame containing the training data
+        :return: The fitted Preprocessor
+    '''
+    def fit(self, df):
+        df = df[self.__columns__()].copy()
+        self.means = {feature: df[feature].mean() for feature in self.numeric_features}
+        df = mean_imputer(df, self.numeric_features, means = self.means)
+        self.bounds = outlier_bounds(df, self.outlier_features)
+        df = remove_outliers(df, self.outlier_features, bounds = self.bounds)
+        self.categories = {feature: [value for value in df[feature].unique() if not pd.isna(value)] for feature in self.categorical_features}
+        return self
+
+    ''' The names of the columns of the design matrix
+    '''
+    @property
+    def feature_names(self):
+        names = ['const'] if self.add_constant else []
+        names += self.numeric_features
+        for feature in self.categorical_features:
+            names += ['is_' + str(feature) + '_' + str(feature_type) for feature_type in self.categories[feature]]
+        return names
+
+    ''' Applies the learned preprocessing to new data: imputes missing values, removes the rows with outliers,
+        and builds the design matrix
+        :param df: The DataFrame containing the data
+        :param target: The name of a column to be returned alongside the design matrix, with the same rows kept
+        :param drop_outliers: Whether to remove the rows with outliers. When scoring new data, all rows are usually kept,
+            and the outlier features, such as the price, do not need to be present
+        :return: The design matrix, or the design matrix and the target values if a target is given
+    '''
+    def transform(self, df, target = None, drop_outliers = True):
+        if self.means is None:
+            raise ValueError("The Preprocessor has to be fitted before transforming data.")
+        columns = self.__columns__() if drop_outliers else list(dict.fromkeys(self.numeric_features + self.categorical_features))
+        columns = columns + ([target] if target is not None and target not in columns else [])
+        df = mean_imputer(df[columns].copy(), self.numeric_features, means = self.means)
+        if drop_outliers:
+            df = remove_outliers(df, self.outlier_features, bounds = self.bounds)
+
+        blocks = []
+        if self.add_constant:
+            blocks.append(np.ones((len(df), 1), dtype = self.dtype))
+        blocks.append(df[self.numeric_features].to_numpy(dtype = self.dtype))
+        for feature in self.categorical_features:
+            codes = pd.Categorical(df[feature], categories = self.categories[feature]).codes
+            rows = np.flatnonzero(codes >= 0)
+            encoding = scipy.sparse.csr_matrix((np.ones(len(rows), dtype = self.dtype), (rows, codes[rows])),
+                                               shape = (len(df), len(self.categories[feature])))
+            blocks.append(encoding if self.sparse else encoding.toarray())
+
+        if self.sparse:
+            design_matrix = scipy.sparse.hstack([scipy.sparse.csr_matrix(block) for block in blocks], format = 'csr', dtype = self.dtype)
+        else:
+            design_matrix = np.hstack(blocks)
+        if target is None:
+            return design_matrix
+        return design_matrix, df[target].to_numpy()
+
+    ''' Learns the preprocessing from the data and applies it
+        :param df: The DataFrame containing the training data
+        :param target: The name of a column to be returned alongside the design matrix
+        :return: The design matrix, or the design matrix and the target values if a target is given
+    '''
+    def fit_transform(self, df, target = None):
+        return self.fit(df).transform(df, target = target)
+
+    def __columns__(self):
+        return list(dict.fromkeys(self.numeric_features + self.categorical_features + self.outlier_features))
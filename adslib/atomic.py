@@ -0,0 +1,31 @@
+import os
+import json
+import threading
+
+''' Private method returning a temporary file next to a file, unique to the process and the thread writing it,
+    so that concurrent writers of the same file never write to the same temporary file
+    :param file_location: The location of the file
+    :return: The location of the temporary file
+'''
+def __temporary_file__(file_location):
+    return '%s.%d-%d.tmp' % (file_location, os.getpid(), threading.get_ident())
+
+''' Writes a DataFrame as Parquet atomically, so that an interrupted write does not leave a partial file behind,
+    and readers see either the previous file or the new one
+    :param frame: The DataFrame
+    :param file_location: The location of the file
+'''
+def write_parquet(frame, file_location):
+    temporary_file = __temporary_file__(file_location)
+    frame.to_parquet(temporary_file)
+    os.replace(temporary_file, file_location)
+
+''' Writes a value as a JSON file atomically
+    :param value: The value to be stored
+    :param file_location: The location of the file
+'''
+def write_json(value, file_location):
+    temporary_file = __temporary_file__(file_location)
+    with open(temporary_file, 'w') as file:
+        json.dump(value, file)
+    os.replace(temporary_file, file_location)
@@ -0,0 +1,687 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import sqlite3
+import subprocess
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+from . import access_load
+from . import access_store
+from . import assess
+from . import address
+from . import load_from_osm
+from .access_store import create_spatial_index
+from .osm_extract import ExtractGeometrySource
+
+''' Creates a scratch database and switches the connection to it, so that synthetic tables do not overwrite real data
+    :param conn: A pymysql connection
+    :param database: The name of the scratch database
+'''
+def use_scratch_database(conn, database = 'adslib_benchmark'):
+    cur = conn.cursor()
+    cur.execute('CREATE DATABASE IF NOT EXISTS `' + database + '`')
+    cur.execute('USE `' + database + '`')
+    cur.close()
+
+''' Private method to insert rows in batches
+    :param conn: A pymysql connection to a database
+    :param table_name: The name of the table
+    :param frame: A DataFrame with the columns of the table, in order
+    :param batch_size: The number of rows inserted at a time
+'''
+def __insert_frame__(conn, table_name, frame, batch_size):
+    query = 'INSERT INTO `' + table_name + '` VALUES (' + ', '.join(['%s'] * len(frame.columns)) + ')'
+    cur = conn.cursor()
+    for start in range(0, len(frame), batch_size):
+        rows = frame.iloc[start:start + batch_size].astype(object).to_numpy().tolist()
+        cur.executemany(query, rows)
+        conn.commit()
+    cur.close()
+
+# Postcode areas used for the synthetic postcodes
+__POSTCODE_AREAS__ = ['AB', 'B', 'BS', 'CB', 'CF', 'E', 'G', 'L', 'LS', 'M', 'N', 'NE', 'NW', 'OX', 'S', 'SE', 'SW', 'W', 'WC', 'YO']
+
+# The bounds of Great Britain, as (north, south, east, west)
+__GREAT_BRITAIN__ = (58.5, 50.0, 1.7, -5.5)
+
+''' Generates synthetic transactions and postcodes with the columns of the `pp_data` and `postcode_data` tables,
+    the `db_id` key being the last column
+    :param rows: The number of transactions
+    :param postcodes: The number of postcodes, by default one per 20 transactions
+    :param bounds: The (north, south, east, west) box in which postcodes are placed uniformly, by default Great Britain
+    :param seed: The seed of the generator
+    :return: The transactions and the postcodes, as two DataFrames
+'''
+def synthetic_price_data(rows, postcodes = None, bounds = __GREAT_BRITAIN__, seed = 0):
+    generator = np.random.default_rng(seed)
+    postcodes = max(1, rows // 20) if postcodes is None else postcodes
+    north, south, east, west = bounds
+
+    codes = np.array(['%s%d %d%s%s' % (__POSTCODE_AREAS__[i % len(__POSTCODE_AREAS__)], (i // len(__POSTCODE_AREAS__)) % 99 + 1,
+                                       (i // 1980) % 10, chr(65 + (i // 19800) % 26), chr(65 + (i // 514800) % 26))
+                      for i in range(postcodes)])
+    postcode_frame = pd.DataFrame({'postcode': codes,
+                                   'country': 'England',
+                                   'lattitude': generator.uniform(south, north, postcodes).round(6),
+                                   'longitude': generator.uniform(west, east, postcodes).round(6),
+                                   'db_id': np.arange(1, postcodes + 1)})
+
+    dates = np.datetime64('1995-01-01') + generator.integers(0, 28 * 365, rows).astype('timedelta64[D]')
+    price_frame = pd.DataFrame({'transaction_unique_identifier': ['{%032X}' % i for i in range(rows)],
+                                'price': generator.lognormal(12, 0.6, rows).astype(int),
+                                'date_of_transfer': dates.astype(str),
+                                'postcode': codes[generator.integers(0, postcodes, rows)],
+                                'property_type': generator.choice(list('DSTFO'), rows),
+                                'new_build_flag': generator.choice(list('YN'), rows),
+                                'tenure_type': generator.choice(list('FL'), rows),
+                                'locality': 'LOCALITY',
+                                'town_city': 'TOWN',
+                                'district': 'DISTRICT',
+                                'county': 'COUNTY',
+                                'db_id': np.arange(1, rows + 1)})
+    return price_frame, postcode_frame
+
+''' Writes synthetic transactions and postcodes as csv files, which can be loaded with `access_store.save_local_data_in_table`
+    :param directory: The folder in which the files are written
+    :param rows: The number of transactions
+    :param postcodes: The number of postcodes, by default one per 20 transactions
+    :param bounds: The (north, south, east, west) box in which postcodes are placed uniformly, by default Great Britain
+    :param seed: The seed of the generator
+    :return: The locations of the `pp_data` and `postcode_data` files
+'''
+def write_synthetic_price_csvs(directory, rows, postcodes = None, bounds = __GREAT_BRITAIN__, seed = 0):
+    os.makedirs(directory, exist_ok = True)
+    files = []
+    for name, frame in zip(['pp_data', 'postcode_data'], synthetic_price_data(rows, postcodes = postcodes, bounds = bounds, seed = seed)):
+        files.append(os.path.join(directory, name + '.csv'))
+        frame.drop(columns = 'db_id').to_csv(files[-1], index = False)
+    return files[0], files[1]
+
+''' Generates synthetic OSM buildings and POIs inside a box, in the format returned by osmnx
+    (indexed by element type and OSM id, with one column per tag key).
+    Buildings are small squares with an address, and POIs are points with an 'amenity' tag.
+    :param north: The north edge of the box
+    :param south: The south edge of the box
+    :param east: The east edge of the box
+    :param west: The west edge of the box
+    :param buildings: The number of buildings
+    :param pois: The number of POIs
+    :param seed: The seed of the generator
+    :return: A GeoDataFrame of features
+'''
+def synthetic_osm_features(north, south, east, west, buildings = 10000, pois = 1000, seed = 0):
+    generator = np.random.default_rng(seed)
+    size = 0.0001
+    building_x = generator.uniform(west, east, buildings)
+    building_y = generator.uniform(south, north, buildings)
+    building_frame = gpd.GeoDataFrame({'building': generator.choice(['house', 'residential', 'detached', 'yes'], buildings),
+                                       'addr:housenumber': (generator.integers(1, 200, buildings)).astype(str),
+                                       'addr:street': ['STREET %d' % i for i in generator.integers(0, max(1, buildings // 50), buildings)]},
+                                      geometry = [box(x, y, x + size, y + size) for x, y in zip(building_x, building_y)], crs = 4326,
+                                      index = pd.MultiIndex.from_arrays([['way'] * buildings, np.arange(buildings)], names = ['element_type', 'osmid']))
+    poi_frame = gpd.GeoDataFrame({'amenity': generator.choice(['school', 'hospital', 'restaurant', 'pub', 'place_of_worship'], pois)},
+                                 geometry = gpd.points_from_xy(generator.uniform(west, east, pois), generator.uniform(south, north, pois)), crs = 4326,
+                                 index = pd.MultiIndex.from_arrays([['node'] * pois, np.arange(pois)], names = ['element_type', 'osmid']))
+    return pd.concat([building_frame, poi_frame])
+
+''' Creates an offline geometry source, which answers the osmnx-style queries from synthetic features instead of Overpass.
+    It can be passed to `load_from_osm.set_geometry_source`.
+    :param north: The north edge of the box covered by the features
+    :param south: The south edge of the box
+    :param east: The east edge of the box
+    :param west: The west edge of the box
+    :param buildings: The number of buildings
+    :param pois: The number of POIs
+    :param seed: The seed of the generator
+    :return: An ExtractGeometrySource
+'''
+def stub_geometry_source(north, south, east, west, buildings = 10000, pois = 1000, seed = 0):
+    return ExtractGeometrySource(synthetic_osm_features(north, south, east, west, buildings = buildings, pois = pois, seed = seed))
+
+''' Generates a synthetic `pp_data` and `postcode_data` pair in a MariaDB database, with the layout of the real tables
+    (the `db_id` key being the last column), with the postcodes spread uniformly over Great Britain.
+    The tables get the indexes of the real ones, on the postcode and the date of transfer, but no spatial index.
+    The connection is always switched to a scratch database first (see `use_scratch_database`), so that the real tables are never dropped.
+    :param conn: A pymysql connection
+    :param rows: The number of transactions
+    :param postcodes: The number of postcodes, by default one per 20 transactions
+    :param seed: The seed of the generator
+    :param batch_size: The number of rows inserted at a time
+    :param database: The name of the scratch database
+'''
+def create_synthetic_price_tables(conn, rows = 3000000, postcodes = None, seed = 0, batch_size = 50000, database = 'adslib_benchmark'):
+    use_scratch_database(conn, database)
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS `pp_data`')
+    cur.execute('DROP TABLE IF EXISTS `postcode_data`')
+    cur.execute('''CREATE TABLE `pp_data` (
+                   transaction_unique_identifier tinytext COLLATE utf8_bin NOT NULL,
+                   price int(10) unsigned NOT NULL,
+                   date_of_transfer date NOT NULL,
+                   postcode varchar(8) COLLATE utf8_bin NOT NULL,
+                   property_type varchar(1) COLLATE utf8_bin NOT NULL,
+                   new_build_flag varchar(1) COLLATE utf8_bin NOT NULL,
+                   tenure_type varchar(1) COLLATE utf8_bin NOT NULL,
+                   locality tinytext COLLATE utf8_bin NOT NULL,
+                   town_city tinytext COLLATE utf8_bin NOT NULL,
+                   district tinytext COLLATE utf8_bin NOT NULL,
+                   county tinytext COLLATE utf8_bin NOT NULL,
+                   db_id bigint(20) unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY)''')
+    cur.execute('''CREATE TABLE `postcode_data` (
+                   postcode varchar(8) COLLATE utf8_bin NOT NULL,
+                   country enum('England', 'Wales', 'Scotland', 'Northern Ireland', 'Channel Islands', 'Isle of Man') NOT NULL,
+                   lattitude decimal(11,8) NOT NULL,
+                   longitude decimal(10,8) NOT NULL,
+                   db_id bigint(20) unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY)''')
+    conn.commit()
+    cur.close()
+
+    price_frame, postcode_frame = synthetic_price_data(rows, postcodes = postcodes, seed = seed)
+    __insert_frame__(conn, 'postcode_data', postcode_frame, batch_size)
+    __insert_frame__(conn, 'pp_data', price_frame, batch_size)
+
+    cur = conn.cursor()
+    cur.execute('CREATE INDEX pp_postcode USING HASH ON pp_data (postcode)')
+    cur.execute('CREATE INDEX pp_date USING HASH ON pp_data (date_of_transfer)')
+    cur.execute('CREATE INDEX po_postcode USING HASH ON postcode_data (postcode)')
+    conn.commit()
+    cur.close()
+
+''' Private cursor of a SQLiteConnection, translating the MariaDB statements used by adslib into SQLite ones
+'''
+class __SQLiteCursor__:
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.database.cursor()
+        self.description = None
+        self.rowcount = -1
+        self.__rows__ = None
+
+    def execute(self, query, args = None):
+        query, args = self.connection.translate(query, args)
+        self.__rows__ = None
+        if query.startswith('SHOW GLOBAL VARIABLES') or query.startswith('SHOW VARIABLES'):
+            self.__rows__ = []
+            return 0
+        match = re.match(r'SHOW COLUMNS FROM (\w+)', query)
+        if match:
+            self.cursor.execute('PRAGMA table_info(%s)' % match.group(1))
+            self.__rows__ = [(row[1], row[2]) for row in self.cursor.fetchall()]
+            return len(self.__rows__)
+        match = re.match(r'ALTER TABLE (\w+) (.*)$', query, re.S)
+        if match:
+            return self.__alter__(match.group(1), match.group(2))
+        self.connection.reset_random()
+        self.cursor.execute(query, args)
+        self.description = self.cursor.description
+        self.rowcount = self.cursor.rowcount
+        match = re.match(r'CREATE TABLE (\w+) AS', query)
+        if match:
+            # SQLite does not report the rows of a CREATE TABLE ... AS SELECT
+            self.cursor.execute('SELECT COUNT(*) FROM ' + match.group(1))
+            self.rowcount = self.cursor.fetchone()[0]
+        return self.rowcount
+
+    ''' Private method running the clauses of an ALTER TABLE statement. Column types are not changed, indexes are created
+        as ordinary indexes, and an auto-increment primary key is added by copying the table.
+    '''
+    def __alter__(self, table_name, clauses):
+        depth, start, split = 0, 0, []
+        for i, character in enumerate(clauses + ','):
+            depth += {'(': 1, ')': -1}.get(character, 0)
+            if character == ',' and depth == 0:
+                split.append(clauses[start:i].strip())
+                start = i + 1
+        for clause in sorted(split, key = lambda clause: 'PRIMARY KEY' not in clause):
+            index = re.match(r'ADD (?:SPATIAL )?INDEX (\w+) (\(.*\))$', clause)
+            key = re.match(r'ADD (\w+) .*AUTO_INCREMENT PRIMARY KEY$', clause)
+            if index:
+                self.cursor.execute('CREATE INDEX %s_%s ON %s %s' % (table_name, index.group(1), table_name, index.group(2)))
+            elif key:
+                self.cursor.execute('PRAGMA table_info(%s)' % table_name)
+                columns = ', '.join(row[1] for row in self.cursor.fetchall())
+                self.cursor.execute('CREATE TABLE %s_copy (%s, %s INTEGER PRIMARY KEY AUTOINCREMENT)' % (table_name, columns, key.group(1)))
+                self.cursor.execute('INSERT INTO %s_copy (%s) SELECT %s FROM %s' % (table_name, columns, columns, table_name))
+                self.cursor.execute('DROP TABLE ' + table_name)
+                self.cursor.execute('ALTER TABLE %s_copy RENAME TO %s' % (table_name, table_name))
+            elif not clause.startswith('MODIFY '):
+                raise ValueError('Unsupported ALTER TABLE clause: ' + clause)
+        self.rowcount = 0
+        return 0
+
+    def executemany(self, query, rows):
+        query, _ = self.connection.translate(query, None)
+        self.cursor.executemany(query.replace('%s', '?'), ([__sqlite_value__(value) for value in row] for row in rows))
+        self.rowcount = self.cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        if self.__rows__ is not None:
+            return self.__rows__.pop(0) if len(self.__rows__) > 0 else None
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return tuple(self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        if self.__rows__ is not None:
+            rows, self.__rows__ = self.__rows__, []
+            return tuple(rows)
+        return tuple(self.cursor.fetchall())
+
+    def close(self):
+        self.cursor.close()
+
+''' An offline stand-in for a MariaDB connection, backed by an SQLite database, which runs the `access_store` loading
+    and the `access_load` queries without a server. The statements are translated: parameters are converted to the SQLite
+    style, RAND is provided, SHOW COLUMNS is answered from the table schema, and LOAD DATA is reported as unavailable.
+    Points are stored as WKT text, POINT, ST_GeomFromText and MBRIntersects are provided, and spatial indexes are created
+    as ordinary ones. Statements relying on other MariaDB-only features, such as PERCENTILE_CONT, are not supported.
+    :param database: The SQLite database file, by default an in-memory database
+'''
+class SQLiteConnection:
+    def __init__(self, database = ':memory:'):
+        self.database = sqlite3.connect(database, check_same_thread = False)
+        self.db = database
+        self.__generators__ = {}
+        self.database.create_function('RAND', -1, self.__random__)
+        self.database.create_function('POINT', 2, lambda x, y: None if x is None or y is None else 'POINT(%r %r)' % (x, y))
+        self.database.create_function('ST_GeomFromText', 1, lambda text: text)
+        self.database.create_function('MBRIntersects', 2, __bounding_boxes_intersect__)
+
+    def cursor(self, *args):
+        return __SQLiteCursor__(self)
+
+    def commit(self):
+        self.database.commit()
+
+    def rollback(self):
+        self.database.rollback()
+
+    def close(self):
+        self.database.close()
+
+    def reset_random(self):
+        self.__generators__ = {}
+
+    ''' Translates a MariaDB statement and its parameters into SQLite
+        :param query: The statement
+        :param args: The parameters, as a dictionary, a sequence or None
+        :return: The translated statement and parameters
+    '''
+    def translate(self, query, args):
+        query = query.replace('`', '').replace(' ENGINE = InnoDB', '').replace(' unsigned', '').strip()
+        query = query.replace("information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+                              "sqlite_master WHERE type = 'table' AND name = %s")
+        if isinstance(args, dict):
+            query = re.sub(r'%\((\w+)\)s', r':\1', query)
+            args = {key: __sqlite_value__(value) for key, value in args.items()}
+        elif args is not None:
+            query = query.replace('%s', '?')
+            args = [__sqlite_value__(value) for value in args]
+        return query, args if args is not None else ()
+
+    def __random__(self, seed = None):
+        if seed is None:
+            return random.random()
+        return self.__generators__.setdefault(seed, random.Random(seed)).random()
+
+''' Private method checking whether the bounding boxes of two WKT geometries intersect, as MBRIntersects does
+    :return: 1 if they intersect, 0 otherwise
+'''
+def __bounding_boxes_intersect__(first, second):
+    if first is None or second is None:
+        return None
+    boxes = []
+    for text in [first, second]:
+        coordinates = np.array(re.findall(r'-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?', text), dtype = float).reshape(-1, 2)
+        boxes.append((coordinates.min(axis = 0), coordinates.max(axis = 0)))
+    (first_min, first_max), (second_min, second_max) = boxes
+    return int(bool(np.all(first_min <= second_max) and np.all(second_min <= first_max)))
+
+''' Private method converting the dates used as query parameters, such as '2020/1/1', into the ISO format stored by SQLite,
+    and NumPy scalars into Python ones
+    :param value: A parameter
+    :return: The converted parameter
+'''
+def __sqlite_value__(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, str) and re.match(r'^\d{4}/\d{1,2}/\d{1,2}$', value):
+        year, month, day = value.split('/')
+        return '%s-%02d-%02d' % (year, int(month), int(day))
+    return value
+
+''' Creates the `pp_data` and `postcode_data` tables in a SQLiteConnection, with the same columns as the real ones
+    :param conn: A SQLiteConnection
+'''
+def create_local_price_tables(conn):
+    cur = conn.cursor()
+    for table_name, frame in zip(['pp_data', 'postcode_data'], synthetic_price_data(1)):
+        cur.execute('DROP TABLE IF EXISTS ' + table_name)
+        # Keys are never reused after a deletion, as with the AUTO_INCREMENT keys of MariaDB
+        columns = ', '.join(column + (' INTEGER PRIMARY KEY AUTOINCREMENT' if column == 'db_id' else '') for column in frame.columns)
+        cur.execute('CREATE TABLE ' + table_name + ' (' + columns + ')')
+    cur.execute('CREATE INDEX pp_postcode ON pp_data (postcode)')
+    cur.execute('CREATE INDEX pp_date ON pp_data (date_of_transfer)')
+    cur.execute('CREATE INDEX po_postcode ON postcode_data (postcode)')
+    conn.commit()
+    cur.close()
+
+''' Private wrapper around a connection, recording the statements executed through its cursors
+'''
+class __RecordingConnection__:
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def cursor(self, *args):
+        cursor = self.conn.cursor(*args)
+        execute = cursor.execute
+
+        def recording_execute(query, args = None):
+            self.statements.append((query, args))
+            return execute(query, args)
+        cursor.execute = recording_execute
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+''' Compares the plan and latency of the coordinate price queries with and without the spatial index.
+    The spatial index is created first if needed. Results are not cached, so that every repetition reaches the server.
+    :param conn: A pymysql connection to a database containing `pp_data` and `postcode_data`
+    :param boxes: A list of (north, east, south, west) boxes, by default boxes of increasing size around London
+    :param radii: A list of radii in metres, queried around the centre of the first box
+    :param start_year: The first year of the queries
+    :param end_year: The last year of the queries
+    :param limit: The number of sampled rows
+    :param repeats: The number of timed repetitions of every query
+    :param build_index: Whether to (re)build the spatial index before running the queries
+    :return: A DataFrame with one row per query and variant, with the median latency, the number of rows and the EXPLAIN output
+'''
+def benchmark_coordinate_queries(conn, boxes = None, radii = [500, 2000], start_year = 1995, end_year = 2022, limit = 100,
+                                 repeats = 3, build_index = True):
+    if boxes is None:
+        boxes = [(51.51 + size, -0.13 + size, 51.51 - size, -0.13 - size) for size in (0.005, 0.02, 0.1)]
+    if build_index:
+        create_spatial_index(conn)
+
+    box_query = access_load.get_price_coord_data_between_years_for_coordinate_area.__wrapped__
+    radius_query = access_load.get_price_coord_data_between_years_within_radius.__wrapped__
+    recorder = __RecordingConnection__(conn)
+    north, east, south, west = boxes[0]
+    queries = [('box', str(edges), lambda use, edges = edges: box_query(recorder, *edges, start_year, end_year, limit,
+                                                                        use_spatial_index = use))
+               for edges in boxes]
+    queries += [('radius', str(radius), lambda use, radius = radius: radius_query(recorder, (north + south) / 2, (east + west) / 2, radius,
+                                                                                  start_year, end_year, limit, use_spatial_index = use))
+                for radius in radii]
+
+    results = []
+    for kind, description, query in queries:
+        for use_spatial_index in (False, True):
+            recorder.statements = []
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                rows = query(use_spatial_index)
+                timings.append(time.perf_counter() - start)
+            statement, args = recorder.statements[-1]
+            cur = conn.cursor()
+            cur.execute('EXPLAIN ' + statement, args)
+            plan = cur.fetchall()
+            cur.close()
+            results.append({'query': kind, 'parameters': description, 'spatial_index': use_spatial_index,
+                            'median_seconds': float(np.median(timings)), 'rows': len(rows), 'plan': plan})
+    return pd.DataFrame(results)
+
+''' Compares the outlier bounds computed with quantile sketches over chunks against the exact bounds, on synthetic prices.
+    It checks the documented error of `sketch.KLLSketch`: the exact rank of each estimated quartile should be within
+    about 1.7 / k of the requested one.
+    :param rows: The number of synthetic prices
+    :param chunk_size: The number of rows in each chunk
+    :param k: The accuracy parameter of the sketches
+    :param seed: The seed of the generator
+    :return: A dictionary with the exact and approximate bounds, the rank error of the quartiles, and the time taken by each method
+'''
+def benchmark_quantile_sketch(rows = 1000000, chunk_size = 100000, k = 200, seed = 0):
+    generator = np.random.default_rng(seed)
+    data = pd.DataFrame({'price': generator.lognormal(12, 0.6, rows)})
+    chunks = [data.iloc[start:start + chunk_size] for start in range(0, rows, chunk_size)]
+
+    start = time.perf_counter()
+    exact = assess.outlier_bounds(data, ['price'])['price']
+    exact_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    sketches = assess.sketch_features(chunks, ['price'], k = k, random_state = seed)
+    approximate = assess.outlier_bounds_from_sketches(sketches)['price']
+    sketch_seconds = time.perf_counter() - start
+
+    quartiles = sketches['price'].quantile([0.25, 0.75])
+    ranks = np.searchsorted(np.sort(data.price.to_numpy()), quartiles, side = 'right') / rows
+    return {'exact_bounds': exact, 'approximate_bounds': approximate,
+            'rank_error': float(np.max(np.abs(ranks - [0.25, 0.75]))), 'error_bound': 1.7 / k,
+            'exact_seconds': exact_seconds, 'sketch_seconds': sketch_seconds}
+
+# The box of the synthetic OSM features, around Cambridge
+__OSM_BOX__ = (52.25, 52.15, 0.2, 0.05)
+
+# The input sizes of the benchmark suite
+__SIZES__ = [10000, 30000, 100000]
+
+''' Private method timing a function, keeping the best of several runs, and measuring its peak memory in a separate traced run
+    :param function: A function without arguments
+    :param repeats: The number of timed runs
+    :return: A dictionary with the time in seconds and the peak memory allocated in bytes
+'''
+def __measure__(function, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(seconds), 'peak_bytes': peak}
+
+''' Private method estimating how the cost of a benchmark grows with the input size, as the slope of a least squares fit
+    in log-log space: 1 is linear, 2 is quadratic
+    :param sizes: The input sizes
+    :param values: The measured costs
+    :return: The exponent, or None with fewer than two sizes
+'''
+def __scaling_exponent__(sizes, values):
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(np.maximum(values, 1e-9)), 1)[0])
+
+''' Private method building a local database holding synthetic `pp_data` and `postcode_data` tables
+    :param directory: The folder in which the csv files are written
+    :param rows: The number of transactions
+    :param seed: The seed of the generator
+    :return: A SQLiteConnection and the locations of the csv files
+'''
+def __local_price_database__(directory, rows, seed):
+    files = write_synthetic_price_csvs(directory, rows, bounds = __OSM_BOX__, seed = seed)
+    conn = SQLiteConnection()
+    create_local_price_tables(conn)
+    return conn, files
+
+''' Private method running the benchmarks of one input size
+    :param size: The number of rows
+    :param repeats: The number of timed runs of each benchmark
+    :param seed: The seed of the generators
+    :return: A dictionary from benchmark name to its measurements
+'''
+def __run_size__(size, repeats, seed):
+    results = {}
+    north, south, east, west = __OSM_BOX__
+    with tempfile.TemporaryDirectory() as directory:
+        conn, (price_file, postcode_file) = __local_price_database__(directory, size, seed)
+        results['save_local_data_in_table'] = __measure__(
+            lambda: (access_store.save_local_data_in_table(conn, 'postcode_data', postcode_file, method = 'chunked'),
+                     access_store.save_local_data_in_table(conn, 'pp_data', price_file, method = 'chunked')), repeats)
+
+        # The undecorated queries are timed, so that the query cache does not hide the cost of the database
+        queries = {'get_price_coord_data_between_years': lambda: access_load.get_price_coord_data_between_years.__wrapped__(
+                       conn, 2000, 2010, limit = 1000, seed = seed),
+                   'get_price_coord_data_between_years_for_area': lambda: access_load.get_price_coord_data_between_years_for_area.__wrapped__(
+                       conn, 'CB', 2000, 2010, limit = 1000, seed = seed),
+                   'get_price_coord_data_between_years_for_coordinate_area': lambda: access_load.get_price_coord_data_between_years_for_coordinate_area.__wrapped__(
+                       conn, 52.22, 0.15, 52.18, 0.1, 2000, 2010, limit = 1000, seed = seed),
+                   'get_price_coord_data_between_years_within_radius': lambda: access_load.get_price_coord_data_between_years_within_radius.__wrapped__(
+                       conn, 52.2, 0.12, 2000, 2000, 2010, limit = 1000, seed = seed),
+                   'get_price_coord_frame_between_years': lambda: access_load.get_price_coord_frame_between_years.__wrapped__(
+                       conn, 2000, 2010)}
+        for name, query in queries.items():
+            results[name] = __measure__(query, repeats)
+        conn.close()
+
+    generator = np.random.default_rng(seed)
+    building_data = pd.DataFrame({'latitude': generator.uniform(south, north, size), 'longitude': generator.uniform(west, east, size)})
+    previous = load_from_osm.set_geometry_source(stub_geometry_source(north, south, east, west, buildings = size,
+                                                                      pois = max(1, size // 10), seed = seed))
+    try:
+        results['extract_osm_building_features'] = __measure__(
+            lambda: load_from_osm.extract_osm_building_features(building_data), repeats)
+        results['extract_distance_to_closest_feature_in_box'] = __measure__(
+            lambda: load_from_osm.extract_distance_to_closest_feature_in_box(building_data, {'amenity': 'school'}), repeats)
+    finally:
+        load_from_osm.set_geometry_source(previous)
+
+    features = generator.normal(size = (size, 20))
+    target = features @ generator.normal(size = 20) + generator.normal(size = size)
+    results['compute_pca'] = __measure__(lambda: assess.compute_pca(features), repeats)
+    results['cross_validation_train'] = __measure__(
+        lambda: address.cross_validation_train(features, target, [0.6, 0.2, 0.2], alpha = 0.1, random_state = seed), repeats)
+    return results
+
+# The heavy dependencies which a module may load on import, for the lightweight entry points of the library, its import time,
+# and the resident memory it may add to that of a bare interpreter. The loaded modules are what matters, and do not depend on
+# the machine, so the time is not checked and the memory budget leaves room for other interpreters and allocators.
+__IMPORT_BUDGETS__ = {'adslib': {'allowed': [], 'seconds': None, 'rss_megabytes': 8},
+                      'adslib.access_load': {'allowed': ['pymysql'], 'seconds': None, 'rss_megabytes': 32}}
+
+# The dependencies reported as heavy by the import measurement
+__HEAVY_MODULES__ = ['numpy', 'pandas', 'scipy', 'geopandas', 'shapely', 'osmnx', 'statsmodels', 'sklearn', 'pymysql', 'yaml']
+
+# Measures the import of a module in a fresh interpreter, printing the time, the peak resident memory and the heavy modules loaded
+__IMPORT_SCRIPT__ = """
+import sys, json, time, resource, importlib
+start = time.perf_counter()
+if sys.argv[1] != '':
+    importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+# On Linux, ru_maxrss is inherited from the parent process across exec, unlike the high water mark of /proc
+try:
+    with open('/proc/self/status') as file:
+        peak = [int(line.split()[1]) * 1024 for line in file if line.startswith('VmHWM')][0]
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(json.dumps({'seconds': seconds, 'peak_rss_bytes': peak,
+                  'heavy_modules': [name for name in json.loads(sys.argv[2]) if name in sys.modules]}))
+"""
+
+''' Measures the cost of importing modules of the library, each in a fresh interpreter, as the best of several runs.
+    The resident memory of an interpreter which imports nothing is reported as well, as a reference.
+    :param modules: The names of the modules
+    :param repeats: The number of runs for each module
+    :return: A dictionary from module name to its import time, its peak resident memory and the heavy modules it loaded
+'''
+def measure_import_cost(modules = list(__IMPORT_BUDGETS__), repeats = 3):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, PYTHONPATH = os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    results = {}
+    for module in [''] + list(modules):
+        runs = [json.loads(subprocess.run([sys.executable, '-c', __IMPORT_SCRIPT__, module, json.dumps(__HEAVY_MODULES__)],
+                                          env = environment, capture_output = True, check = True, text = True).stdout)
+                for _ in range(repeats)]
+        results[module or 'interpreter'] = {'seconds': min(run['seconds'] for run in runs),
+                                            'peak_rss_bytes': min(run['peak_rss_bytes'] for run in runs),
+                                            'heavy_modules': runs[0]['heavy_modules']}
+    return results
+
+''' Checks that importing the lightweight entry points of the library stays cheap: `import adslib` must not load
+    any heavy dependency, and `adslib.access_load` only the database driver, each within a memory budget
+    :param budgets: A dictionary from module name to the heavy modules it may load, its maximum import time in seconds
+        or None to not check it, and the maximum resident memory in megabytes it may add to that of an interpreter which imports nothing
+    :return: The measured costs
+'''
+def check_import_cost(budgets = __IMPORT_BUDGETS__):
+    costs = measure_import_cost(list(budgets))
+    problems = []
+    for module, budget in budgets.items():
+        unexpected = sorted(set(costs[module]['heavy_modules']) - set(budget['allowed']))
+        if len(unexpected) > 0:
+            problems.append("importing %s loads %s" % (module, ', '.join(unexpected)))
+        if budget['seconds'] is not None and costs[module]['seconds'] > budget['seconds']:
+            problems.append("importing %s takes %.2fs, over the budget of %.2fs" % (module, costs[module]['seconds'], budget['seconds']))
+        added = (costs[module]['peak_rss_bytes'] - costs['interpreter']['peak_rss_bytes']) / 1024**2
+        if added > budget['rss_megabytes']:
+            problems.append("importing %s adds %.1f MB of resident memory, over the budget of %.1f MB" % (module, added, budget['rss_megabytes']))
+    if len(problems) > 0:
+        raise ValueError("Import cost regression: " + '; '.join(problems) + ".")
+    return costs
+
+''' Runs the benchmark suite offline, on synthetic Land Registry data in a local SQLite database and synthetic OSM features,
+    over several input sizes, and writes a baseline file which can be compared between versions.
+    For every benchmark and size, the best time over the repeats and the peak memory allocated by Python are reported,
+    together with the scaling exponent of the time and the memory over the sizes, and the cost of importing the library.
+    :param sizes: The input sizes, in rows
+    :param output_file: The JSON file the baseline is written to, or None
+    :param repeats: The number of timed runs of each benchmark
+    :param seed: The seed of the generators
+    :return: The baseline, as a dictionary
+'''
+def run_benchmarks(sizes = __SIZES__, output_file = 'benchmark_baseline.json', repeats = 3, seed = 0):
+    runs = {}
+    for size in sizes:
+        print("Running benchmarks with %d rows" % size)
+        for name, measurement in __run_size__(size, repeats, seed).items():
+            runs.setdefault(name, {})[str(size)] = measurement
+
+    benchmarks = {}
+    for name, measurements in runs.items():
+        seconds = [measurements[str(size)]['seconds'] for size in sizes]
+        peak_bytes = [measurements[str(size)]['peak_bytes'] for size in sizes]
+        benchmarks[name] = {'sizes': measurements,
+                            'time_exponent': __scaling_exponent__(sizes, seconds),
+                            'memory_exponent': __scaling_exponent__(sizes, peak_bytes)}
+
+    baseline = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                                'numpy': np.__version__, 'pandas': pd.__version__, 'geopandas': gpd.__version__,
+                                'sqlite': sqlite3.sqlite_version},
+                'parameters': {'sizes': list(sizes), 'repeats': repeats, 'seed': seed},
+                'benchmarks': benchmarks,
+                'import_cost': measure_import_cost()}
+    if output_file is not None:
+        with open(output_file, 'w') as file:
+            json.dump(baseline, file, indent = 2)
+    return baseline
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs the adslib benchmark suite on synthetic data and writes a baseline file.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = __SIZES__, help = 'The input sizes, in rows')
+    parser.add_argument('--output', default = 'benchmark_baseline.json', help = 'The baseline file')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'The number of timed runs of each benchmark')
+    parser.add_argument('--seed', type = int, default = 0, help = 'The seed of the generators')
+    arguments = parser.parse_args()
+    baseline = run_benchmarks(arguments.sizes, arguments.output, arguments.repeats, arguments.seed)
+    for name, benchmark in baseline['benchmarks'].items():
+        print("%-55s time exponent %s" % (name, benchmark['time_exponent']))
@@ -1,35 +1,79 @@
 import os
-import yaml
+from collections.abc import MutableMapping
 
 default_file = os.path.join(os.path.dirname(__file__), "defaults.yml")
 local_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "machine.yml"))
 user_file = '_config.yml'
 
-config = {}
-
-if os.path.exists(default_file):
-    with open(default_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if os.path.exists(local_file):
-    with open(local_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if os.path.exists(user_file):
-    with open(user_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if config=={}:
-    raise ValueError(
-        "No configuration file found at either "
-        + user_file
-        + " or "
-        + local_file
-        + " or "
-        + default_file
-        + "."
-    )
-
-for key, item in config.items():
-    if item is str:
-        config[key] = os.path.expandvars(item)
\ No newline at end of file
+''' Private method reading the configuration files, later files overriding earlier ones
+    :return: A dictionary of settings
+'''
+def __load_config__():
+    import yaml
+
+    config = {}
+
+    if os.path.exists(default_file):
+        with open(default_file) as file:
+            config.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if os.path.exists(local_file):
+        with open(local_file) as file:
+            config.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if os.path.exists(user_file):
+        with open(user_file) as file:
+            config.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if config=={}:
+        raise ValueError(
+            "No configuration file found at either "
+            + user_file
+            + " or "
+            + local_file
+            + " or "
+            + default_file
+            + "."
+        )
+
+    for key, item in config.items():
+        if item is str:
+            config[key] = os.path.expandvars(item)
+    return config
+
+''' The settings of the library, which are only read from the configuration files when first accessed,
+    so that importing a module does not parse YAML or fail when no configuration file exists
+'''
+class LazyConfig(MutableMapping):
+    def __init__(self):
+        self.__settings__ = None
+
+    def __getitem__(self, key):
+        return self.__load__()[key]
+
+    def __setitem__(self, key, value):
+        self.__load__()[key] = value
+
+    def __delitem__(self, key):
+        del self.__load__()[key]
+
+    def __iter__(self):
+        return iter(self.__load__())
+
+    def __len__(self):
+        return len(self.__load__())
+
+    def __repr__(self):
+        return repr(self.__load__())
+
+    ''' Reads the configuration files again, for instance after a user file has been created
+    '''
+    def reload(self):
+        self.__settings__ = __load_config__()
+
+    def __load__(self):
+        if self.__settings__ is None:
+            self.__settings__ = __load_config__()
+        return self.__settings__
+
+config = LazyConfig()
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+from . import load_from_osm
+from .atomic import write_parquet, write_json
+from .spatial import as_projected_points, latitude_column
+
+''' A persistent store of the OSM features of properties, so that features computed once are reused by later runs.
+    Each row of the store holds the features of one location: the POI counts, existence flags and distances of a
+    `load_from_osm.build_feature_matrix` specification, and optionally the attributes of the matched building.
+    Locations are keyed either by their projected coordinates rounded to a resolution, or by their postcode.
+    Stores with different specifications are kept apart, in a folder named by the hash of the specification.
+    Each row records the version of the OSM data it was computed from, and the time it was computed. A row is stale
+    once the version differs from the one of the store, or it is older than the maximum age.
+    When features are requested, only the missing and stale locations are computed, and they are appended as a new
+    Parquet part file. `compact` merges the part files into a single one, sorted by key.
+    :param directory: The folder of the store
+    :param feature_spec: The specification of the POI features, as taken by `load_from_osm.build_feature_matrix`
+    :param building_features: The attributes of the matched building to be stored, such as ['building', 'addr:street'].
+        A 'building_is_valid_match' column is added when any are requested
+    :param source_version: The version of the OSM data, such as the date of an extract, to be changed when it is refreshed
+    :param key: 'coordinates' to key locations by their rounded projected coordinates, or 'postcode'
+    :param resolution: The size in metres to which projected coordinates are rounded
+    :param max_age: The number of seconds after which a row is stale, or None to keep rows until the version changes
+    :param chunk_size: The number of locations for which features are computed at a time
+    :param padding: How much to extend the box of each chunk by in each direction when fetching OSM features
+    :param tile_size: If given, the box of each chunk is fetched as tiles of roughly this size in degrees
+'''
+class FeatureStore:
+    def __init__(self, directory, feature_spec, building_features = [], source_version = '1', key = 'coordinates', resolution = 1.0,
+                 max_age = None, chunk_size = 2000, padding = 0.02, tile_size = None):
+        if key not in ('coordinates', 'postcode'):
+            raise ValueError("Unknown key '%s', expected 'coordinates' or 'postcode'." % key)
+        self.feature_spec = feature_spec
+        self.building_features = list(building_features)
+        self.source_version = str(source_version)
+        self.key = key
+        self.resolution = resolution
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self.padding = padding
+        self.tile_size = tile_size
+        self.key_columns = ['easting_key', 'northing_key'] if key == 'coordinates' else ['postcode']
+        self.spec_hash = spec_hash(feature_spec, self.building_features, key, resolution)
+        self.directory = os.path.join(directory, self.spec_hash)
+        self.__table__ = None
+        self.__lock__ = threading.Lock()
+        os.makedirs(self.directory, exist_ok = True)
+        if not os.path.exists(os.path.join(self.directory, 'spec.json')):
+            write_json({'feature_spec': feature_spec, 'building_features': self.building_features, 'key': key,
+                            'resolution': resolution}, os.path.join(self.directory, 'spec.json'))
+
+    ''' Returns the features of a set of properties, computing and storing those of the locations which are missing or stale
+        :param data: A DataFrame with 'latitude' (or 'lattitude') and 'longitude' columns, and a 'postcode' column when keyed
+            by postcode, such as the result of `access_load.get_price_coord_frame_between_years`
+        :return: A DataFrame of features aligned to the index of the data. The features of the rows without a location
+            are missing
+    '''
+    def get_features(self, data):
+        keys = self.keys(data)
+        with self.__lock__:
+            table = self.__load__()
+            fresh = table[self.__is_fresh__(table)]
+            missing = ~keys.set_index(self.key_columns).index.isin(fresh.index) & keys.notna().all(axis = 1).to_numpy()
+            if missing.any():
+                first_rows = ~keys[missing].duplicated()
+                locations = data[missing][first_rows.to_numpy()]
+                computed = self.__compute__(locations, keys[missing][first_rows.to_numpy()])
+                self.__append__(computed)
+                table = self.__table__
+        features = table.reindex(keys.set_index(self.key_columns).index)
+        features.index = data.index
+        return features.drop(columns = ['source_version', 'computed'])
+
+    ''' Joins the features of a set of properties onto them
+        :param data: A DataFrame, as taken by `get_features`
+        :return: The data with the feature columns added
+    '''
+    def join(self, data):
+        return data.join(self.get_features(data))
+
+    ''' Computes the keys of a set of properties
+        :param data: A DataFrame with 'latitude' (or 'lattitude') and 'longitude' columns, or a 'postcode' column when keyed by postcode
+        :return: A DataFrame with the key columns, aligned to the index of the data. The keys of the rows with a missing
+            postcode, or missing coordinates, are missing
+    '''
+    def keys(self, data):
+        if self.key == 'postcode':
+            return pd.DataFrame({'postcode': data.postcode.astype(str).where(data.postcode.notna(), None).to_numpy()}, index = data.index)
+        # Rounding a missing coordinate would give an arbitrary integer, which would be shared by all such rows
+        located = np.isfinite(data[latitude_column(data)].to_numpy(dtype = float)) & np.isfinite(data.longitude.to_numpy(dtype = float))
+        keys = pd.DataFrame({'easting_key': pd.array([None] * len(data), dtype = 'Int64'),
+                             'northing_key': pd.array([None] * len(data), dtype = 'Int64')}, index = data.index)
+        if located.any():
+            points = as_projected_points(data[located])
+            keys.loc[located, 'easting_key'] = np.round(points.easting / self.resolution).astype(np.int64)
+            keys.loc[located, 'northing_key'] = np.round(points.northing / self.resolution).astype(np.int64)
+        return keys
+
+    ''' Reads all rows of the store, the latest row of each location taking precedence
+        :return: A DataFrame indexed by the key columns, with the features, the 'source_version' and the 'computed' time
+    '''
+    def read(self):
+        with self.__lock__:
+            return self.__load__().copy()
+
+    ''' Merges the part files into a single one sorted by key, dropping the rows superseded by later ones.
+        The parts are read again from disk, so that the parts appended by other processes since this store was loaded are kept.
+    '''
+    def compact(self):
+        with self.__lock__:
+            parts = self.__parts__()
+            if len(parts) <= 1:
+                return
+            self.__table__ = None
+            table = self.__load__(parts)
+            # The last part is replaced first, so that an interruption leaves older parts which it supersedes
+            write_parquet(table.sort_index(), os.path.join(self.directory, parts[-1]))
+            for part in parts[:-1]:
+                os.remove(os.path.join(self.directory, part))
+
+    def __is_fresh__(self, table):
+        fresh = table.source_version.to_numpy() == self.source_version
+        if self.max_age is not None:
+            fresh &= time.time() - table.computed.to_numpy() <= self.max_age
+        return fresh
+
+    def __compute__(self, locations, keys):
+        frames = []
+        # Locations are sorted as in the scoring pipeline, so that each chunk covers a small area
+        order = np.lexsort([locations.longitude.to_numpy(), np.floor(locations[latitude_column(locations)].to_numpy() / 0.1)])
+        locations, keys = locations.iloc[order], keys.iloc[order]
+        for begin in range(0, len(locations), self.chunk_size):
+            chunk = locations.iloc[begin:begin + self.chunk_size]
+            features = load_from_osm.build_feature_matrix(chunk, self.feature_spec, padding = self.padding, tile_size = self.tile_size)
+            if len(self.building_features) > 0:
+                buildings = load_from_osm.extract_osm_building_features(chunk, padding = self.padding, tile_size = self.tile_size)
+                if buildings is None:
+                    buildings = pd.DataFrame(index = chunk.index, columns = self.building_features + ['is_valid_match'])
+                buildings = buildings.reindex(columns = self.building_features + ['is_valid_match'])
+                features = features.join(buildings.rename(columns = {'is_valid_match': 'building_is_valid_match'}))
+            frames.append(features)
+        computed = pd.concat(frames)
+        if self.key == 'coordinates':
+            keys = keys.astype(np.int64)
+        computed.index = keys.set_index(self.key_columns).index
+        computed['source_version'] = self.source_version
+        computed['computed'] = time.time()
+        return computed
+
+    def __append__(self, computed):
+        # Part names are unique, so that processes appending at the same time never replace each other's part,
+        # and start with the time, so that later parts sort last and take precedence
+        name = 'part-%020d-%d-%s.parquet' % (time.time_ns(), os.getpid(), uuid.uuid4().hex[:8])
+        write_parquet(computed, os.path.join(self.directory, name))
+        table = pd.concat([self.__table__, computed]) if len(self.__table__) > 0 else computed
+        self.__table__ = table[~table.index.duplicated(keep = 'last')]
+
+    def __load__(self, parts = None):
+        if self.__table__ is None:
+            frames = [pd.read_parquet(os.path.join(self.directory, part)) for part in (self.__parts__() if parts is None else parts)]
+            if len(frames) == 0:
+                self.__table__ = pd.DataFrame(columns = self.key_columns + ['source_version', 'computed']).set_index(self.key_columns)
+            else:
+                table = pd.concat(frames)
+                self.__table__ = table[~table.index.duplicated(keep = 'last')]
+        return self.__table__
+
+    def __parts__(self):
+        return sorted(file for file in os.listdir(self.directory) if file.startswith('part-') and file.endswith('.parquet'))
+
+''' Produces a stable identifier for a feature specification
+    :param feature_spec: The specification of the POI features, as taken by `load_from_osm.build_feature_matrix`
+    :param building_features: The attributes of the matched building
+    :param key: The kind of key of the locations
+    :param resolution: The size in metres to which projected coordinates are rounded
+    :return: A hexadecimal hash, independent of the ordering of the specification
+'''
+def spec_hash(feature_spec, building_features = [], key = 'coordinates', resolution = 1.0):
+    description = {'feature_spec': feature_spec, 'building_features': sorted(building_features), 'key': key, 'resolution': resolution}
+    return hashlib.sha1(json.dumps(description, sort_keys = True, default = str).encode()).hexdigest()[:16]
@@ -0,0 +1,171 @@
+import sys
+import json
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+from .config import config
+
+__recorder__ = None
+# Whether the configuration has been checked for the 'instrumentation' setting
+__configured__ = False
+
+logger = logging.getLogger(__name__)
+
+''' Collects measurements of the instrumented operations of the library: for each operation, the number of calls,
+    the wall time, and counters such as the rows and features returned, the bytes held by the returned DataFrames,
+    and the hits and misses of the caches.
+    :param log_calls: Whether to also log every call as a JSON line, on the 'adslib.instrument' logger
+'''
+class Recorder:
+    def __init__(self, log_calls = False):
+        self.log_calls = log_calls
+        self.operations = {}
+        self.__lock__ = threading.Lock()
+
+    ''' Records one call of an operation
+        :param operation: The name of the operation
+        :param seconds: The wall time of the call
+        :param counters: The counters of the call, such as rows = 100
+    '''
+    def record(self, operation, seconds, **counters):
+        with self.__lock__:
+            entry = self.operations.setdefault(operation, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            for name, value in counters.items():
+                entry[name] = entry.get(name, 0) + value
+        if self.log_calls:
+            logger.info(json.dumps(dict(operation = operation, seconds = seconds, **counters)))
+
+    ''' Adds to the counters of an operation, without counting a call
+        :param operation: The name of the operation
+        :param counters: The increments, such as cache_hits = 1
+    '''
+    def increment(self, operation, **counters):
+        with self.__lock__:
+            entry = self.operations.setdefault(operation, {'calls': 0, 'seconds': 0.0})
+            for name, value in counters.items():
+                entry[name] = entry.get(name, 0) + value
+
+    ''' Removes all measurements
+    '''
+    def reset(self):
+        with self.__lock__:
+            self.operations = {}
+
+    ''' Summarizes the measurements
+        :return: A DataFrame with one row per operation and one column per counter
+    '''
+    def summary(self):
+        import pandas as pd
+        with self.__lock__:
+            summary = pd.DataFrame.from_dict(self.operations, orient = 'index').fillna(0)
+        summary.index.name = 'operation'
+        return summary.sort_values('seconds', ascending = False) if len(summary) > 0 else summary
+
+    ''' Exports the measurements in the Prometheus text format, with one metric per counter labelled by operation
+        :param prefix: The prefix of the metric names
+        :return: The text of the metrics
+    '''
+    def to_prometheus(self, prefix = 'adslib'):
+        with self.__lock__:
+            operations = {operation: dict(entry) for operation, entry in self.operations.items()}
+        names = sorted({name for entry in operations.values() for name in entry})
+        lines = []
+        for name in names:
+            metric = '%s_%s_total' % (prefix, name)
+            lines.append('# TYPE %s counter' % metric)
+            for operation, entry in sorted(operations.items()):
+                if name in entry:
+                    lines.append('%s{operation="%s"} %r' % (metric, operation, entry[name]))
+        return '\n'.join(lines) + '\n'
+
+    ''' Writes the measurements of every operation as a JSON line on a logger
+        :param target: The logger, by default the 'adslib.instrument' logger
+        :param level: The logging level
+    '''
+    def to_log(self, target = None, level = logging.INFO):
+        target = logger if target is None else target
+        with self.__lock__:
+            operations = {operation: dict(entry) for operation, entry in self.operations.items()}
+        for operation, entry in sorted(operations.items()):
+            target.log(level, json.dumps(dict(operation = operation, **entry)))
+
+''' Sets the recorder used by all instrumented operations
+    :param recorder: A Recorder, or None to disable instrumentation
+    :return: The previously used recorder
+'''
+def set_recorder(recorder):
+    global __recorder__
+    previous = get_recorder()
+    __recorder__ = recorder
+    return previous
+
+''' Returns the recorder used by all instrumented operations. Unless one has been set, a recorder is created if
+    'instrumentation' is enabled in the configuration, and otherwise instrumentation is disabled.
+    The configuration is only checked on the first call, so later calls cost a global lookup.
+    :return: A Recorder or None
+'''
+def get_recorder():
+    global __recorder__, __configured__
+    if not __configured__:
+        __configured__ = True
+        if __recorder__ is None and config.get('instrumentation'):
+            __recorder__ = Recorder(log_calls = config.get('instrumentation_log_calls', False))
+    return __recorder__
+
+''' Enables instrumentation for the duration of a with block
+    :param recorder: A Recorder, by default a new one
+    :return: A context manager yielding the recorder
+'''
+@contextmanager
+def recording(recorder = None):
+    recorder = Recorder() if recorder is None else recorder
+    previous = set_recorder(recorder)
+    try:
+        yield recorder
+    finally:
+        set_recorder(previous)
+
+''' Adds to the counters of an operation, if instrumentation is enabled
+    :param operation: The name of the operation
+    :param counters: The increments, such as cache_hits = 1
+'''
+def increment(operation, **counters):
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.increment(operation, **counters)
+
+''' Decorator recording the calls of a function, their wall time, the size of their result and, for DataFrames,
+    the bytes they hold. When instrumentation is disabled, the function is called directly.
+    :param operation: The name of the operation, by default the module and name of the function
+    :param counter: The name of the counter of the size of the result
+    :param size: A function from the result to its size, or None to not count it
+    :return: The decorator
+'''
+def instrumented(operation = None, counter = 'rows', size = len):
+    def decorator(function):
+        name = operation or function.__module__.rsplit('.', 1)[-1] + '.' + function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = get_recorder()
+            if recorder is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            counters = {}
+            if size is not None and result is not None:
+                counters[counter] = size(result)
+            # pandas is only imported by the library when needed, and a result cannot be a DataFrame before that
+            pandas = sys.modules.get('pandas')
+            if pandas is not None and isinstance(result, pandas.DataFrame):
+                counters['bytes'] = int(result.memory_usage(index = False).sum())
+            recorder.record(name, seconds, **counters)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,18 @@
+import importlib
+
+''' A module which is only imported when one of its attributes is first used, so that a module of the library can
+    name a heavy dependency at its top, as `pd = LazyModule('pandas')`, without importing it along with the library
+    :param name: The name of the module
+'''
+class LazyModule:
+    def __init__(self, name):
+        self.__name__ = name
+        self.__loaded__ = None
+
+    def __getattr__(self, attribute):
+        if self.__loaded__ is None:
+            self.__loaded__ = importlib.import_module(self.__name__)
+        return getattr(self.__loaded__, attribute)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__name__
@@ -1,8 +1,54 @@
+import os
+import math
+import atexit
 import osmnx as ox
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
+from concurrent.futures import ThreadPoolExecutor
+from .config import config
+from .osm_extract import ExtractGeometrySource, filter_by_tags
+from .osm_cache import TileCache, GeocodeCache, bbox_from_point, __EMPTY_RESPONSE_ERRORS__
+from .spatial import FeatureIndex, ProjectedPoints, as_projected_points, features_in_boxes
+from .instrument import instrumented
+
+__geometry_source__ = None
+__geocode_cache__ = None
+
+''' Sets the object used to fetch OSM geometries for all methods in this module
+    :param source: An object exposing `geometries_from_bbox` and `geometries_from_point` with the osmnx signatures,
+        such as the osmnx module itself or a TileCache
+    :return: The previously used source
+'''
+def set_geometry_source(source):
+    global __geometry_source__
+    previous = __geometry_source__
+    __geometry_source__ = source
+    return previous
+
+''' Returns the object used to fetch OSM geometries.
+    Unless one has been set, this is a local extract if 'osm_extract_file' is configured,
+    or otherwise osmnx, wrapped in a TileCache if 'osm_cache_directory' is configured.
+    :return: The geometry source
+'''
+def get_geometry_source():
+    global __geometry_source__
+    if __geometry_source__ is None:
+        if config.get('osm_extract_file'):
+            __geometry_source__ = ExtractGeometrySource.load(os.path.expanduser(config['osm_extract_file']),
+                                                             keys = config.get('osm_extract_keys'),
+                                                             bbox = config.get('osm_extract_bbox'))
+        elif config.get('osm_cache_directory'):
+            __geometry_source__ = TileCache(os.path.expanduser(config['osm_cache_directory']),
+                                            tile_size = config.get('osm_cache_tile_size', 0.05),
+                                            max_bytes = config.get('osm_cache_max_bytes', 2 * 1024**3),
+                                            max_age = config.get('osm_cache_max_age'),
+                                            flush_interval = config.get('osm_cache_flush_interval', 60))
+            # The access times of the last hits are written when the process exits
+            atexit.register(__geometry_source__.flush)
+        else:
+            __geometry_source__ = ox
+    return __geometry_source__
 
 ''' Selects all POIs, given by tags, within a certain distance around a point.
     :param latitude: The latitude of the center point
@@ -12,11 +58,12 @@ from shapely.geometry import Point
     :param feature_set: A list of features to be extracted from the resulting query
     :return: A GeoDataFrame of POIs
 '''
+@instrumented('osm_request_point', counter = 'features')
 def get_features_around_coord(latitude, longitude, distance, tags, feature_set = []):
     if len(feature_set) == 0:
-        return ox.geometries_from_point((latitude, longitude), tags, dist = distance)
+        return get_geometry_source().geometries_from_point((latitude, longitude), tags, dist = distance)
     else:
-        return ox.geometries_from_point((latitude, longitude), tags, dist = distance)[feature_set]
+        return get_geometry_source().geometries_from_point((latitude, longitude), tags, dist = distance)[feature_set]
 
 
 ''' # Returns the number of POIs up to a certain distance from point
@@ -27,7 +74,7 @@ def get_features_around_coord(latitude, longitude, distance, tags, feature_set =
     :return: The number of POIs
 '''
 def extract_number_features(latitude, longitude, distance, tags):
-    features_in_radius = ox.geometries_from_point((latitude, longitude), tags, dist = distance)
+    features_in_radius = get_features_around_coord(latitude, longitude, distance, tags)
     return len(features_in_radius)
  
 ''' # The existence of a feature is defined by checking whether the number of features is at least 1
@@ -47,12 +94,12 @@ extract_existance_feature = lambda latitude, longitude, distance, tags : extract
     :return: The distance to the closest feature or None
 '''   
 def extract_distance_to_closest_feature_single(latitude, longitude, feature_tag, limit_distance = 5000):
-    features_in_radius = ox.geometries_from_point((latitude, longitude), feature_tag, dist = limit_distance)
+    features_in_radius = get_features_around_coord(latitude, longitude, limit_distance, feature_tag)
     if len(features_in_radius) == 0:
         return None
-    point = gpd.GeoSeries(Point(longitude, latitude)).set_crs(4326).to_crs(27700)
-    distances = features_in_radius.to_crs(27700).geometry.centroid.apply(lambda x: point.distance(x))
-    return distances[0].min()
+    point = ProjectedPoints([latitude], [longitude])
+    _, distances, _ = FeatureIndex(features_in_radius).nearest(point)
+    return distances[0]
 
 ''' Returns the matching building for a given point
     :param latitude: The latitude of the center point
@@ -64,10 +111,98 @@ def match_single_building(latitude, longitude):
     buildings_in_radius = get_features_around_coord(latitude, longitude, radius, {'building': True})
     if len(buildings_in_radius) == 0:
         return None
-    point = gpd.GeoSeries(Point(longitude, latitude)).set_crs(4326).to_crs(27700)
-    distances = buildings_in_radius.to_crs(27700).geometry.centroid.apply(lambda x: point.distance(x))
+    point = ProjectedPoints([latitude], [longitude])
+    matches, _, _ = FeatureIndex(buildings_in_radius).nearest(point)
     buildings_in_radius['is_valid_match'] = True
-    return buildings_in_radius.iloc[distances[0].argmin()]
+    return buildings_in_radius.iloc[matches[0]]
+
+
+''' Private method to fetch, in a single query, the features around each of a set of points.
+    The box around each point is the same as the one used by the single point queries.
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param distance: The distance from each point to the edges of its box
+    :param tags: A dictionary of OSM-style tags to be considered
+    :return: The features, and the positional indices of the point and of the feature for each point-feature pair
+'''
+def __features_around_points__(building_data, distance, tags):
+    building_data = as_projected_points(building_data)
+    north, south, east, west = bbox_from_point((building_data.latitude.to_numpy(), building_data.longitude.to_numpy()), distance)
+    features = __source_geometries__(north.max(), south.min(), east.max(), west.min(), tags)
+    if len(features) == 0:
+        return features, np.array([], dtype = int), np.array([], dtype = int)
+    point_positions, feature_positions = features_in_boxes(features, north, south, east, west)
+    return features, point_positions, feature_positions
+
+''' Private method to compute the projected distance for each point-feature pair
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param features: A GeoDataFrame of features
+    :param point_positions: The positional indices of the points in the pairs
+    :param feature_positions: The positional indices of the features in the pairs
+    :return: An array of distances between each point and the centroid of the feature
+'''
+def __pair_distances__(building_data, features, point_positions, feature_positions):
+    points = as_projected_points(building_data)
+    centroids = features.to_crs(27700).geometry.centroid
+    return np.hypot(points.easting[point_positions] - centroids.x.to_numpy()[feature_positions],
+                    points.northing[point_positions] - centroids.y.to_numpy()[feature_positions])
+
+''' Returns the number of POIs up to a certain distance from each point, with a single query for all points
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param distance: The maximum distance away from the point to be considered
+    :param tags: A dictionary of OSM-style tags to be considered
+    :return: A series with the number of POIs for each row
+'''
+def extract_number_features_batch(building_data, distance, tags):
+    building_data = as_projected_points(building_data)
+    _, point_positions, _ = __features_around_points__(building_data, distance, tags)
+    return pd.Series(np.bincount(point_positions, minlength = len(building_data)), index = building_data.index)
+
+''' For each row determines whether the number of POIs up to a certain distance is at least 1
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param distance: The maximum distance away from the point to be considered
+    :param tags: A dictionary of OSM-style tags to be considered
+    :return: A boolean series showing whether any POI exists for each row
+'''
+def extract_existance_feature_batch(building_data, distance, tags):
+    return extract_number_features_batch(building_data, distance, tags) >= 1
+
+''' Takes the distance to the closest POI from each point, with a single query for all points
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param feature_tag: The tag(s) to be considered for the POIs
+    :param limit_distance: The maximum distance to be considered valid
+    :return: A series with the distance to the closest feature for each row, or NaN if there is none
+'''
+def extract_distance_to_closest_feature_batch(building_data, feature_tag, limit_distance = 5000):
+    building_data = as_projected_points(building_data)
+    features, point_positions, feature_positions = __features_around_points__(building_data, limit_distance, feature_tag)
+    closest = np.full(len(building_data), np.inf)
+    if len(point_positions) > 0:
+        distances = __pair_distances__(building_data, features, point_positions, feature_positions)
+        np.minimum.at(closest, point_positions, distances)
+    closest[np.isinf(closest)] = np.nan
+    return pd.Series(closest, index = building_data.index)
+
+''' Returns the matching building for each point, with a single query for all points
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :return: A GeoDataFrame of the closest buildings, with 'is_valid_match' set to False where no match is found
+'''
+def match_buildings_batch(building_data):
+    building_data = as_projected_points(building_data)
+    radius = 300
+    buildings, point_positions, feature_positions = __features_around_points__(building_data, radius, {'building': True})
+    if len(point_positions) == 0:
+        return gpd.GeoDataFrame({'is_valid_match': np.full(len(building_data), False)}, index = building_data.index)
+    distances = __pair_distances__(building_data, buildings, point_positions, feature_positions)
+    # Order the pairs by point and then by distance, so that the first pair of each point is its closest building
+    order = np.lexsort((distances, point_positions))
+    point_positions, feature_positions = point_positions[order], feature_positions[order]
+    is_first = np.r_[True, point_positions[1:] != point_positions[:-1]]
+    matching_buildings = buildings.iloc[feature_positions[is_first]].copy()
+    matching_buildings.index = building_data.index[point_positions[is_first]]
+    matching_buildings['is_valid_match'] = True
+    matching_buildings = matching_buildings.reindex(building_data.index)
+    matching_buildings['is_valid_match'] = matching_buildings['is_valid_match'].notna()
+    return matching_buildings
 
 
 ''' Private method to compute the mean radius of a polygon
@@ -76,8 +211,34 @@ def match_single_building(latitude, longitude):
 '''  
 def __polygon_radius__(poly):
     centroid = poly.centroid
-    exterior_points = gpd.GeoSeries([Point(i) for i in poly.exterior.coords])
-    return exterior_points.apply(lambda x: centroid.distance(x)).mean()
+    exterior = np.asarray(poly.exterior.coords)
+    return np.hypot(exterior[:, 0] - centroid.x, exterior[:, 1] - centroid.y).mean()
+
+''' Sets the cache used to geocode places
+    :param cache: A GeocodeCache, or None to use the configured one
+    :return: The previously used cache
+'''
+def set_geocode_cache(cache):
+    global __geocode_cache__
+    previous = __geocode_cache__
+    __geocode_cache__ = cache
+    return previous
+
+''' Private method geocoding a place name, through the geocode cache if one is set or 'osm_geocode_cache_directory' is configured
+    :param place_name: The name of the place
+    :return: A GeoDataFrame, which is empty if the place could not be found
+'''
+@instrumented('osm_geocode', counter = 'features')
+def __geocode__(place_name):
+    global __geocode_cache__
+    if __geocode_cache__ is None and config.get('osm_geocode_cache_directory'):
+        __geocode_cache__ = GeocodeCache(os.path.expanduser(config['osm_geocode_cache_directory']))
+    if __geocode_cache__ is not None:
+        return __geocode_cache__.geocode(place_name)
+    try:
+        return ox.geocode_to_gdf(place_name)
+    except (ValueError,) + __EMPTY_RESPONSE_ERRORS__:
+        return gpd.GeoDataFrame()
 
 ''' Method to get the size, importance and centroid of a city/town/village
     :param city: The name of the place
@@ -87,63 +248,181 @@ def __polygon_radius__(poly):
 '''  
 def extract_place_features(city, country, county = ""):
     place_name = city
-    if len(county) == 0:
+    if len(county) > 0:
         place_name += ', %s'%county
     place_name += ', %s'%country
-    try:
-        place_data = ox.geocode_to_gdf(place_name)
-    except ValueError:
-        return None
+    place_data = __geocode__(place_name)
     if len(place_data) < 1:
         return None
     place = place_data.iloc[0]
-    centroid = place_data.geometry.to_crs(27700)[0].centroid
+    geometry = place_data.geometry.to_crs(27700).iloc[0]
+    centroid = geometry.centroid
     # Geometries are encoded as either Polygons or a set of Polygons(MultiPolygon)
     # For the latter, we define the radius as the Euclidean magnitude of the list of polygon radiuses
-    if place.geometry.geom_type == 'MultiPolygon':
-        multi_radius = np.array([__polygon_radius__(poly) for poly in place_data.geometry.to_crs(27700)[0]])
+    if geometry.geom_type == 'MultiPolygon':
+        multi_radius = np.array([__polygon_radius__(poly) for poly in geometry.geoms])
         radius = ((multi_radius**2).sum())**(1/2)
-    elif place.geometry.geom_type == 'Polygon':
-        radius = __polygon_radius__(place_data.geometry.to_crs(27700)[0])
+    elif geometry.geom_type == 'Polygon':
+        radius = __polygon_radius__(geometry)
     else:
         return None    
     return {'place_center': centroid, 'importance': place.importance, 'radius': radius}
 
+''' Adds the features of the place of each row, geocoding every distinct place only once.
+    If the data has coordinates, the distance from each row to the center of its place is added as well.
+    :param data: A DataFrame, such as the result of an `access_load` query
+    :param city_column: The column with the name of the place
+    :param county_column: The column with the county of the place, or None to not use counties
+    :param country_column: The column with the country of the place, or None to use a fixed country
+    :param country: The country used when there is no country column
+    :return: A DataFrame aligned to the input index, with the 'place_importance', 'place_radius', 'place_easting' and
+        'place_northing' of each row, and 'place_distance' if the data has coordinates. Rows of unknown places get NaN
+'''
+@instrumented()
+def extract_place_features_batch(data, city_column = 'town_city', county_column = 'county', country_column = 'country',
+                                 country = 'United Kingdom'):
+    places = pd.DataFrame({'city': data[city_column].fillna('').astype(str),
+                           'county': data[county_column].fillna('').astype(str) if county_column is not None else '',
+                           'country': data[country_column].fillna(country).astype(str) if country_column is not None else country},
+                          index = data.index)
+    # Places are geocoded one at a time, as the Nominatim usage policy does not allow parallel requests
+    unique_places = places.drop_duplicates().reset_index(drop = True)
+    records = []
+    for city, county, place_country in unique_places.itertuples(index = False, name = None):
+        features = extract_place_features(city, place_country, county) if len(city) > 0 else None
+        if features is None:
+            records.append((np.nan, np.nan, np.nan, np.nan))
+        else:
+            center = features['place_center']
+            records.append((features['importance'], features['radius'], center.x, center.y))
+    columns = ['place_importance', 'place_radius', 'place_easting', 'place_northing']
+    unique_places[columns] = pd.DataFrame(records, columns = columns, dtype = float)
+
+    result = places.merge(unique_places, on = ['city', 'county', 'country'], how = 'left')
+    result.index = data.index
+    result = result.drop(columns = ['city', 'county', 'country'])
+    if ('latitude' in data.columns or 'lattitude' in data.columns) and 'longitude' in data.columns:
+        points = as_projected_points(data)
+        result['place_distance'] = np.hypot(points.easting - result.place_easting.to_numpy(),
+                                            points.northing - result.place_northing.to_numpy())
+    return result
+
+''' Private method to estimate the area of a bounding box and the number of Overpass requests needed to fetch it
+    :param tile: A (north, south, east, west) tuple
+    :return: The area in square kilometres and the number of requests
+'''
+def __tile_cost__(tile):
+    north, south, east, west = tile
+    height = (north - south) * 110.574
+    width = (east - west) * 111.320 * math.cos(math.radians((north + south) / 2))
+    # osmnx splits any query into sub-queries, whose area is at most the maximum query area size
+    max_side = math.sqrt(getattr(ox.settings, 'max_query_area_size', 50 * 1000 * 50 * 1000)) / 1000
+    return height * width, max(1, math.ceil(height / max_side)) * max(1, math.ceil(width / max_side))
+
+''' Splits the region covered by a set of buildings into compact tiles, skipping the empty areas between them.
+    The buildings are grouped by the grid cell they fall in, and each group is covered by its padded bounding box.
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param padding: How much to extend each tile by in each direction
+    :param tile_size: The side of a grid cell in degrees
+    :return: A list of (north, south, east, west) tiles and a summary comparing them with the single box plan
+'''
+def plan_region_tiles(building_data, padding = 0.02, tile_size = 0.1):
+    building_data = as_projected_points(building_data)
+    cells = pd.DataFrame({'latitude': building_data.latitude.to_numpy(),
+                          'longitude': building_data.longitude.to_numpy(),
+                          'x': np.floor(building_data.longitude.to_numpy() / tile_size),
+                          'y': np.floor(building_data.latitude.to_numpy() / tile_size)})
+    bounds = cells.groupby(['x', 'y']).agg(north = ('latitude', 'max'), south = ('latitude', 'min'),
+                                           east = ('longitude', 'max'), west = ('longitude', 'min'))
+    tiles = [(north + padding, south - padding, east + padding, west - padding)
+             for north, south, east, west in bounds[['north', 'south', 'east', 'west']].itertuples(index = False)]
+
+    single_area, single_requests = __tile_cost__((cells.latitude.max() + padding, cells.latitude.min() - padding,
+                                                  cells.longitude.max() + padding, cells.longitude.min() - padding))
+    tile_costs = [__tile_cost__(tile) for tile in tiles]
+    tiled_area = sum(area for area, _ in tile_costs)
+    tiled_requests = sum(requests for _, requests in tile_costs)
+    summary = {'tiles': len(tiles),
+               'single_box_area_km2': single_area, 'tiled_area_km2': tiled_area,
+               'area_saved_km2': single_area - tiled_area,
+               'single_box_requests': single_requests, 'tiled_requests': tiled_requests,
+               'requests_saved': single_requests - tiled_requests}
+    return tiles, summary
+
+''' Private method fetching the features in a box from the geometry source. Each call is one request to the source,
+    which is a remote request when the source is osmnx, or a lookup of the tiles of a TileCache.
+    :return: A GeoDataFrame of features
+'''
+@instrumented('osm_request', counter = 'features')
+def __source_geometries__(north, south, east, west, tags):
+    return get_geometry_source().geometries_from_bbox(north, south, east, west, tags)
+
+''' Private method to fetch a single tile, treating an empty response as an empty GeoDataFrame
+    :param tile: A (north, south, east, west) tuple
+    :param tags: A dictionary of OSM-style tags to be considered
+    :return: A GeoDataFrame of POIs
+'''
+def __fetch_tile__(tile, tags):
+    try:
+        return __source_geometries__(*tile, tags)
+    except __EMPTY_RESPONSE_ERRORS__:
+        return gpd.GeoDataFrame()
+
 ''' Loads all POIs with the given task within the boundary, determined by the set of buildings given
-    :param building_data: A DataFrame, containing the buildings' features and coordinates
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
     :param tags: A dictionary of OSM-style tags to be considered
     :param padding: How much to extend the box by in each direction
-    :return: A GeoDataFrame of POIs
+    :param tile_size: If given, the region is split into tiles of roughly this size in degrees by `plan_region_tiles`,
+        which are fetched concurrently; otherwise a single box around all buildings is fetched
+    :param max_workers: The maximum number of tiles fetched at the same time
+    :param return_plan: Whether to also return the summary of the tiling plan
+    :return: A GeoDataFrame of POIs, and the summary of the plan if requested
 '''
-def get_geometries_in_region(building_data, tags, padding = 0.02):
-    box_height = building_data.latitude.max() - building_data.latitude.min() + 2*padding
-    latitude = (building_data.latitude.max() + building_data.latitude.min())/2
-    box_width = building_data.longitude.max() - building_data.longitude.min() + 2*padding
-    longitude = (building_data.longitude.max() + building_data.longitude.min())/2
-    
-    north = latitude + box_height/2
-    south = latitude - box_height/2
-    east = longitude + box_width/2
-    west = longitude - box_width/2
-    
-    return ox.geometries_from_bbox(north, south, east, west, tags)
+def get_geometries_in_region(building_data, tags, padding = 0.02, tile_size = None, max_workers = 4, return_plan = False):
+    building_data = as_projected_points(building_data)
+    if tile_size is None:
+        box_height = building_data.latitude.max() - building_data.latitude.min() + 2*padding
+        latitude = (building_data.latitude.max() + building_data.latitude.min())/2
+        box_width = building_data.longitude.max() - building_data.longitude.min() + 2*padding
+        longitude = (building_data.longitude.max() + building_data.longitude.min())/2
+
+        north = latitude + box_height/2
+        south = latitude - box_height/2
+        east = longitude + box_width/2
+        west = longitude - box_width/2
+
+        features = __source_geometries__(north, south, east, west, tags)
+        return (features, None) if return_plan else features
+
+    tiles, summary = plan_region_tiles(building_data, padding = padding, tile_size = tile_size)
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        fetched = [tile for tile in executor.map(lambda tile: __fetch_tile__(tile, tags), tiles) if len(tile) > 0]
+    if len(fetched) == 0:
+        features = gpd.GeoDataFrame()
+    else:
+        # Tiles can overlap, so the same OSM element may be returned more than once
+        features = pd.concat(fetched)
+        features = features[~features.index.duplicated()]
+    return (features, summary) if return_plan else features
 
 ''' Loads all POIs with the given task within the boundary, determined by the set of buildings given
-    :param building_data: A DataFrame, containing the buildings' features and coordinates
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
     :param tags: A dictionary of OSM-style tags to be considered
     :param padding: How much to extend the box by in each direction
+    :param tile_size: If given, the region is fetched as tiles of roughly this size in degrees (see `get_geometries_in_region`)
     :return: A GeoDataFrame of POIs
 '''
-def extract_osm_building_features(building_data, geometries_features = [], padding = 0.02):
-    buildings = get_geometries_in_region(building_data, {'building': True}, padding = padding)
-    centroids = buildings.to_crs(27700).geometry.centroid
+@instrumented()
+def extract_osm_building_features(building_data, geometries_features = [], padding = 0.02, tile_size = None):
+    points = as_projected_points(building_data)
+    buildings = get_geometries_in_region(points, {'building': True}, padding = padding, tile_size = tile_size)
     if len(buildings) == 0:
         return None
-    points = gpd.GeoSeries(building_data.apply(lambda x: Point(x.longitude, x.latitude), axis = 1)).set_crs(4326).to_crs(27700)
-    matches = points.apply(lambda x: centroids.distance(x).argmin())
-    matching_buildings = buildings.iloc[matches]
+    index = FeatureIndex(buildings)
+    matches, _, is_valid_match = index.nearest(points, distance_limit = 150)
+    matching_buildings = buildings.iloc[matches].copy()
     matching_buildings.index = building_data.index
-    matching_buildings['is_valid_match'] = points.apply(lambda x: centroids.distance(x).min()) < 150
+    matching_buildings['is_valid_match'] = is_valid_match
     
     # If not features are specified, return all
     if len(geometries_features) == 0:
@@ -153,21 +432,24 @@ def extract_osm_building_features(building_data, geometries_features = [], paddi
     return matching_buildings[geometries_features]
 
 ''' Calculates the closest distance for each row to a set of POIs
-    :param building_data: A DataFrame, containing the buildings' features and coordinates
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
     :param tags: A dictionary of OSM-style tags to be considered
     :param padding: How much to extend the box by in each direction
+    :param tile_size: If given, the region is fetched as tiles of roughly this size in degrees (see `get_geometries_in_region`)
     :return: A series with the distance to the closest feature for each building
 '''
-def extract_distance_to_closest_feature_in_box(building_data, tags, padding = 0.02):
-    features = get_geometries_in_region(building_data, tags, padding = padding)
+@instrumented()
+def extract_distance_to_closest_feature_in_box(building_data, tags, padding = 0.02, tile_size = None):
+    points = as_projected_points(building_data)
+    features = get_geometries_in_region(points, tags, padding = padding, tile_size = tile_size)
     if len(features) == 0:
         return None
-    centroids = features.to_crs(27700).geometry.centroid
-    points = gpd.GeoSeries(building_data.apply(lambda x: Point(x.longitude, x.latitude), axis = 1)).set_crs(4326).to_crs(27700)
-    return points.apply(lambda x: centroids.distance(x).min())
+    index = FeatureIndex(features)
+    _, distances, _ = index.nearest(points)
+    return pd.Series(distances, index = points.index)
 
 ''' Calculates the number of features in a given box, determined by the set of buildings
-    :param building_data: A DataFrame, containing the buildings' features and coordinates
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
     :param tags: A dictionary of OSM-style tags to be considered
     :param padding: How much to extend the box by in each direction
     :return: The number of features in the box
@@ -177,15 +459,90 @@ def extract_number_of_features_in_box(building_data, tags, padding = 0.02):
     return len(features)
 
 ''' For each row determines whether there exists a POI within a certain distance
-    :param building_data: A DataFrame, containing the buildings' features and coordinates
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
     :param tags: A dictionary of OSM-style tags to be considered
     :param padding: How much to extend the box by in each direction
+    :param tile_size: If given, the region is fetched as tiles of roughly this size in degrees (see `get_geometries_in_region`)
     :return: The number of features in the box
 '''
-def extract_feature_existence_in_box (building_data, tags, padding = 0.02, distance_limit = 500): 
-    features = get_geometries_in_region(building_data, tags, padding = padding)
+@instrumented()
+def extract_feature_existence_in_box (building_data, tags, padding = 0.02, distance_limit = 500, tile_size = None): 
+    points = as_projected_points(building_data)
+    features = get_geometries_in_region(points, tags, padding = padding, tile_size = tile_size)
     if len(features) == 0:
         return False
-    centroids = features.to_crs(27700).geometry.centroid
-    points = gpd.GeoSeries(building_data.apply(lambda x: Point(x.longitude, x.latitude), axis = 1)).set_crs(4326).to_crs(27700)
-    return points.apply(lambda x: centroids.distance(x).min()) < distance_limit
+    index = FeatureIndex(features)
+    _, _, within = index.nearest(points, distance_limit = distance_limit)
+    return pd.Series(within, index = points.index)
+
+''' Private method to combine several sets of OSM-style tags into one, which matches any feature matched by either set
+    :param tag_sets: A list of dictionaries of OSM-style tags
+    :return: The combined dictionary of tags
+'''
+def __merge_tags__(tag_sets):
+    merged = {}
+    for tags in tag_sets:
+        for key, value in tags.items():
+            if value is True or merged.get(key) is True:
+                merged[key] = True
+                continue
+            values = merged.get(key, [])
+            values = values if isinstance(values, list) else [values]
+            for item in (value if isinstance(value, list) else [value]):
+                if item not in values:
+                    values.append(item)
+            merged[key] = values
+    return merged
+
+''' Private method computing the padding in degrees needed for a box around a set of points to include everything
+    within a distance of each point. A degree of longitude is shortest at the point furthest from the equator.
+    :param points: ProjectedPoints
+    :param distance: The distance in metres
+    :return: The padding
+'''
+def __radius_padding__(points, distance):
+    if len(points) == 0:
+        return 0
+    _, _, east, _ = bbox_from_point((np.abs(points.latitude).max(), 0), distance)
+    return float(east)
+
+''' Builds several distance-based features for each row, using a single fetch of all required POIs.
+    Each entry of the specification describes one set of POIs, and which features to compute for it:
+    'count' - the number of POIs within the radius, 'exists' - whether there is a POI within the radius,
+    'distance' - the distance to the closest POI.
+    For example, {'school': {'tags': {'amenity': 'school'}, 'radius': 1000, 'kinds': ['count', 'distance']}}
+    :param building_data: A DataFrame, containing the buildings' features and coordinates, or ProjectedPoints
+    :param feature_spec: A dictionary from a feature name to its 'tags', 'radius' (500 by default) and 'kinds' (all by default)
+    :param padding: How much to extend the box by in each direction, at least as far as the largest radius reaches
+    :param tile_size: If given, the region is fetched as tiles of roughly this size in degrees (see `get_geometries_in_region`)
+    :return: A DataFrame with a '<name>_<kind>' column for each requested feature, aligned to the input index
+'''
+@instrumented()
+def build_feature_matrix(building_data, feature_spec, padding = 0.02, tile_size = None):
+    points = as_projected_points(building_data)
+    radius = max([spec.get('radius', 500) for spec in feature_spec.values()], default = 0)
+    padding = max(padding, __radius_padding__(points, radius))
+    features = get_geometries_in_region(points, __merge_tags__([spec['tags'] for spec in feature_spec.values()]),
+                                        padding = padding, tile_size = tile_size)
+    if len(features) > 0:
+        centroids = features.to_crs(27700).geometry.centroid
+
+    columns = {}
+    for name, spec in feature_spec.items():
+        radius = spec.get('radius', 500)
+        kinds = spec.get('kinds', ['count', 'exists', 'distance'])
+        matching = filter_by_tags(features, spec['tags']) if len(features) > 0 else features
+        if len(matching) == 0:
+            counts = np.zeros(len(points), dtype = int)
+            distances = np.full(len(points), np.nan)
+        else:
+            index = FeatureIndex.from_centroids(centroids.loc[matching.index])
+            counts = index.count_within(points, radius)
+            _, distances, _ = index.nearest(points)
+        if 'count' in kinds:
+            columns[name + '_count'] = counts
+        if 'exists' in kinds:
+            columns[name + '_exists'] = counts > 0
+        if 'distance' in kinds:
+            columns[name + '_distance'] = distances
+    return pd.DataFrame(columns, index = building_data.index)
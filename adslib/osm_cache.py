@@ -0,0 +1,290 @@
+import os
+import json
+import math
+import time
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import osmnx as ox
+from osmnx import _errors
+from shapely.geometry import box
+
+from .atomic import write_json, write_parquet
+from .instrument import increment
+
+# Errors raised by the different osmnx versions when a query contains no features
+__EMPTY_RESPONSE_ERRORS__ = tuple(getattr(_errors, name) for name in ('InsufficientResponseError', 'EmptyOverpassResponse')
+                                  if hasattr(_errors, name))
+
+''' Computes the bounding box around a point in the same way osmnx does for its point queries
+    :param center_point: A (latitude, longitude) tuple, where both can also be arrays of coordinates
+    :param dist: The distance in metres from the point to each edge of the box
+    :return: The north, south, east and west edges of the box
+'''
+def bbox_from_point(center_point, dist):
+    earth_radius = 6371009
+    latitude, longitude = center_point
+    delta_lat = (dist / earth_radius) * (180 / np.pi)
+    delta_lon = delta_lat / np.cos(latitude * np.pi / 180)
+    return latitude + delta_lat, latitude - delta_lat, longitude + delta_lon, longitude - delta_lon
+
+''' Produces a stable identifier for a set of OSM-style tags
+    :param tags: A dictionary of OSM-style tags
+    :return: A hexadecimal hash, independent of the ordering of the tags
+'''
+def tags_key(tags):
+    normalized = {key: sorted(value) if isinstance(value, list) else value for key, value in tags.items()}
+    return hashlib.sha1(json.dumps(normalized, sort_keys = True).encode()).hexdigest()[:16]
+
+''' An on-disk cache of OSM geometries, split into tiles of a fixed size in degrees.
+    Any bounding box query is served from the tiles that cover it, so overlapping queries only download the missing tiles.
+    Each tile is stored as a GeoParquet file. The least recently used tiles are evicted when the size cap is exceeded,
+    and tiles older than the maximum age are downloaded again. The access times of the tiles, which only decide the order of
+    eviction, are written to the index at most once every `flush_interval` seconds rather than on every hit, and on `flush`.
+    A directory can be shared by several processes: the index on disk is merged with the one in memory before it is written,
+    and a tile whose file was evicted by another process is downloaded again. Two processes writing the index at the same
+    moment can still lose the entry of a tile, which is then downloaded again when it is next needed.
+    :param directory: The folder in which tiles are stored
+    :param source: The object used to fetch missing tiles, exposing `geometries_from_bbox` (osmnx by default)
+    :param tile_size: The side of a tile in degrees
+    :param max_bytes: The maximum total size of the stored tiles
+    :param max_age: The number of seconds after which a tile is considered stale, or None to keep tiles indefinitely
+    :param flush_interval: The number of seconds for which the access times of hits may be held in memory only
+'''
+class TileCache:
+    def __init__(self, directory, source = ox, tile_size = 0.05, max_bytes = 2 * 1024**3, max_age = None, flush_interval = 60):
+        self.directory = directory
+        self.source = source
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self.__lock__ = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+        self.__index_file__ = os.path.join(directory, 'index.json')
+        self.__index__ = {}
+        self.__saved__ = time.time()
+        self.__pending__ = False
+        self.__removed__ = set()
+        self.__written__ = set()
+        self.__merge_index__()
+
+    ''' Loads all features with the given tags intersecting a bounding box
+        :param north: The north edge of the box
+        :param south: The south edge of the box
+        :param east: The east edge of the box
+        :param west: The west edge of the box
+        :param tags: A dictionary of OSM-style tags to be considered
+        :return: A GeoDataFrame of features
+    '''
+    def geometries_from_bbox(self, north, south, east, west, tags):
+        tiles = [self.__load_tile__(x, y, tags) for x, y in self.tiles_for_bbox(north, south, east, west)]
+        tiles = [tile for tile in tiles if len(tile) > 0]
+        if len(tiles) == 0:
+            return gpd.GeoDataFrame()
+        features = pd.concat(tiles)
+        features = features[~features.index.duplicated()]
+        return features[features.intersects(box(west, south, east, north))]
+
+    ''' Loads all features with the given tags within a certain distance around a point
+        :param center_point: A (latitude, longitude) tuple
+        :param tags: A dictionary of OSM-style tags to be considered
+        :param dist: The distance in metres from the point to each edge of the queried box
+        :return: A GeoDataFrame of features
+    '''
+    def geometries_from_point(self, center_point, tags, dist = 1000):
+        return self.geometries_from_bbox(*bbox_from_point(center_point, dist), tags)
+
+    ''' Lists the grid tiles covering a bounding box
+        :return: A list of (x, y) tile coordinates
+    '''
+    def tiles_for_bbox(self, north, south, east, west):
+        x_range = range(math.floor(west / self.tile_size), math.ceil(east / self.tile_size))
+        y_range = range(math.floor(south / self.tile_size), math.ceil(north / self.tile_size))
+        return [(x, y) for x in x_range for y in y_range]
+
+    ''' Writes the access times of the hits which are only held in memory to the index
+    '''
+    def flush(self):
+        with self.__lock__:
+            if self.__pending__:
+                self.__save_index__()
+
+    ''' Removes all stored tiles
+    '''
+    def clear(self):
+        with self.__lock__:
+            self.__merge_index__()
+            for key in list(self.__index__):
+                self.__remove__(key)
+            self.__save_index__()
+
+    def __load_tile__(self, x, y, tags):
+        key = '%s_%d_%d' % (tags_key(tags), x, y)
+        with self.__lock__:
+            entry = self.__index__.get(key)
+            if entry is not None and self.max_age is not None and time.time() - entry['created'] > self.max_age:
+                self.__remove__(key)
+                self.__save_index__()
+                entry = None
+        tile = self.__read_tile__(entry) if entry is not None else None
+        with self.__lock__:
+            now = time.time()
+            if tile is not None:
+                entry['accessed'] = now
+                self.__pending__ = True
+                if now - self.__saved__ > self.flush_interval:
+                    self.__save_index__()
+                self.hits += 1
+            else:
+                # The file of the tile may have been evicted by another thread or process since the index was read
+                if entry is not None and self.__index__.get(key) is entry:
+                    self.__index__.pop(key)
+                self.misses += 1
+        if tile is not None:
+            increment('osm_tile_cache', cache_hits = 1)
+            return tile
+
+        increment('osm_tile_cache', cache_misses = 1, requests = 1)
+        west, south = x * self.tile_size, y * self.tile_size
+        try:
+            tile = self.source.geometries_from_bbox(south + self.tile_size, south, west + self.tile_size, west, tags)
+        except __EMPTY_RESPONSE_ERRORS__:
+            tile = gpd.GeoDataFrame()
+        self.__store__(key, tile)
+        return tile
+
+    def __store__(self, key, tile):
+        now = time.time()
+        entry = {'file': None, 'bytes': 0, 'created': now, 'accessed': now}
+        if len(tile) > 0:
+            entry['file'] = key + '.parquet'
+            path = os.path.join(self.directory, entry['file'])
+            write_parquet(tile, path)
+            entry['bytes'] = os.path.getsize(path)
+        with self.__lock__:
+            self.__merge_index__()
+            self.__index__[key] = entry
+            self.__removed__.discard(key)
+            self.__evict__()
+            self.__save_index__()
+
+    ''' Private method reading the stored features of a tile
+        :param entry: The entry of the tile in the index
+        :return: A GeoDataFrame of features, or None if the file of the tile no longer exists
+    '''
+    def __read_tile__(self, entry):
+        if entry['file'] is None:
+            return gpd.GeoDataFrame()
+        try:
+            return gpd.read_parquet(os.path.join(self.directory, entry['file']))
+        except FileNotFoundError:
+            return None
+
+    def __evict__(self):
+        total_bytes = sum(entry['bytes'] for entry in self.__index__.values())
+        for key in sorted(self.__index__, key = lambda k: self.__index__[k]['accessed']):
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self.__index__[key]['bytes']
+            self.__remove__(key)
+
+    def __remove__(self, key):
+        entry = self.__index__.pop(key)
+        self.__removed__.add(key)
+        if entry['file'] is not None and os.path.exists(os.path.join(self.directory, entry['file'])):
+            os.remove(os.path.join(self.directory, entry['file']))
+
+    ''' Private method merging the index on disk, which other processes may have written, into the one in memory.
+        Tiles stored by other processes are added, tiles removed by them since the index was last read are dropped,
+        and tiles removed by this cache since the index was last written are not added back.
+    '''
+    def __merge_index__(self):
+        if not os.path.exists(self.__index_file__):
+            return
+        with open(self.__index_file__) as file:
+            stored = json.load(file)
+        for key, entry in stored.items():
+            current = self.__index__.get(key)
+            if key in self.__removed__:
+                continue
+            if current is None or entry['created'] > current['created']:
+                self.__index__[key] = entry
+            else:
+                current['accessed'] = max(current['accessed'], entry['accessed'])
+        for key in self.__written__.difference(stored):
+            self.__index__.pop(key, None)
+        self.__written__ = set(stored)
+
+    def __save_index__(self):
+        self.__merge_index__()
+        write_json(self.__index__, self.__index_file__)
+        self.__removed__ = set()
+        self.__written__ = set(self.__index__)
+        self.__saved__ = time.time()
+        self.__pending__ = False
+
+''' A persistent cache of geocoding results, so that each place name is only sent to Nominatim once.
+    Each result is stored as a GeoParquet file, and places which could not be geocoded are remembered as well.
+    :param directory: The folder in which results are stored
+    :param geocoder: The function geocoding a query into a GeoDataFrame (osmnx's `geocode_to_gdf` by default)
+'''
+class GeocodeCache:
+    def __init__(self, directory, geocoder = ox.geocode_to_gdf):
+        self.directory = directory
+        self.geocoder = geocoder
+        self.hits = 0
+        self.misses = 0
+        self.__lock__ = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+        self.__index_file__ = os.path.join(directory, 'index.json')
+        self.__index__ = {}
+        if os.path.exists(self.__index_file__):
+            with open(self.__index_file__) as file:
+                self.__index__ = json.load(file)
+
+    ''' Geocodes a place name
+        :param query: The place name
+        :return: A GeoDataFrame, which is empty if the place could not be found
+    '''
+    def geocode(self, query):
+        with self.__lock__:
+            found = query in self.__index__
+            file = self.__index__.get(query)
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if found:
+            increment('osm_geocode_cache', cache_hits = 1)
+            if file is None:
+                return gpd.GeoDataFrame()
+            return gpd.read_parquet(os.path.join(self.directory, file))
+
+        increment('osm_geocode_cache', cache_misses = 1, requests = 1)
+        try:
+            place_data = self.geocoder(query)
+        except (ValueError,) + __EMPTY_RESPONSE_ERRORS__:
+            place_data = gpd.GeoDataFrame()
+        file = None
+        if len(place_data) > 0:
+            file = hashlib.sha1(query.encode()).hexdigest() + '.parquet'
+            place_data.to_parquet(os.path.join(self.directory, file))
+        with self.__lock__:
+            self.__index__[query] = file
+            write_json(self.__index__, self.__index_file__)
+        return place_data
+
+    ''' Removes all stored results
+    '''
+    def clear(self):
+        with self.__lock__:
+            for file in self.__index__.values():
+                if file is not None and os.path.exists(os.path.join(self.directory, file)):
+                    os.remove(os.path.join(self.directory, file))
+            self.__index__ = {}
+            write_json(self.__index__, self.__index_file__)
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+from .osm_cache import bbox_from_point
+
+# The columns holding the bounding box of each feature in a stored extract, which allow a part of it to be read
+__BBOX_COLUMNS__ = ['bbox_minx', 'bbox_miny', 'bbox_maxx', 'bbox_maxy']
+
+''' Keeps the features matching a set of OSM-style tags, with the same semantics as osmnx:
+    a value of True matches any value of the key, a list matches any of its values, and a string matches exactly.
+    A feature is kept if it matches any of the tags.
+    :param features: A GeoDataFrame with one column per tag key
+    :param tags: A dictionary of OSM-style tags to be considered
+    :return: The matching features
+'''
+def filter_by_tags(features, tags):
+    keep = np.full(len(features), False)
+    for key, value in tags.items():
+        if key not in features.columns:
+            continue
+        if value is True:
+            keep |= features[key].notna().to_numpy()
+        elif isinstance(value, list):
+            keep |= features[key].isin(value).to_numpy()
+        else:
+            keep |= (features[key] == value).to_numpy()
+    return features[keep]
+
+''' Private method to parse an OSM extract into a GeoDataFrame using pyosmium
+    :param file_location: The location of the .osm.pbf or .osm file
+    :param keys: If given, only elements having at least one of these tag keys are kept
+    :return: A GeoDataFrame indexed by element type and OSM id, with one column per tag key
+'''
+def __parse_extract__(file_location, keys = None):
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading OSM extracts requires pyosmium. Install it with 'pip install osmium'.")
+
+    class ExtractHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.factory = osmium.geom.WKBFactory()
+            self.records = []
+
+        def keep(self, tags):
+            return len(tags) > 0 and (keys is None or any(key in tags for key in keys))
+
+        def add(self, element_type, osmid, create_geometry, tags):
+            # Elements with missing or invalid locations cannot be turned into geometries
+            try:
+                self.records.append((element_type, osmid, create_geometry(), {tag.k: tag.v for tag in tags}))
+            except RuntimeError:
+                pass
+
+        def node(self, n):
+            if self.keep(n.tags):
+                self.add('node', n.id, lambda: self.factory.create_point(n), n.tags)
+
+        def way(self, w):
+            # Closed ways are assembled into polygons by the area callback, unless explicitly marked as not being areas
+            if self.keep(w.tags) and (not w.is_closed() or w.tags.get('area') == 'no'):
+                self.add('way', w.id, lambda: self.factory.create_linestring(w), w.tags)
+
+        def area(self, a):
+            if self.keep(a.tags):
+                self.add('way' if a.from_way() else 'relation', a.orig_id(), lambda: self.factory.create_multipolygon(a), a.tags)
+
+    handler = ExtractHandler()
+    handler.apply_file(file_location, locations = True)
+
+    index = pd.MultiIndex.from_tuples([(record[0], record[1]) for record in handler.records], names = ['element_type', 'osmid'])
+    geometry = gpd.GeoSeries.from_wkb([record[2] for record in handler.records], index = index, crs = 4326)
+    # Areas built from a single ring are stored as Polygons, as osmnx does
+    multi_part = (geometry.geom_type == 'MultiPolygon').to_numpy()
+    geometry[multi_part] = geometry[multi_part].apply(lambda g: g.geoms[0] if len(g.geoms) == 1 else g)
+    tags = pd.DataFrame([record[3] for record in handler.records], index = index)
+    return gpd.GeoDataFrame(tags, geometry = geometry, crs = 4326)
+
+''' A geometry source, which answers the osmnx-style queries from a local OSM extract instead of the Overpass API.
+    The extract is parsed and spatially indexed once, and then queried from memory.
+    It can be passed to `load_from_osm.set_geometry_source`, or configured with 'osm_extract_file'.
+    :param features: A GeoDataFrame indexed by element type and OSM id, with one column per tag key
+'''
+class ExtractGeometrySource:
+    def __init__(self, features):
+        self.features = features
+        # Build the spatial index up front, so that it is shared by all queries
+        self.features.sindex
+
+    ''' Parses a local .osm.pbf or .osm extract, such as a Geofabrik country file
+        :param file_location: The location of the extract
+        :param keys: If given, only elements having at least one of these tag keys are kept, which reduces memory use
+        :return: An ExtractGeometrySource
+    '''
+    @classmethod
+    def from_file(cls, file_location, keys = None):
+        return cls(__parse_extract__(file_location, keys = keys))
+
+    ''' Loads a previously parsed extract, stored as GeoParquet by `to_parquet`. With a bounding box, only the features
+        intersecting it are read: the row groups lying outside of it are skipped, and the other rows are filtered
+        before they are converted, so that the rest of the extract is never held in memory.
+        :param file_location: The location of the GeoParquet file
+        :param bbox: The (north, south, east, west) edges of the area to be read, or None to read the whole extract
+        :return: An ExtractGeometrySource
+    '''
+    @classmethod
+    def from_parquet(cls, file_location, bbox = None):
+        if bbox is None:
+            features = gpd.read_parquet(file_location)
+        else:
+            north, south, east, west = bbox
+            features = gpd.read_parquet(file_location, filters = [('bbox_maxx', '>=', west), ('bbox_minx', '<=', east),
+                                                                  ('bbox_maxy', '>=', south), ('bbox_miny', '<=', north)])
+        return cls(features.drop(columns = __BBOX_COLUMNS__, errors = 'ignore'))
+
+    ''' Loads an extract, either parsing an OSM file or reading a GeoParquet file, depending on its extension
+        :param file_location: The location of the file
+        :param keys: If given, only elements having at least one of these tag keys are kept when parsing
+        :param bbox: If given, only the features intersecting this (north, south, east, west) box are read from a GeoParquet file
+        :return: An ExtractGeometrySource
+    '''
+    @classmethod
+    def load(cls, file_location, keys = None, bbox = None):
+        if file_location.endswith('.parquet'):
+            return cls.from_parquet(file_location, bbox = bbox)
+        return cls.from_file(file_location, keys = keys)
+
+    ''' Stores the parsed extract as GeoParquet, so that it does not need to be parsed again.
+        The bounding box of each feature is stored along with it, and the features are ordered by grid cell and written
+        in small row groups, so that `from_parquet` can read the features of an area without reading the whole file.
+        :param file_location: The location of the GeoParquet file
+        :param cell_size: The side in degrees of the grid cells by which the features are ordered
+        :param row_group_size: The number of features in each row group
+    '''
+    def to_parquet(self, file_location, cell_size = 0.1, row_group_size = 10000):
+        bounds = self.features.bounds.to_numpy()
+        order = np.lexsort((np.floor(bounds[:, 0] / cell_size), np.floor(bounds[:, 1] / cell_size)))
+        features = self.features.assign(**dict(zip(__BBOX_COLUMNS__, bounds.T))).iloc[order]
+        features.to_parquet(file_location, row_group_size = row_group_size)
+
+    ''' Selects all features with the given tags intersecting a bounding box
+        :param north: The north edge of the box
+        :param south: The south edge of the box
+        :param east: The east edge of the box
+        :param west: The west edge of the box
+        :param tags: A dictionary of OSM-style tags to be considered
+        :return: A GeoDataFrame of features, containing only the tag columns used by them
+    '''
+    def geometries_from_bbox(self, north, south, east, west, tags):
+        candidates = self.features.sindex.query(box(west, south, east, north), predicate = 'intersects')
+        features = filter_by_tags(self.features.iloc[np.sort(candidates)], tags)
+        if len(features) == 0:
+            return gpd.GeoDataFrame()
+        return features.dropna(axis = 1, how = 'all')
+
+    ''' Selects all features with the given tags within a certain distance around a point
+        :param center_point: A (latitude, longitude) tuple
+        :param tags: A dictionary of OSM-style tags to be considered
+        :param dist: The distance in metres from the point to each edge of the queried box
+        :return: A GeoDataFrame of features
+    '''
+    def geometries_from_point(self, center_point, tags, dist = 1000):
+        return self.geometries_from_bbox(*bbox_from_point(center_point, dist), tags)
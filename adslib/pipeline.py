@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import shutil
+import threading
+import traceback
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from concurrent.futures import ThreadPoolExecutor
+
+from . import load_from_osm
+from .atomic import write_parquet, write_json
+from .spatial import latitude_column
+
+# The stages run for each partition, in order
+__STAGES__ = ['features', 'predictions']
+
+''' A batch runner scoring a set of properties end to end: the input, for example pulled with `access_load`, is split into
+    partitions, the OSM features of each partition are extracted with `load_from_osm.build_feature_matrix`, the rows are
+    turned into a design matrix with a fitted `assess.Preprocessor`, and scored with a fitted model, such as the one
+    returned by `address.cross_validation_train`.
+    The output of every stage is stored on disk for each partition, so that a rerun after a failure only repeats
+    the unfinished work. Partitions run concurrently on a pool of threads, and each one is processed in chunks of
+    a bounded number of rows. The time taken by each stage is recorded.
+    :param directory: The folder in which the partitions, the checkpoints and the predictions are stored
+    :param feature_spec: The OSM feature specification, as taken by `load_from_osm.build_feature_matrix`
+    :param preprocessor: A fitted `assess.Preprocessor`
+    :param model: A fitted model with a `predict` method taking the design matrix, such as statsmodels results
+    :param partition_size: The number of rows in each partition
+    :param chunk_size: The number of rows processed at a time within a partition
+    :param max_workers: The number of partitions processed at the same time
+    :param padding: How much to extend the box of each chunk by in each direction when fetching OSM features
+    :param tile_size: If given, the box of each chunk is fetched as tiles of roughly this size in degrees
+    :param cell_size: The size in degrees of the cells in which the input is spilled to disk while it is partitioned
+'''
+class ScoringPipeline:
+    def __init__(self, directory, feature_spec, preprocessor, model, partition_size = 10000, chunk_size = 2000, max_workers = 4,
+                 padding = 0.02, tile_size = None, cell_size = 0.1):
+        self.directory = directory
+        self.feature_spec = feature_spec
+        self.preprocessor = preprocessor
+        self.model = model
+        self.partition_size = partition_size
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.padding = padding
+        self.tile_size = tile_size
+        self.cell_size = cell_size
+        self.timings = []
+        self.failures = {}
+        self.__lock__ = threading.Lock()
+        os.makedirs(os.path.join(directory, 'partitions'), exist_ok = True)
+        os.makedirs(os.path.join(directory, 'predictions'), exist_ok = True)
+
+    ''' Splits the input into partitions stored on disk. Rows are sorted by location first, so that each partition and chunk
+        covers a small area, which keeps the OSM queries small. A stream of chunks is partitioned as it arrives: each chunk
+        is split into cells of `cell_size` degrees, which are appended to spill files on disk, and the cells are then read
+        back one at a time in spatial order. Only one cell and one partition are held in memory.
+        If the partitions already exist, they are reused when resuming, and the input is not read again.
+        :param data: A DataFrame with 'latitude' (or 'lattitude') and 'longitude' columns, or an iterable of such DataFrames,
+            such as `access_load.iter_price_coord_data_between_years`
+        :param resume: Whether to reuse existing partitions. Otherwise, existing partitions are an error, so that new input
+            is never silently ignored
+        :return: The list of partition names
+    '''
+    def partition(self, data, resume = False):
+        manifest_file = os.path.join(self.directory, 'partitions', 'manifest.json')
+        if os.path.exists(manifest_file):
+            if not resume:
+                raise ValueError("The directory %s already holds partitions. Pass resume = True to continue scoring them, "
+                                 "or use a new directory for new input." % self.directory)
+            with open(manifest_file) as file:
+                return json.load(file)
+        if data is None:
+            raise ValueError("The input data is required on the first run.")
+
+        start = time.time()
+        spill_directory = os.path.join(self.directory, 'partitions', 'spill')
+        # Spill files left by an interrupted run are incomplete
+        shutil.rmtree(spill_directory, ignore_errors = True)
+        os.makedirs(spill_directory)
+        # The rows of a stream are renumbered, since chunks have overlapping indices
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+        total = 0
+        for number, chunk in enumerate(chunks):
+            if not isinstance(data, pd.DataFrame):
+                chunk = chunk.set_axis(pd.RangeIndex(total, total + len(chunk)), axis = 0)
+            total += len(chunk)
+            cells = pd.DataFrame({'band': np.floor(chunk[latitude_column(chunk)].to_numpy() / self.cell_size).astype(int),
+                                  'column': np.floor(chunk.longitude.to_numpy() / self.cell_size).astype(int)})
+            for (band, column), positions in cells.groupby(['band', 'column']).indices.items():
+                cell_directory = os.path.join(spill_directory, '%d_%d' % (band, column))
+                os.makedirs(cell_directory, exist_ok = True)
+                chunk.iloc[positions].to_parquet(os.path.join(cell_directory, '%05d.parquet' % number))
+
+        names = []
+        pending = []
+        rows = 0
+        cells = sorted(tuple(int(part) for part in cell.split('_')) for cell in os.listdir(spill_directory))
+        for band, column in cells:
+            cell_directory = os.path.join(spill_directory, '%d_%d' % (band, column))
+            cell = pd.concat([pd.read_parquet(os.path.join(cell_directory, file)) for file in sorted(os.listdir(cell_directory))])
+            pending.append(cell.iloc[np.argsort(cell.longitude.to_numpy(), kind = 'stable')])
+            rows += len(cell)
+            while rows >= self.partition_size:
+                pending, rows = self.__write_partition__(pending, names), rows - self.partition_size
+        if rows > 0:
+            self.__write_partition__(pending, names)
+        shutil.rmtree(spill_directory)
+        write_json(names, manifest_file)
+        self.__record__('partition', None, total, time.time() - start, False)
+        return names
+
+    ''' Runs all stages on all partitions, skipping the stages whose output is already stored.
+        A failure in one partition does not stop the others, and is reported in `failures` with its traceback,
+        which is also stored in an 'error.txt' file of the partition.
+        :param data: The input, as taken by `partition`. It can be omitted when resuming, once the partitions are stored
+        :param resume: Whether to continue scoring existing partitions, for instance after a failure
+        :return: A DataFrame with the timings of every stage of every partition
+    '''
+    def run(self, data = None, resume = False):
+        names = self.partition(data, resume = resume or data is None)
+        self.failures = {}
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            for name, error in zip(names, executor.map(self.__run_partition__, names)):
+                if error is not None:
+                    self.failures[name] = error
+        if len(self.failures) > 0:
+            print("%d of %d partitions failed, rerun with resume = True to retry them: %s" % (len(self.failures), len(names), list(self.failures)))
+        return self.timing_summary()
+
+    ''' Reads the predictions of all finished partitions
+        :return: A DataFrame with the input columns and a 'prediction' column
+    '''
+    def predictions(self):
+        files = sorted(os.listdir(os.path.join(self.directory, 'predictions')))
+        frames = [pd.read_parquet(os.path.join(self.directory, 'predictions', file)) for file in files if file.endswith('.parquet')]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(frames)
+
+    ''' Summarizes the recorded timings
+        :return: A DataFrame with the rows, time and throughput of every stage of every partition
+    '''
+    def timing_summary(self):
+        timings = pd.DataFrame(self.timings, columns = ['stage', 'partition', 'rows', 'seconds', 'skipped'])
+        timings['rows_per_second'] = timings.rows / timings.seconds.clip(lower = 1e-9)
+        return timings
+
+    def __run_partition__(self, name):
+        error_file = os.path.join(self.__path__(name), 'error.txt')
+        try:
+            for stage in __STAGES__:
+                if os.path.exists(self.__path__(name, stage)):
+                    self.__record__(stage, name, None, 0, True)
+                    continue
+                start = time.time()
+                rows = getattr(self, '__' + stage + '__')(name)
+                self.__record__(stage, name, rows, time.time() - start, False)
+            if os.path.exists(error_file):
+                os.remove(error_file)
+            return None
+        except Exception:
+            error = traceback.format_exc()
+            with open(error_file, 'w') as file:
+                file.write(error)
+            return error
+
+    def __write_partition__(self, pending, names):
+        frame = pd.concat(pending)
+        name = '%05d' % len(names)
+        os.makedirs(self.__path__(name), exist_ok = True)
+        write_parquet(frame.iloc[:self.partition_size], self.__path__(name, 'input'))
+        names.append(name)
+        return [frame.iloc[self.partition_size:]]
+
+    def __features__(self, name):
+        data = pd.read_parquet(self.__path__(name, 'input'))
+        features = [load_from_osm.build_feature_matrix(data.iloc[begin:begin + self.chunk_size], self.feature_spec,
+                                                       padding = self.padding, tile_size = self.tile_size)
+                    for begin in range(0, len(data), self.chunk_size)]
+        features = pd.concat(features) if len(features) > 0 else pd.DataFrame(index = data.index)
+        write_parquet(features, self.__path__(name, 'features'))
+        return len(features)
+
+    def __predictions__(self, name):
+        data = pd.read_parquet(self.__path__(name, 'input')).join(pd.read_parquet(self.__path__(name, 'features')))
+        predictions = []
+        for begin in range(0, len(data), self.chunk_size):
+            design_matrix = self.preprocessor.transform(data.iloc[begin:begin + self.chunk_size], drop_outliers = False)
+            if scipy.sparse.issparse(design_matrix):
+                design_matrix = design_matrix.toarray()
+            predictions.append(np.asarray(self.model.predict(design_matrix)))
+        data['prediction'] = np.concatenate(predictions) if len(predictions) > 0 else []
+        write_parquet(data, os.path.join(self.directory, 'predictions', name + '.parquet'))
+        # The stage is marked as finished only once its predictions are stored
+        write_parquet(data[['prediction']], self.__path__(name, 'predictions'))
+        return len(data)
+
+    def __record__(self, stage, name, rows, seconds, skipped):
+        with self.__lock__:
+            self.timings.append((stage, name, rows, seconds, skipped))
+
+    def __path__(self, name, stage = None):
+        if stage is None:
+            return os.path.join(self.directory, 'partitions', name)
+        return os.path.join(self.directory, 'partitions', name, stage + '.parquet')
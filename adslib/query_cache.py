@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .config import config
+from .atomic import write_json
+from .instrument import increment
+from .lazy import LazyModule
+
+# pandas is only imported once results are stored on or read from disk
+pd = LazyModule('pandas')
+
+__active_cache__ = None
+
+''' A cache of query results, with an in-memory LRU tier and an optional Parquet tier on disk.
+    Each entry records the version of every table it was computed from. Reloading a table bumps its version,
+    which invalidates all entries depending on it.
+    :param directory: The folder of the on-disk tier, or None to only keep results in memory
+    :param max_entries: The maximum number of results kept in memory
+    :param max_bytes: The maximum total size of the results stored on disk
+    :param ttl: The number of seconds after which a result expires, or None to keep results until invalidated
+'''
+class QueryCache:
+    def __init__(self, directory = None, max_entries = 128, max_bytes = 1024**3, ttl = None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__memory__ = OrderedDict()
+        self.__lock__ = threading.RLock()
+        self.__versions__ = {}
+        self.__index__ = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok = True)
+            if os.path.exists(self.__path__('index.json')):
+                with open(self.__path__('index.json')) as file:
+                    self.__index__ = json.load(file)
+
+    ''' Builds the key of a query from the function name, the database and the normalized parameters
+        :param function_name: The name of the query function
+        :param conn: The pymysql connection used by the query
+        :param params: A dictionary of the parameters of the query, including the sampling seed
+        :return: A hexadecimal key
+    '''
+    def key(self, function_name, conn, params):
+        database = getattr(conn, 'db', None)
+        database = database.decode() if isinstance(database, bytes) else database
+        description = [function_name, getattr(conn, 'host', None), getattr(conn, 'port', None), database, params]
+        return hashlib.sha1(json.dumps(description, sort_keys = True, default = str).encode()).hexdigest()
+
+    ''' Returns the current versions of a set of tables
+        :param tables: A list of table names
+        :return: A dictionary from table name to version
+    '''
+    def table_versions(self, tables):
+        with self.__lock__:
+            versions = self.__load_versions__()
+            return {table: versions.get(table, 0) for table in tables}
+
+    ''' Increases the version of a table, invalidating all results depending on it
+        :param table_name: The name of the table
+    '''
+    def bump_table_version(self, table_name):
+        with self.__lock__:
+            versions = self.__load_versions__()
+            versions[table_name] = versions.get(table_name, 0) + 1
+            self.__versions__ = versions
+            if self.directory is not None:
+                write_json(versions, self.__path__('table_versions.json'))
+
+    ''' Looks up a result, first in memory and then on disk
+        :param key: The key of the query
+        :param tables: The tables the query depends on
+        :return: The result, or None if there is no valid entry
+    '''
+    def get(self, key, tables):
+        with self.__lock__:
+            versions = self.table_versions(tables)
+            if key in self.__memory__:
+                result, created, entry_versions = self.__memory__[key]
+                if entry_versions == versions and not self.__expired__(created):
+                    self.__memory__.move_to_end(key)
+                    self.hits += 1
+                    increment('query_cache', cache_hits = 1)
+                    return __copy_result__(result)
+                del self.__memory__[key]
+
+            entry = self.__index__.get(key)
+            if entry is not None:
+                if entry['versions'] == versions and not self.__expired__(entry['created']):
+                    result = __from_frame__(pd.read_parquet(self.__path__(key + '.parquet')), entry['kind'])
+                    entry['accessed'] = time.time()
+                    self.__save_index__()
+                    self.__remember__(key, result, entry['created'], versions)
+                    self.hits += 1
+                    increment('query_cache', cache_hits = 1)
+                    return __copy_result__(result)
+                self.__remove__(key)
+                self.__save_index__()
+            self.misses += 1
+            increment('query_cache', cache_misses = 1)
+            return None
+
+    ''' Stores a result in memory and, if the cache has a directory, on disk
+        :param key: The key of the query
+        :param tables: The tables the query depends on
+        :param result: A sequence of rows or a DataFrame
+    '''
+    def put(self, key, tables, result):
+        with self.__lock__:
+            versions = self.table_versions(tables)
+            created = time.time()
+            self.__remember__(key, __copy_result__(result), created, versions)
+            if self.directory is None:
+                return
+            frame, kind = __to_frame__(result)
+            frame.to_parquet(self.__path__(key + '.parquet'))
+            self.__index__[key] = {'kind': kind, 'versions': versions, 'created': created, 'accessed': created,
+                                   'bytes': os.path.getsize(self.__path__(key + '.parquet'))}
+            self.__evict__()
+            self.__save_index__()
+
+    ''' Removes all stored results
+    '''
+    def clear(self):
+        with self.__lock__:
+            self.__memory__.clear()
+            for key in list(self.__index__):
+                self.__remove__(key)
+            self.__save_index__()
+
+    def __path__(self, name):
+        return os.path.join(self.directory, name)
+
+    def __expired__(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def __load_versions__(self):
+        if self.directory is not None and os.path.exists(self.__path__('table_versions.json')):
+            with open(self.__path__('table_versions.json')) as file:
+                self.__versions__ = json.load(file)
+        return dict(self.__versions__)
+
+    def __remember__(self, key, result, created, versions):
+        self.__memory__[key] = (result, created, versions)
+        self.__memory__.move_to_end(key)
+        while len(self.__memory__) > self.max_entries:
+            self.__memory__.popitem(last = False)
+
+    def __evict__(self):
+        total_bytes = sum(entry['bytes'] for entry in self.__index__.values())
+        for key in sorted(self.__index__, key = lambda k: self.__index__[k]['accessed']):
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self.__index__[key]['bytes']
+            self.__remove__(key)
+
+    def __remove__(self, key):
+        self.__index__.pop(key)
+        if os.path.exists(self.__path__(key + '.parquet')):
+            os.remove(self.__path__(key + '.parquet'))
+
+    def __save_index__(self):
+        if self.directory is None:
+            return
+        write_json(self.__index__, self.__path__('index.json'))
+
+''' Private method to copy a DataFrame result, so that a caller modifying what it gets does not change the stored entry.
+    Sequences of rows are tuples, which cannot be modified, and are shared.
+    :param result: A sequence of rows or a DataFrame
+    :return: The result, or a copy of it
+'''
+def __copy_result__(result):
+    if hasattr(result, 'copy') and not isinstance(result, tuple):
+        return result.copy()
+    return result
+
+''' Private method to convert a query result into a DataFrame, which can be stored as Parquet
+    :param result: A sequence of rows or a DataFrame
+    :return: The DataFrame and the kind of the original result
+'''
+def __to_frame__(result):
+    if isinstance(result, pd.DataFrame):
+        return result, 'frame'
+    frame = pd.DataFrame.from_records(list(result))
+    frame.columns = [str(column) for column in frame.columns]
+    return frame, 'rows'
+
+''' Private method to convert a stored DataFrame back into the original kind of result
+    :param frame: The stored DataFrame
+    :param kind: 'frame' or 'rows'
+    :return: The result
+'''
+def __from_frame__(frame, kind):
+    if kind == 'frame':
+        return frame
+    return tuple(frame.itertuples(index = False, name = None))
+
+''' Sets the cache used by all cached queries
+    :param cache: A QueryCache, or None to disable caching
+    :return: The previously used cache
+'''
+def set_query_cache(cache):
+    global __active_cache__
+    previous = __active_cache__
+    __active_cache__ = cache
+    return previous
+
+''' Returns the cache used by all cached queries. Unless one has been set, a cache is created if
+    'query_cache_directory' is configured, and otherwise caching is disabled.
+    :return: A QueryCache or None
+'''
+def get_query_cache():
+    global __active_cache__
+    if __active_cache__ is None and config.get('query_cache_directory'):
+        __active_cache__ = QueryCache(os.path.expanduser(config['query_cache_directory']),
+                                      max_entries = config.get('query_cache_max_entries', 128),
+                                      max_bytes = config.get('query_cache_max_bytes', 1024**3),
+                                      ttl = config.get('query_cache_ttl'))
+    return __active_cache__
+
+''' Enables a cache for the duration of a with block
+    :param cache: A QueryCache, by default an in-memory one
+    :return: A context manager yielding the cache
+'''
+@contextmanager
+def use_query_cache(cache = None):
+    cache = QueryCache() if cache is None else cache
+    previous = set_query_cache(cache)
+    try:
+        yield cache
+    finally:
+        set_query_cache(previous)
+
+''' Increases the version of a table in the active cache, invalidating all results depending on it
+    :param table_name: The name of the table
+'''
+def bump_table_version(table_name):
+    cache = get_query_cache()
+    if cache is not None:
+        cache.bump_table_version(table_name)
+
+''' Decorator making a query function use the active cache. The function must take a connection as its first argument.
+    Functions taking a sampling seed are only cached when a seed is given, since an unseeded sample is meant to differ between calls.
+    :param tables: The tables the query depends on. Each is either a table name, or a function from the
+        parameters of the call to a table name
+    :return: The decorator
+'''
+def cached_query(*tables):
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(conn, *args, **kwargs):
+            cache = get_query_cache()
+            if cache is None:
+                return function(conn, *args, **kwargs)
+            bound = signature.bind(conn, *args, **kwargs)
+            bound.apply_defaults()
+            params = dict(list(bound.arguments.items())[1:])
+            if 'seed' in params and params['seed'] is None:
+                return function(conn, *args, **kwargs)
+            dependencies = [table(params) if callable(table) else table for table in tables]
+            key = cache.key(function.__name__, conn, params)
+            result = cache.get(key, dependencies)
+            if result is None:
+                result = function(conn, *args, **kwargs)
+                cache.put(key, dependencies, result)
+            return result
+        return wrapper
+    return decorator
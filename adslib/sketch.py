@@ -0,0 +1,94 @@
+import math
+import numpy as np
+
+''' A mergeable streaming quantile sketch (KLL, Karnin, Lang and Liberty, 2016).
+    Values are kept in a hierarchy of compactors, where a value at level h stands for 2^h input values.
+    When a level is full, it is sorted and every other value, starting at a random offset, is promoted to the next level.
+    The capacity of the levels decreases geometrically towards the bottom, so the sketch keeps O(k) values.
+
+    Error bound: the rank of the value returned for any quantile differs from the requested rank by at most about
+    1.7 / k * n with high probability, independently of the distribution of the data, and typically by less than
+    half of that (k = 200 gives a rank error of under 1%, i.e. the 0.25 quantile lies between the exact 0.24 and 0.26 quantiles).
+    Merging sketches built on partitions gives the same guarantee as a single sketch over all the data.
+    :param k: The capacity of the top level, controlling the trade-off between accuracy and memory
+    :param random_state: A seed for the random compaction offsets
+'''
+class KLLSketch:
+    def __init__(self, k = 200, random_state = None):
+        self.k = k
+        self.n = 0
+        self.compactors = [np.empty(0)]
+        self.__generator__ = np.random.default_rng(random_state)
+
+    ''' Adds values to the sketch. Missing values are ignored.
+        :param values: A number or an array of numbers
+        :return: The sketch
+    '''
+    def update(self, values):
+        values = np.asarray(values, dtype = float).ravel()
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self.__compress__()
+        return self
+
+    ''' Adds the values summarized by another sketch
+        :param other: A KLLSketch
+        :return: The sketch
+    '''
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, items in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], items])
+        self.n += other.n
+        self.__compress__()
+        return self
+
+    ''' Estimates quantiles of the values added to the sketch
+        :param q: A quantile or an array of quantiles between 0 and 1
+        :return: The estimated quantiles, as a number or an array
+    '''
+    def quantile(self, q):
+        if self.n == 0:
+            raise ValueError("Cannot compute quantiles of an empty sketch.")
+        items, cumulative_weights = self.__sorted_items__()
+        positions = np.searchsorted(cumulative_weights, np.asarray(q, dtype = float) * self.n, side = 'left')
+        return items[np.minimum(positions, len(items) - 1)]
+
+    ''' Estimates the fraction of the values added to the sketch which are smaller than or equal to a value
+        :param value: A number or an array of numbers
+        :return: The estimated normalized ranks
+    '''
+    def rank(self, value):
+        items, cumulative_weights = self.__sorted_items__()
+        positions = np.searchsorted(items, np.asarray(value, dtype = float), side = 'right')
+        return np.concatenate([[0], cumulative_weights])[positions] / self.n
+
+    def __len__(self):
+        return sum(len(items) for items in self.compactors)
+
+    def __sorted_items__(self):
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(compactor), 2**level) for level, compactor in enumerate(self.compactors)])
+        order = np.argsort(items, kind = 'stable')
+        return items[order], np.cumsum(weights[order])
+
+    def __capacity__(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3)**depth)))
+
+    def __compress__(self):
+        while len(self) > sum(self.__capacity__(level) for level in range(len(self.compactors))):
+            for level in range(len(self.compactors)):
+                if len(self.compactors[level]) >= self.__capacity__(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append(np.empty(0))
+                    items = np.sort(self.compactors[level])
+                    # An odd value out stays at its level, so that the total weight is preserved
+                    kept = items[len(items) - len(items) % 2:]
+                    items = items[:len(items) - len(items) % 2]
+                    offset = self.__generator__.integers(2)
+                    self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], items[offset::2]])
+                    self.compactors[level] = kept
+                    break
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from functools import lru_cache
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+from shapely.geometry import box
+
+from .instrument import instrumented
+
+''' Private method returning a shared transformer from WGS84 coordinates to a projected CRS
+    :param crs: The target CRS
+    :return: A pyproj Transformer taking (longitude, latitude) pairs
+'''
+@lru_cache(maxsize = None)
+def __transformer__(crs):
+    return Transformer.from_crs(4326, crs, always_xy = True)
+
+''' A set of points, whose projection is computed once and reused by every method that needs it.
+    It can be passed to any method in `load_from_osm` expecting a DataFrame of buildings, and exposes the raw
+    easting/northing arrays, so that distances can be computed without creating shapely objects.
+    :param latitude: An array of latitudes
+    :param longitude: An array of longitudes
+    :param index: The index of the points, by default a range
+    :param crs: The projected CRS, by default the British National Grid
+'''
+class ProjectedPoints:
+    def __init__(self, latitude, longitude, index = None, crs = 27700):
+        index = pd.RangeIndex(len(latitude)) if index is None else index
+        self.index = index
+        self.crs = crs
+        self.latitude = pd.Series(np.asarray(latitude, dtype = float), index = index)
+        self.longitude = pd.Series(np.asarray(longitude, dtype = float), index = index)
+        self.easting, self.northing = __transformer__(crs).transform(self.longitude.to_numpy(), self.latitude.to_numpy())
+        self.__geoseries__ = None
+
+    ''' Prepares the points of a DataFrame with 'latitude' (or 'lattitude') and 'longitude' columns
+        :param data: The DataFrame
+        :param crs: The projected CRS
+        :return: The ProjectedPoints, with the index of the DataFrame
+    '''
+    @classmethod
+    @instrumented('reprojection')
+    def from_dataframe(cls, data, crs = 27700):
+        return cls(data[latitude_column(data)].to_numpy(), data.longitude.to_numpy(), index = data.index, crs = crs)
+
+    def __len__(self):
+        return len(self.index)
+
+    ''' The projected coordinates as a (n, 2) array
+    '''
+    @property
+    def xy(self):
+        return np.column_stack([self.easting, self.northing])
+
+    ''' The projected points as a GeoSeries, which is only created when first needed
+    '''
+    @property
+    def geoseries(self):
+        if self.__geoseries__ is None:
+            self.__geoseries__ = gpd.GeoSeries(gpd.points_from_xy(self.easting, self.northing), index = self.index, crs = self.crs)
+        return self.__geoseries__
+
+''' Finds the latitude column of a DataFrame. The tables of the database, and so the frames returned by `access_load`,
+    spell it 'lattitude', while the frames built in the notebooks use 'latitude'
+    :param data: A DataFrame
+    :return: 'latitude' or 'lattitude'
+'''
+def latitude_column(data):
+    for column in ['latitude', 'lattitude']:
+        if column in data.columns:
+            return column
+    raise ValueError("The data has no 'latitude' or 'lattitude' column.")
+
+''' Returns the prepared points for a DataFrame, or the points themselves if they are already prepared
+    :param data: A DataFrame with 'latitude' (or 'lattitude') and 'longitude' columns, or ProjectedPoints
+    :return: ProjectedPoints
+'''
+def as_projected_points(data):
+    if isinstance(data, ProjectedPoints):
+        return data
+    return ProjectedPoints.from_dataframe(data)
+
+''' Extracts the planar coordinates of a set of points
+    :param points: ProjectedPoints, or a GeoSeries of points in a projected CRS
+    :return: A (n, 2) array of x/y coordinates
+'''
+def __coordinates__(points):
+    if isinstance(points, ProjectedPoints):
+        return points.xy
+    return np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+
+''' Nearest-neighbour engine over the centroids of a set of OSM features.
+    The centroids are computed once in the British National Grid (EPSG:27700), so that all distances are in metres,
+    and stored in a KD-tree, which allows answering the queries for all points at once.
+    :param features: A GeoDataFrame or GeoSeries of features
+    :param crs: The projected CRS in which distances are measured
+'''
+class FeatureIndex:
+    def __init__(self, features, crs = 27700):
+        self.crs = crs
+        self.centroids = features.to_crs(crs).geometry.centroid
+        self.tree = cKDTree(__coordinates__(self.centroids))
+
+    ''' Builds an index over already projected centroids, avoiding the reprojection
+        :param centroids: A GeoSeries of points in a projected CRS
+        :return: A FeatureIndex
+    '''
+    @classmethod
+    def from_centroids(cls, centroids):
+        index = cls.__new__(cls)
+        index.crs = centroids.crs
+        index.centroids = centroids
+        index.tree = cKDTree(__coordinates__(centroids))
+        return index
+
+    def __len__(self):
+        return len(self.centroids)
+
+    ''' Finds the closest feature to each point
+        :param points: ProjectedPoints, or a GeoSeries of points in the CRS of the index
+        :param distance_limit: The distance under which a match is considered valid
+        :return: The positional index of the closest feature, the distance to it and whether it is within the limit
+    '''
+    @instrumented('nearest_feature', size = lambda result: len(result[1]))
+    def nearest(self, points, distance_limit = None):
+        distances, indices = self.tree.query(__coordinates__(points), k = 1)
+        if distance_limit is None:
+            within = np.full(len(distances), True)
+        else:
+            within = distances < distance_limit
+        return indices, distances, within
+
+    ''' Counts the features within a given distance of each point
+        :param points: ProjectedPoints, or a GeoSeries of points in the CRS of the index
+        :param radius: The maximum distance away from the point to be considered
+        :return: An array with the number of features around each point
+    '''
+    @instrumented('count_within')
+    def count_within(self, points, radius):
+        return self.tree.query_ball_point(__coordinates__(points), r = radius, return_length = True)
+
+''' Finds which features intersect each of a set of bounding boxes
+    :param features: A GeoDataFrame of features
+    :param north: An array with the north edges of the boxes
+    :param south: An array with the south edges of the boxes
+    :param east: An array with the east edges of the boxes
+    :param west: An array with the west edges of the boxes
+    :return: Two arrays with the positional indices of the box and of the feature for each intersecting pair
+'''
+def features_in_boxes(features, north, south, east, west):
+    boxes = gpd.GeoSeries([box(*edges) for edges in zip(west, south, east, north)], crs = features.crs)
+    box_positions, feature_positions = features.sindex.query(boxes, predicate = 'intersects')
+    return box_positions, feature_positions
@@ -22,19 +22,22 @@ DESCRIPTION = "Library used for the implementation of the assignment for the Dat
 URL = "https://github.com/1414vo/adslib"
 EMAIL = "1414vo@gmail.com"
 AUTHOR = "Ivo Petrov"
-REQUIRES_PYTHON = ">=3.6.0"
+REQUIRES_PYTHON = ">=3.7.0"
 VERSION = "1.0.0"
 
 # What packages are required for this module to be executed?
 REQUIRED = [
     "pandas", "numpy", "jupyter", "geopandas",
     "pyyaml", "osmnx", "shapely", "scikit-learn",
-    "statsmodels"
+    "statsmodels", "scipy"
 ]
 
 # What packages are optional?
 EXTRAS = {
     "interactive html plots": ["bokeh",],
+    "osm cache": ["pyarrow",],
+    "offline osm": ["osmium", "pyarrow",],
+    "feature store": ["pyarrow",],
 }
 
 PACKAGE_DATA = {"adslib": ["defaults.yml"]}
@@ -130,7 +133,7 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: Implementation :: CPython",
         "Programming Language :: Python :: Implementation :: PyPy"
     ],
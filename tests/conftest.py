@@ -0,0 +1,17 @@
+import pytest
+
+from adslib import access_store
+from adslib.benchmark import SQLiteConnection, create_local_price_tables, write_synthetic_price_csvs
+
+''' A local SQLite stand-in for the database, with synthetic `pp_data` and `postcode_data` tables loaded from csv files
+    :return: The connection and the locations of the `pp_data` and `postcode_data` files
+'''
+@pytest.fixture
+def price_database(tmp_path):
+    price_file, postcode_file = write_synthetic_price_csvs(str(tmp_path), 2000, bounds = (52.25, 52.15, 0.2, 0.05), seed = 0)
+    conn = SQLiteConnection()
+    create_local_price_tables(conn)
+    access_store.save_local_data_in_table(conn, 'postcode_data', postcode_file, method = 'chunked')
+    access_store.save_local_data_in_table(conn, 'pp_data', price_file, method = 'chunked')
+    yield conn, price_file, postcode_file
+    conn.close()
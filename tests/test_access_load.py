@@ -0,0 +1,115 @@
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from adslib import access_load, access_store
+
+''' Counts how often each row of a table is drawn over many seeded samples
+'''
+def __inclusion_counts__(conn, sampling, samples, limit):
+    counts = {}
+    for seed in range(samples):
+        for row in access_load.get_row_sample.__wrapped__(conn, 'postcode_data', limit = limit, sampling = sampling, seed = seed):
+            counts[row[-1]] = counts.get(row[-1], 0) + 1
+    return counts
+
+def test_key_sampling_has_the_distribution_of_rand_sampling(price_database):
+    conn, _, _ = price_database
+    # Gaps in the key must not bias the sample
+    cur = conn.cursor()
+    cur.execute('DELETE FROM postcode_data WHERE db_id % 3 = 0')
+    cur.execute('SELECT db_id FROM postcode_data')
+    keys = [row[0] for row in cur.fetchall()]
+    samples, limit = 600, 10
+
+    expected = samples * limit / len(keys)
+    for sampling in ['key', 'rand']:
+        counts = __inclusion_counts__(conn, sampling, samples, limit)
+        assert set(counts) <= set(keys)
+        observed = np.array([counts.get(key, 0) for key in keys])
+        # Every row is equally likely under both strategies
+        assert stats.chisquare(observed, np.full(len(keys), expected)).pvalue > 0.001
+
+def test_key_sampling_returns_distinct_existing_rows(price_database):
+    conn, _, _ = price_database
+    rows = access_load.get_row_sample.__wrapped__(conn, 'pp_data', limit = 50, sampling = 'key', seed = 1)
+    assert len(rows) == 50
+    assert len({row[-1] for row in rows}) == 50
+    assert rows == access_load.get_row_sample.__wrapped__(conn, 'pp_data', limit = 50, sampling = 'key', seed = 1)
+    everything = access_load.get_row_sample.__wrapped__(conn, 'postcode_data', limit = 1000, sampling = 'key', seed = 1)
+    assert len(everything) == 100
+
+def test_key_sampling_does_not_materialize_the_key_range(price_database):
+    conn, _, _ = price_database
+    cur = conn.cursor()
+    # A single distant key makes the range 5 million keys wide, which would take 40 MB as an array
+    cur.execute("INSERT INTO pp_data (transaction_unique_identifier, price, db_id) VALUES ('outlier', 1, 5000000)")
+    tracemalloc.start()
+    try:
+        rows = access_load.get_row_sample.__wrapped__(conn, 'pp_data', limit = 10, sampling = 'key', seed = 0)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(rows) == 10
+    assert peak < 10 * 1024**2
+
+''' Runs the box and radius queries, without the query cache, and returns their rows in a canonical order
+'''
+def __coordinate_query_rows__(conn, use_spatial_index):
+    box = access_load.get_price_coord_data_between_years_for_coordinate_area.__wrapped__(
+        conn, 52.22, 0.15, 52.18, 0.1, limit = 100000, use_spatial_index = use_spatial_index)
+    radius = access_load.get_price_coord_data_between_years_within_radius.__wrapped__(
+        conn, 52.2, 0.12, 2000, limit = 100000, use_spatial_index = use_spatial_index)
+    return sorted(map(tuple, box), key = repr), sorted(map(tuple, radius), key = repr)
+
+def test_spatial_index_queries_match_the_coordinate_queries(price_database):
+    conn, _, _ = price_database
+    expected = __coordinate_query_rows__(conn, False)
+    assert all(len(rows) > 0 for rows in expected)
+    access_store.create_spatial_index(conn)
+    assert access_store.postcode_coordinates_fresh(conn)
+    assert __coordinate_query_rows__(conn, True) == expected
+    # The spatial index is also used by the queries on the materialized table
+    access_store.build_prices_coordinates(conn)
+    assert __coordinate_query_rows__(conn, True) == expected
+
+def test_spatial_index_is_ignored_after_postcodes_are_reloaded(price_database):
+    conn, _, postcode_file = price_database
+    access_store.create_spatial_index(conn)
+    cur = conn.cursor()
+    # Moving the postcodes is only seen by the queries if the outdated index is not used
+    cur.execute('DELETE FROM postcode_data')
+    conn.commit()
+    access_store.save_local_data_in_table(conn, 'postcode_data', postcode_file, method = 'chunked')
+    cur.execute('UPDATE postcode_data SET longitude = longitude + 0.01')
+    conn.commit()
+    assert not access_store.postcode_coordinates_fresh(conn)
+    assert __coordinate_query_rows__(conn, True) == __coordinate_query_rows__(conn, False)
+    access_store.create_spatial_index(conn)
+    assert access_store.postcode_coordinates_fresh(conn)
+    assert __coordinate_query_rows__(conn, True) == __coordinate_query_rows__(conn, False)
+
+def test_streamed_chunks_have_the_same_dtypes(price_database):
+    conn, _, _ = price_database
+    cur = conn.cursor()
+    cur.execute('''SELECT COUNT(*) FROM pp_data pp INNER JOIN postcode_data pc ON pp.postcode = pc.postcode
+                   WHERE date_of_transfer BETWEEN '1995-01-01' AND '2022-12-31' ''')
+    total = cur.fetchone()[0]
+    chunks = list(access_load.iter_price_coord_data_between_years(conn, chunk_size = 300))
+    assert sum(map(len, chunks)) == total and all(len(chunk) == 300 for chunk in chunks[:-1])
+    dtypes = chunks[0].dtypes
+    assert dtypes['date_of_transfer'].kind == 'M' and dtypes['price'].kind in 'iuf'
+    assert dtypes['lattitude'] == float and dtypes['longitude'] == float
+    for column, categories in access_load.__CATEGORIES__.items():
+        assert list(dtypes[column].categories) == categories
+    # The categories are fixed, so the chunks can be concatenated without falling back to objects
+    assert all(chunk.dtypes.equals(dtypes) for chunk in chunks)
+    assert access_load.read_query_frame(conn, 'SELECT * FROM pp_data', chunk_size = 700).property_type.dtype == dtypes['property_type']
+    # The materialized table returns the same frames
+    access_store.build_prices_coordinates(conn)
+    materialized = list(access_load.iter_price_coord_data_between_years(conn, chunk_size = 300))
+    assert all(chunk.dtypes.equals(dtypes) for chunk in materialized)
+    key = list(dtypes.index)
+    pd.testing.assert_frame_equal(pd.concat(materialized).sort_values(key).reset_index(drop = True),
+                                  pd.concat(chunks).sort_values(key).reset_index(drop = True))
@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import pandas as pd
+import pymysql
+import pytest
+
+from adslib import access_load, access_store, benchmark
+from adslib.benchmark import SQLiteConnection, create_local_price_tables, write_synthetic_price_csvs
+
+class __FakeConnection__:
+    def __init__(self):
+        self.closed = False
+
+    def ping(self, reconnect = True):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def test_pool_closes_connections_left_by_any_exception():
+    created = []
+    def factory():
+        created.append(__FakeConnection__())
+        return created[-1]
+    pool = access_store.ConnectionPool(None, None, None, None, size = 1, connection_factory = factory)
+    with pytest.raises(KeyError):
+        with pool.connection():
+            raise KeyError('not a database error')
+    assert created[0].closed
+    # The slot is released, and a healthy connection is reused
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second and not first.closed
+    assert len(created) == 2
+
+def __csv_rows__(file_location):
+    with open(file_location) as file:
+        return sum(1 for _ in file) - 1
+
+def test_chunked_load_inserts_every_row(tmp_path):
+    price_file, _ = write_synthetic_price_csvs(str(tmp_path), 1000, seed = 0)
+    conn = SQLiteConnection()
+    create_local_price_tables(conn)
+    stats = access_store.save_local_data_in_table(conn, 'pp_data', price_file, method = 'auto', batch_size = 300)
+    assert stats['rows'] == 1000 and stats['rows_per_second'] > 0
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*), COUNT(DISTINCT transaction_unique_identifier), MIN(price) FROM pp_data')
+    count, distinct, lowest = cur.fetchone()
+    assert count == distinct == 1000
+    assert lowest == pd.read_csv(price_file).price.min()
+    cur.execute('SELECT COUNT(*) FROM load_progress')
+    assert cur.fetchone() == (0,)
+    conn.close()
+
+@pytest.mark.parametrize('failing_method', ['executemany', 'commit'])
+def test_failed_chunked_load_resumes_from_its_checkpoint(tmp_path, monkeypatch, failing_method):
+    price_file, _ = write_synthetic_price_csvs(str(tmp_path), 1000, seed = 0)
+    conn = SQLiteConnection()
+    create_local_price_tables(conn)
+    # The third chunk fails either while its rows are sent, or while they are committed after being sent
+    executemany, commit = benchmark.__SQLiteCursor__.executemany, SQLiteConnection.commit
+    chunks = []
+    def failing_executemany(self, query, rows):
+        chunks.append(len(rows))
+        if len(chunks) == 3 and failing_method == 'executemany':
+            raise sqlite3.OperationalError('connection lost')
+        return executemany(self, query, rows)
+    def failing_commit(self):
+        if len(chunks) == 3 and failing_method == 'commit':
+            raise sqlite3.OperationalError('connection lost')
+        return commit(self)
+    monkeypatch.setattr(benchmark.__SQLiteCursor__, 'executemany', failing_executemany)
+    monkeypatch.setattr(SQLiteConnection, 'commit', failing_commit)
+    with pytest.raises(sqlite3.OperationalError):
+        access_store.save_local_data_in_table(conn, 'pp_data', price_file, method = 'chunked', batch_size = 300)
+    monkeypatch.undo()
+    cur = conn.cursor()
+    cur.execute('SELECT committed_rows FROM load_progress')
+    assert cur.fetchone() == (600,)
+    cur.execute('SELECT COUNT(*) FROM pp_data')
+    assert cur.fetchone() == (600,)
+
+    stats = access_store.save_local_data_in_table(conn, 'pp_data', price_file, method = 'chunked', batch_size = 300, resume = True)
+    assert stats['rows'] == 400
+    cur.execute('SELECT COUNT(*), COUNT(DISTINCT transaction_unique_identifier) FROM pp_data')
+    assert cur.fetchone() == (1000, 1000)
+    cur.execute('SELECT COUNT(*) FROM load_progress')
+    assert cur.fetchone() == (0,)
+    conn.close()
+
+''' A connection of a MariaDB server which accepts LOAD DATA LOCAL INFILE, recording the statements
+'''
+class __InfileConnection__:
+    def __init__(self, columns, fail = False):
+        self.columns = columns
+        self.fail = fail
+        self.statements = []
+        self.rolled_back = False
+
+    def cursor(self):
+        return __InfileCursor__(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rolled_back = True
+
+class __InfileCursor__:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, args = None):
+        self.connection.statements.append((query, args))
+        if query.startswith('SHOW GLOBAL VARIABLES'):
+            self.rows = [('local_infile', 'ON')]
+        elif query.startswith('SHOW COLUMNS'):
+            self.rows = [(column, 'text') for column in self.connection.columns]
+        elif query.startswith('LOAD DATA'):
+            if self.connection.fail:
+                raise pymysql.err.OperationalError(1148, 'The used command is not allowed with this MariaDB version')
+            return 1000
+        return 0
+
+    def executemany(self, query, rows):
+        self.connection.statements.append((query, rows))
+        return len(rows)
+
+    def fetchone(self):
+        return self.rows.pop(0) if len(self.rows) > 0 else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+def test_load_data_infile_is_used_when_the_server_allows_it(tmp_path):
+    price_file, _ = write_synthetic_price_csvs(str(tmp_path), 1000, seed = 0)
+    columns = list(pd.read_csv(price_file, nrows = 0).columns) + ['db_id']
+    conn = __InfileConnection__(columns)
+    stats = access_store.save_local_data_in_table(conn, 'pp_data', price_file)
+    assert stats['rows'] == 1000
+    loads = [(query, args) for query, args in conn.statements if query.startswith('LOAD DATA')]
+    assert len(loads) == 1
+    query, args = loads[0]
+    assert args == (os.path.abspath(price_file),)
+    assert "LINES TERMINATED BY '\\n'" in query and 'IGNORE 1 LINES' in query
+    # Every column of the file but the key is filled, with the same transformation as the chunked insertion
+    assert "price = IFNULL(@c1, '0')" in query and 'db_id' not in query
+    assert not any(query.startswith('INSERT') for query, _ in conn.statements)
+
+def test_failed_load_data_infile_falls_back_to_chunks_unless_required(tmp_path):
+    price_file, _ = write_synthetic_price_csvs(str(tmp_path), 1000, seed = 0)
+    columns = list(pd.read_csv(price_file, nrows = 0).columns) + ['db_id']
+    conn = __InfileConnection__(columns, fail = True)
+    stats = access_store.save_local_data_in_table(conn, 'pp_data', price_file, batch_size = 400)
+    assert stats['rows'] == 1000 and conn.rolled_back
+    assert [len(rows) for query, rows in conn.statements if query.startswith('INSERT INTO pp_data')] == [400, 400, 200]
+
+    with pytest.raises(pymysql.err.OperationalError):
+        access_store.save_local_data_in_table(__InfileConnection__(columns, fail = True), 'pp_data', price_file, method = 'infile')
+
+''' Counts the rows of the join of the price and postcode tables
+'''
+def __join_count__(conn):
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM pp_data pp INNER JOIN postcode_data pc ON pp.postcode = pc.postcode')
+    return cur.fetchone()[0]
+
+def test_prices_coordinates_is_refreshed_from_its_watermark(price_database):
+    conn, _, postcode_file = price_database
+    first = access_store.build_prices_coordinates(conn)
+    assert first['watermark'] is None and first['rows'] == __join_count__(conn)
+    assert access_store.prices_coordinates_fresh(conn)
+
+    # New transactions get keys above the watermark, and only they are appended
+    cur = conn.cursor()
+    cur.execute('SELECT MAX(db_id) FROM pp_data')
+    watermark = cur.fetchone()[0]
+    columns = ', '.join(column for column in pd.read_sql('SELECT * FROM pp_data LIMIT 1', conn.database).columns if column != 'db_id')
+    cur.execute('INSERT INTO pp_data (' + columns + ') SELECT ' + columns + ' FROM pp_data WHERE db_id <= 100')
+    conn.commit()
+    assert not access_store.prices_coordinates_fresh(conn)
+    refresh = access_store.build_prices_coordinates(conn)
+    assert refresh['watermark'] == watermark and refresh['rows'] == __join_count__(conn) - first['rows'] > 0
+    assert access_store.prices_coordinates_fresh(conn)
+    cur.execute('SELECT COUNT(*), COUNT(DISTINCT pp_db_id) FROM prices_coordinates')
+    assert cur.fetchone() == (__join_count__(conn),) * 2
+
+    # Reloading the postcodes rebuilds the table
+    access_store.save_local_data_in_table(conn, 'postcode_data', postcode_file, method = 'chunked')
+    assert not access_store.prices_coordinates_fresh(conn)
+    rebuild = access_store.build_prices_coordinates(conn)
+    assert rebuild['watermark'] is None and rebuild['rows'] == __join_count__(conn)
+
+def test_price_queries_only_read_an_up_to_date_prices_coordinates(price_database):
+    conn, price_file, _ = price_database
+    recording = benchmark.__RecordingConnection__(conn)
+    query = lambda: sorted(access_load.get_price_coord_data_between_years_for_area.__wrapped__(recording, 'CB', limit = 100000))
+    joined = query()
+    assert len(joined) > 0
+    assert 'prices_coordinates' not in recording.statements[-1][0]
+    access_store.build_prices_coordinates(conn)
+    assert query() == joined
+    assert 'FROM `prices_coordinates`' in recording.statements[-1][0]
+    # After a reload, the transactions are joined again until the table is refreshed
+    access_store.save_local_data_in_table(conn, 'pp_data', price_file, method = 'chunked')
+    assert query() == joined
+    assert 'prices_coordinates' not in recording.statements[-1][0]
@@ -0,0 +1,59 @@
+import numpy as np
+import scipy.sparse
+import statsmodels.api as sm
+from sklearn.model_selection import train_test_split, KFold
+
+from adslib import address
+
+def __regression_data__(rows = 400, columns = 6, seed = 0):
+    generator = np.random.default_rng(seed)
+    features = np.column_stack([np.ones(rows), generator.normal(size = (rows, columns - 1))])
+    target = features @ generator.normal(size = columns) + generator.normal(size = rows)
+    return features, target
+
+''' The validation scores of the folds fitted one at a time with statsmodels, as cross_validation_train used to do
+'''
+def __statsmodels_fold_scores__(features, target, split_fractions, alpha, L1_wt, random_state, number_of_splits = 5):
+    X_fit_val, X_test, y_fit_val, y_test = train_test_split(features, target, test_size = split_fractions[2], random_state = random_state)
+    scores = []
+    for fit_index, val_index in KFold(n_splits = number_of_splits).split(X_fit_val):
+        fit = sm.OLS(y_fit_val[fit_index], X_fit_val[fit_index]).fit_regularized(alpha = alpha, L1_wt = L1_wt)
+        scores.append(address.mse(fit.predict(X_fit_val[val_index]), y_fit_val[val_index]))
+    test_fit = sm.OLS(y_fit_val, X_fit_val).fit_regularized(alpha = alpha, L1_wt = L1_wt)
+    return np.array(scores), address.mse(test_fit.predict(X_test), y_test), test_fit.params
+
+def test_ridge_path_matches_statsmodels():
+    features, target = __regression_data__()
+    alphas = [0, 0.001, 0.1, 1, 10]
+    params = address.ridge_path(features.T @ features, features.T @ target, len(target), alphas)
+    for alpha, row in zip(alphas, params):
+        expected = sm.OLS(target, features).fit_regularized(alpha = alpha, L1_wt = 0).params
+        assert np.allclose(row, expected, rtol = 1e-10, atol = 1e-12)
+
+def test_ridge_cross_validation_matches_the_statsmodels_folds():
+    features, target = __regression_data__()
+    for alpha in [0, 0.05]:
+        expected_scores, expected_test, expected_params = __statsmodels_fold_scores__(features, target, [0.6, 0.2, 0.2], alpha, 0, 3)
+        for matrix in [features, scipy.sparse.csr_matrix(features)]:
+            results, fit = address.cross_validation_train(matrix, target, [0.6, 0.2, 0.2], alpha = alpha, random_state = 3)
+            assert np.allclose(results['validation_scores'], expected_scores, rtol = 1e-10)
+            assert np.isclose(results['test_score'], expected_test, rtol = 1e-10)
+            assert np.allclose(fit.params, expected_params, rtol = 1e-10, atol = 1e-12)
+
+def test_grid_search_picks_the_best_mean_validation_score():
+    features, target = __regression_data__(300, 5, seed = 1)
+    alphas = [0.5, 0.01, 0.1]
+    results, fit = address.grid_search_train(features, target, [0.6, 0.2, 0.2], alphas, L1_wts = [0, 0.5], max_workers = 1,
+                                             random_state = 0, warm_start = False)
+    scores = results['scores']
+    assert len(scores) == len(alphas) * 2 * 5
+    for (alpha, L1_wt), group in scores.groupby(['alpha', 'L1_wt']):
+        expected, _, _ = __statsmodels_fold_scores__(features, target, [0.6, 0.2, 0.2], alpha, L1_wt, 0)
+        assert np.allclose(group.sort_values('fold').score.to_numpy(), expected, rtol = 1e-8)
+    means = scores.groupby(['alpha', 'L1_wt']).score.mean()
+    assert (results['best_alpha'], results['best_L1_wt']) == means.idxmin()
+    assert np.isclose(results['validation_scores'].mean(), means.min())
+    # The worker processes give the same scores as the current process
+    parallel, _ = address.grid_search_train(features, target, [0.6, 0.2, 0.2], alphas, L1_wts = [0, 0.5], max_workers = 2,
+                                            random_state = 0, warm_start = False)
+    assert np.allclose(parallel['scores'].score, scores.score)
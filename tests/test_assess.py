@@ -0,0 +1,94 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from adslib import assess
+
+def test_one_hot_encoding_of_many_values_is_not_fragmented():
+    data = pd.DataFrame({'area': np.random.default_rng(0).integers(0, 300, 2000), 'price': 1.0})
+    original = data.copy()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', pd.errors.PerformanceWarning)
+        encoded = assess.do_one_hot_encoding(data, 'area')
+    assert data.equals(original)
+    assert list(encoded.columns[:2]) == ['area', 'price'] and encoded.shape[1] == 2 + data.area.nunique()
+    assert (encoded.filter(like = 'is_area_').sum(axis = 1) == 1).all()
+    assert (encoded['is_area_7'] == (data.area == 7)).all()
+    # Encoding again replaces the columns instead of duplicating them
+    assert assess.do_one_hot_encoding(encoded, 'area', categories = [7]).columns.is_unique
+
+def __training_data__(rows, seed = 0):
+    generator = np.random.default_rng(seed)
+    data = pd.DataFrame({'floor_area': generator.normal(100, 20, rows), 'rooms': generator.integers(1, 6, rows).astype(float),
+                         'property_type': generator.choice(['D', 'S', 'T', 'F'], rows),
+                         'price': generator.lognormal(12, 0.5, rows)})
+    data.loc[::10, 'floor_area'] = np.nan
+    return data
+
+def test_preprocessor_applies_what_it_learned():
+    train, test = __training_data__(1000), __training_data__(200, seed = 1)
+    test.loc[0, 'property_type'] = 'O'
+    preprocessor = assess.Preprocessor(['floor_area', 'rooms'], ['property_type'], ['price'], add_constant = True)
+    design_matrix, target = preprocessor.fit_transform(train, target = 'price')
+
+    # The same steps, done by hand with the functions of the module
+    expected = assess.mean_imputer(train.copy(), ['floor_area', 'rooms'])
+    expected = assess.remove_outliers(expected, ['price'])
+    expected = assess.do_one_hot_encoding(expected, 'property_type', categories = preprocessor.categories['property_type'])
+    assert preprocessor.feature_names[:3] == ['const', 'floor_area', 'rooms']
+    assert np.allclose(design_matrix.toarray(), np.column_stack([np.ones(len(expected)), expected[preprocessor.feature_names[1:]].to_numpy(float)]))
+    assert np.array_equal(target, expected.price.to_numpy())
+
+    # New data uses the training means, and a value not seen in training gets no encoding
+    scored = preprocessor.transform(test, drop_outliers = False)
+    assert scored.shape == (200, len(preprocessor.feature_names))
+    assert scored[0, 3:].sum() == 0
+    assert np.isnan(test.floor_area[10]) and np.isclose(scored[10, 1], preprocessor.means['floor_area'])
+    dense = assess.Preprocessor(['floor_area', 'rooms'], ['property_type'], ['price'], add_constant = True, sparse = False).fit(train)
+    assert np.array_equal(dense.transform(test, drop_outliers = False), scored.toarray())
+
+def test_preprocessor_must_be_fitted():
+    with pytest.raises(ValueError):
+        assess.Preprocessor(['rooms']).transform(__training_data__(10))
+
+''' The PCA of the standardized data, computed at once as before the streaming implementation
+'''
+def __reference_pca__(data):
+    means, stds = data.mean(axis = 0), data.std(axis = 0)
+    eigen_values, eigen_vectors = np.linalg.eigh(np.cov(((data - means) / stds).T))
+    order = np.argsort(eigen_values)[::-1]
+    return eigen_values[order], eigen_vectors[:, order], means, stds
+
+''' Checks that two sets of eigenvectors agree, up to the sign of each vector
+'''
+def __assert_same_vectors__(actual, expected, **tolerance):
+    signs = np.sign(np.sum(actual * expected, axis = 0))
+    np.testing.assert_allclose(actual * signs, expected, **tolerance)
+
+def test_streamed_pca_matches_the_pca_of_the_whole_data():
+    generator = np.random.default_rng(0)
+    # Correlated columns far from zero, where merging the chunks naively would lose precision
+    data = generator.standard_normal((5000, 6)) @ generator.standard_normal((6, 6)) + 1e4 * np.arange(1, 7)
+    expected_values, expected_vectors, expected_means, expected_stds = __reference_pca__(data)
+
+    # Chunks of uneven sizes, including an empty one, given as DataFrames
+    bounds = [0, 1, 700, 700, 2500, 4999, 5000]
+    chunks = [pd.DataFrame(data[start:end], columns = list('abcdef')) for start, end in zip(bounds[:-1], bounds[1:])]
+    values, vectors, means, stds = assess.compute_pca_streaming(chunks)
+    np.testing.assert_allclose(values, expected_values, rtol = 1e-9)
+    __assert_same_vectors__(vectors, expected_vectors, atol = 1e-8)
+    np.testing.assert_allclose(means.to_numpy(), expected_means, rtol = 1e-12)
+    np.testing.assert_allclose(stds.to_numpy(), expected_stds, rtol = 1e-9)
+    assert list(means.index) == list('abcdef')
+
+    values, vectors, _, _ = assess.compute_pca(data, chunk_size = 333)
+    np.testing.assert_allclose(values, expected_values, rtol = 1e-9)
+    __assert_same_vectors__(vectors, expected_vectors, atol = 1e-8)
+    values, vectors, _, _ = assess.compute_pca(data, dtype = np.float32, chunk_size = 333)
+    np.testing.assert_allclose(values, expected_values, rtol = 1e-3)
+    values, vectors, _, _ = assess.compute_pca(data, n_components = 2, method = 'randomized', random_state = 0)
+    np.testing.assert_allclose(values, expected_values[:2], rtol = 1e-6)
+    __assert_same_vectors__(vectors, expected_vectors[:, :2], atol = 1e-4)
+    with pytest.raises(ValueError):
+        assess.compute_pca_streaming([data[:0]])
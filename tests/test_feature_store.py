@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from adslib import access_load, load_from_osm
+from adslib.benchmark import stub_geometry_source
+from adslib.feature_store import FeatureStore
+
+BOUNDS = (52.25, 52.15, 0.2, 0.05)
+SPEC = {'school': {'tags': {'amenity': 'school'}, 'radius': 1000}}
+
+''' Serves the OSM features from a synthetic source, and counts the rows for which features are computed
+'''
+@pytest.fixture
+def computed_rows(monkeypatch):
+    previous = load_from_osm.set_geometry_source(stub_geometry_source(*BOUNDS, buildings = 200, pois = 100))
+    rows = []
+    build_feature_matrix = load_from_osm.build_feature_matrix
+    def counting(building_data, *args, **kwargs):
+        rows.append(len(building_data))
+        return build_feature_matrix(building_data, *args, **kwargs)
+    monkeypatch.setattr(load_from_osm, 'build_feature_matrix', counting)
+    yield rows
+    load_from_osm.set_geometry_source(previous)
+
+def __properties__(rows, seed = 0):
+    north, south, east, west = BOUNDS
+    generator = np.random.default_rng(seed)
+    return pd.DataFrame({'latitude': generator.uniform(south + 0.02, north - 0.02, rows),
+                         'longitude': generator.uniform(west + 0.02, east - 0.02, rows)})
+
+def test_only_missing_and_stale_locations_are_computed(tmp_path, computed_rows):
+    data = __properties__(50)
+    store = FeatureStore(str(tmp_path), SPEC)
+    first = store.get_features(data)
+    assert sum(computed_rows) == 50
+    assert first.school_count.notna().all()
+
+    # A second store on the same folder reuses everything
+    assert FeatureStore(str(tmp_path), SPEC).get_features(data).equals(first)
+    assert sum(computed_rows) == 50
+
+    more = pd.concat([data, __properties__(20, seed = 1)], ignore_index = True)
+    features = store.get_features(more)
+    assert sum(computed_rows) == 70
+    assert features.iloc[:50].equals(first)
+
+    # A new version of the OSM data makes every row stale
+    FeatureStore(str(tmp_path), SPEC, source_version = '2').get_features(more)
+    assert sum(computed_rows) == 140
+
+def test_rows_without_coordinates_get_missing_features(tmp_path, computed_rows):
+    data = __properties__(10)
+    data.loc[[2, 5], 'latitude'] = np.nan
+    data.loc[7, 'longitude'] = np.nan
+    store = FeatureStore(str(tmp_path), SPEC)
+    keys = store.keys(data)
+    assert keys.iloc[[2, 5, 7]].isna().all().all()
+    assert keys.drop(index = [2, 5, 7]).notna().all().all()
+
+    features = store.get_features(data)
+    assert sum(computed_rows) == 7
+    assert features.loc[[2, 5, 7]].isna().all().all()
+    assert features.drop(index = [2, 5, 7]).school_count.notna().all()
+    assert len(store.read()) == 7
+
+def test_compaction_keeps_parts_appended_by_other_stores(tmp_path, computed_rows):
+    store = FeatureStore(str(tmp_path), SPEC)
+    store.get_features(__properties__(30))
+    other = FeatureStore(str(tmp_path), SPEC)
+    other.get_features(__properties__(20, seed = 1))
+    store.get_features(__properties__(10, seed = 2))
+
+    store.compact()
+    assert len(store.__parts__()) == 1
+    assert len(FeatureStore(str(tmp_path), SPEC).read()) == 60
+    assert sum(computed_rows) == 60
+
+def test_frames_of_access_load_are_accepted(tmp_path, computed_rows, price_database):
+    conn, _, _ = price_database
+    data = access_load.get_price_coord_frame_between_years.__wrapped__(conn, 1995, 2022).head(100)
+    assert 'lattitude' in data.columns and len(data) == 100
+    store = FeatureStore(str(tmp_path), SPEC, building_features = ['building'])
+    features = store.get_features(data)
+    assert features.school_count.notna().all() and features.building_is_valid_match.notna().all()
+    # The same locations with the other spelling are found in the store
+    assert store.get_features(data.rename(columns = {'lattitude': 'latitude'})).equals(features)
+    assert sum(computed_rows) == data[['lattitude', 'longitude']].drop_duplicates().shape[0]
+
+def test_stores_appending_at_the_same_time_keep_both_parts(tmp_path, computed_rows):
+    store = FeatureStore(str(tmp_path), SPEC)
+    other = FeatureStore(str(tmp_path), SPEC)
+    # The other store lists the folder before the first one has written its part
+    other.__parts__ = lambda: []
+    store.get_features(__properties__(30))
+    other.get_features(__properties__(20, seed = 1))
+    assert len(FeatureStore(str(tmp_path), SPEC).__parts__()) == 2
+    assert len(FeatureStore(str(tmp_path), SPEC).read()) == 50
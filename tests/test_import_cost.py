@@ -0,0 +1,15 @@
+import pytest
+
+from adslib import benchmark
+
+def test_imports_stay_within_their_time_and_memory_budgets():
+    costs = benchmark.check_import_cost()
+    for module in benchmark.__IMPORT_BUDGETS__:
+        assert costs[module]['peak_rss_bytes'] > 0
+
+def test_import_cost_regressions_are_reported():
+    # The database driver takes some memory, so a budget of nothing must fail, which shows the memory is actually checked
+    with pytest.raises(ValueError, match = 'resident memory'):
+        benchmark.check_import_cost({'adslib.access_load': {'allowed': ['pymysql'], 'seconds': 10, 'rss_megabytes': 0}})
+    with pytest.raises(ValueError, match = 'loads pymysql'):
+        benchmark.check_import_cost({'adslib.access_load': {'allowed': [], 'seconds': 10, 'rss_megabytes': 1000}})
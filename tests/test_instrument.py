@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from adslib import instrument, load_from_osm
+from adslib.benchmark import stub_geometry_source
+
+''' A geometry source recording the features it returns
+'''
+class __CountingSource__:
+    def __init__(self, source):
+        self.source = source
+        self.results = []
+
+    def geometries_from_bbox(self, north, south, east, west, tags):
+        self.results.append(self.source.geometries_from_bbox(north, south, east, west, tags))
+        return self.results[-1]
+
+    def geometries_from_point(self, center_point, tags, dist = 1000):
+        self.results.append(self.source.geometries_from_point(center_point, tags, dist = dist))
+        return self.results[-1]
+
+def test_every_osm_request_is_counted():
+    source = __CountingSource__(stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 100, pois = 200))
+    previous = load_from_osm.set_geometry_source(source)
+    data = pd.DataFrame({'latitude': np.linspace(52.17, 52.23, 20), 'longitude': np.linspace(0.07, 0.18, 20)})
+    tags = {'amenity': True}
+    try:
+        with instrument.recording() as recorder:
+            load_from_osm.extract_number_features_batch(data, 500, tags)
+            load_from_osm.extract_distance_to_closest_feature_batch(data, tags)
+            load_from_osm.extract_number_features(52.2, 0.12, 500, tags)
+            load_from_osm.extract_distance_to_closest_feature_single(52.2, 0.12, tags)
+            load_from_osm.extract_existance_feature(52.2, 0.12, 500, tags)
+    finally:
+        load_from_osm.set_geometry_source(previous)
+    operations = recorder.operations
+    requests = operations['osm_request']['calls'] + operations['osm_request_point']['calls']
+    assert (operations['osm_request']['calls'], operations['osm_request_point']['calls']) == (2, 3)
+    assert requests == len(source.results)
+    assert operations['osm_request']['features'] + operations['osm_request_point']['features'] == sum(map(len, source.results))
+    assert operations['osm_request']['bytes'] + operations['osm_request_point']['bytes'] == \
+        sum(int(result.memory_usage(index = False).sum()) for result in source.results)
+
+''' A configuration counting how often it is read
+'''
+class __CountingConfig__(dict):
+    reads = 0
+
+    def get(self, key, default = None):
+        self.reads += 1
+        return super().get(key, default)
+
+def test_the_configuration_is_only_read_once(monkeypatch):
+    settings = __CountingConfig__(instrumentation = True)
+    monkeypatch.setattr(instrument, 'config', settings)
+    monkeypatch.setattr(instrument, '__recorder__', None)
+    monkeypatch.setattr(instrument, '__configured__', False)
+    recorder = instrument.get_recorder()
+    reads = settings.reads
+    assert recorder is not None
+    for _ in range(100):
+        assert instrument.get_recorder() is recorder
+    assert settings.reads == reads
+    # A recorder set for a block is replaced by the configured one afterwards, and None disables instrumentation
+    with instrument.recording() as block:
+        assert instrument.get_recorder() is block
+    assert instrument.get_recorder() is recorder
+    instrument.set_recorder(None)
+    assert instrument.get_recorder() is None and settings.reads == reads
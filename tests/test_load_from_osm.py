@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+from adslib import load_from_osm
+from adslib.benchmark import stub_geometry_source
+from adslib.osm_extract import ExtractGeometrySource
+from adslib.osm_cache import GeocodeCache
+
+''' Serves the OSM features from a synthetic source
+'''
+@pytest.fixture
+def stub_source():
+    source = stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 300, pois = 200)
+    previous = load_from_osm.set_geometry_source(source)
+    yield source
+    load_from_osm.set_geometry_source(previous)
+
+def __properties__(rows = 300, seed = 0):
+    generator = np.random.default_rng(seed)
+    return pd.DataFrame({'latitude': generator.uniform(52.17, 52.23, rows), 'longitude': generator.uniform(0.07, 0.18, rows)},
+                        index = generator.permutation(rows) + 1000)
+
+''' The distance from every property to every feature, computed pairwise as the functions did before the KD-tree
+'''
+def __brute_force_distances__(data, features):
+    centroids = features.to_crs(27700).geometry.centroid
+    points = gpd.GeoSeries(gpd.points_from_xy(data.longitude, data.latitude), index = data.index, crs = 4326).to_crs(27700)
+    return np.array([centroids.distance(point).to_numpy() for point in points])
+
+def test_features_agree_on_the_pois_within_the_radius(stub_source):
+    features = load_from_osm.build_feature_matrix(__properties__(), {'school': {'tags': {'amenity': 'school'}, 'radius': 300}})
+    assert features.school_exists.any() and not features.school_exists.all()
+    assert (features.school_exists == (features.school_count > 0)).all()
+    assert (features.school_exists == (features.school_distance <= 300)).all()
+
+def test_box_features_match_the_brute_force_ones(stub_source):
+    data = __properties__()
+    tags = {'amenity': 'school'}
+    distances = __brute_force_distances__(data, load_from_osm.get_geometries_in_region(data, tags))
+
+    closest = load_from_osm.extract_distance_to_closest_feature_in_box(data, tags)
+    assert closest.index.equals(data.index)
+    assert np.allclose(closest.to_numpy(), distances.min(axis = 1))
+    existence = load_from_osm.extract_feature_existence_in_box(data, tags, distance_limit = 400)
+    assert existence.to_numpy().tolist() == (distances.min(axis = 1) < 400).tolist()
+
+def test_building_matches_match_the_brute_force_ones(stub_source):
+    data = __properties__()
+    buildings = load_from_osm.get_geometries_in_region(data, {'building': True})
+    distances = __brute_force_distances__(data, buildings)
+
+    matches = load_from_osm.extract_osm_building_features(data)
+    assert matches.index.equals(data.index)
+    assert matches['addr:street'].tolist() == buildings['addr:street'].iloc[distances.argmin(axis = 1)].tolist()
+    assert matches.geometry.tolist() == buildings.geometry.iloc[distances.argmin(axis = 1)].tolist()
+    assert matches.is_valid_match.tolist() == (distances.min(axis = 1) < 150).tolist()
+    assert matches.is_valid_match.any() and not matches.is_valid_match.all()
+
+def test_batch_functions_match_the_single_point_ones(stub_source):
+    data = __properties__(40)
+    # The last properties are far from any feature
+    data.iloc[-3:] = [[51.5, -1.5], [51.6, -1.4], [51.7, -1.3]]
+    tags = {'amenity': 'school'}
+    counts = load_from_osm.extract_number_features_batch(data, 400, tags)
+    existence = load_from_osm.extract_existance_feature_batch(data, 400, tags)
+    distances = load_from_osm.extract_distance_to_closest_feature_batch(data, tags, limit_distance = 1000)
+    buildings = load_from_osm.match_buildings_batch(data)
+    for index, (latitude, longitude) in data.iterrows():
+        assert counts[index] == load_from_osm.extract_number_features(latitude, longitude, 400, tags)
+        assert existence[index] == load_from_osm.extract_existance_feature(latitude, longitude, 400, tags)
+        distance = load_from_osm.extract_distance_to_closest_feature_single(latitude, longitude, tags, limit_distance = 1000)
+        assert np.isnan(distances[index]) if distance is None else np.isclose(distances[index], distance)
+        building = load_from_osm.match_single_building(latitude, longitude)
+        if building is None:
+            assert not buildings.is_valid_match[index]
+        else:
+            assert buildings.is_valid_match[index] and buildings.geometry[index] == building.geometry
+    assert counts.iloc[-3:].tolist() == [0, 0, 0] and distances.iloc[-3:].isna().all()
+    assert counts.iloc[:-3].gt(0).any() and distances.iloc[:-3].notna().any() and buildings.is_valid_match.iloc[:-3].any()
+
+def test_the_fetched_region_covers_the_largest_radius():
+    # A single property, with schools 2.5 km and 4 km to its east, beyond the default padding of 0.02 degrees
+    data = pd.DataFrame({'latitude': [52.2], 'longitude': [0.12]})
+    longitudes = 0.12 + np.array([2500, 4000]) / (111195 * np.cos(np.radians(52.2)))
+    schools = gpd.GeoDataFrame({'amenity': ['school', 'school']}, geometry = gpd.points_from_xy(longitudes, [52.2, 52.2]), crs = 4326)
+    previous = load_from_osm.set_geometry_source(ExtractGeometrySource(schools))
+    try:
+        features = load_from_osm.build_feature_matrix(data, {'near': {'tags': {'amenity': 'school'}, 'radius': 3000},
+                                                             'far': {'tags': {'amenity': 'school'}, 'radius': 5000}})
+    finally:
+        load_from_osm.set_geometry_source(previous)
+    assert features.near_count.tolist() == [1] and features.far_count.tolist() == [2]
+    assert features.near_distance.iloc[0] == pytest.approx(2500, rel = 0.01)
+
+def test_region_tiles_cover_each_cluster_of_properties():
+    # Two clusters, in Cambridge and in London, with nothing needed in between
+    generator = np.random.default_rng(1)
+    data = pd.DataFrame({'latitude': np.concatenate([generator.uniform(52.18, 52.22, 50), generator.uniform(51.48, 51.52, 50)]),
+                         'longitude': np.concatenate([generator.uniform(0.08, 0.16, 50), generator.uniform(-0.14, -0.06, 50)])})
+    tiles, summary = load_from_osm.plan_region_tiles(data, padding = 0.01, tile_size = 0.1)
+    assert summary['tiles'] == len(tiles) < 10
+    assert summary['tiled_area_km2'] < summary['single_box_area_km2'] / 10
+    assert summary['area_saved_km2'] == pytest.approx(summary['single_box_area_km2'] - summary['tiled_area_km2'])
+    for latitude, longitude in zip(data.latitude, data.longitude):
+        assert any(south + 0.01 <= latitude <= north - 0.01 and west + 0.01 <= longitude <= east - 0.01
+                   for north, south, east, west in tiles)
+
+def test_features_of_overlapping_tiles_are_returned_once():
+    source = stub_geometry_source(52.3, 52.1, 0.25, 0.0, buildings = 300, pois = 600, seed = 2)
+    previous = load_from_osm.set_geometry_source(source)
+    # The properties straddle the cell edges, so that the padded tiles overlap
+    data = pd.DataFrame({'latitude': [52.19, 52.21, 52.19, 52.21], 'longitude': [0.09, 0.09, 0.11, 0.11]})
+    tags = {'amenity': True}
+    try:
+        features, summary = load_from_osm.get_geometries_in_region(data, tags, padding = 0.03, tile_size = 0.1, return_plan = True)
+        tiles, _ = load_from_osm.plan_region_tiles(data, padding = 0.03, tile_size = 0.1)
+    finally:
+        load_from_osm.set_geometry_source(previous)
+    per_tile = [source.geometries_from_bbox(*tile, tags) for tile in tiles]
+    assert summary['tiles'] == len(tiles) == 4
+    assert not features.index.duplicated().any()
+    assert set(features.index) == set().union(*(set(tile.index) for tile in per_tile))
+    assert len(features) < sum(map(len, per_tile))
+
+''' A geocoder knowing two places, as squares of different sizes, and counting its calls
+'''
+class __Geocoder__:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        places = {'Cambridge, Cambridgeshire, United Kingdom': (52.2, 0.12, 0.03, 0.6),
+                  'Ely, Cambridgeshire, United Kingdom': (52.4, 0.26, 0.01, 0.3)}
+        if query not in places:
+            return gpd.GeoDataFrame()
+        latitude, longitude, size, importance = places[query]
+        return gpd.GeoDataFrame({'importance': [importance]}, crs = 4326,
+                                geometry = [box(longitude - size, latitude - size, longitude + size, latitude + size)])
+
+def test_place_features_are_geocoded_once_per_place(tmp_path):
+    geocoder = __Geocoder__()
+    previous = load_from_osm.set_geocode_cache(GeocodeCache(str(tmp_path), geocoder = geocoder))
+    data = pd.DataFrame({'town_city': ['Cambridge', 'Ely', 'Cambridge', 'Nowhere', None],
+                         'county': ['Cambridgeshire'] * 5, 'country': ['United Kingdom'] * 5,
+                         'lattitude': [52.21, 52.4, 52.2, 52.3, 52.3], 'longitude': [0.12, 0.27, 0.14, 0.2, 0.2]},
+                        index = [5, 4, 3, 2, 1])
+    try:
+        features = load_from_osm.extract_place_features_batch(data)
+        single = load_from_osm.extract_place_features('Cambridge', 'United Kingdom', 'Cambridgeshire')
+    finally:
+        load_from_osm.set_geocode_cache(previous)
+    assert sorted(geocoder.queries) == ['Cambridge, Cambridgeshire, United Kingdom', 'Ely, Cambridgeshire, United Kingdom',
+                                        'Nowhere, Cambridgeshire, United Kingdom']
+    assert features.index.equals(data.index)
+    assert features.place_importance.tolist()[:3] == [0.6, 0.3, 0.6] and features.iloc[3:].isna().all().all()
+    assert features.place_radius[5] == pytest.approx(single['radius']) and features.place_radius[5] > 2 * features.place_radius[4]
+    assert (features.place_easting[5], features.place_northing[5]) == pytest.approx((single['place_center'].x, single['place_center'].y))
+    # The distance to the center of the place is computed from the 'lattitude' column of the database frames
+    points = load_from_osm.ProjectedPoints.from_dataframe(data)
+    expected = np.hypot(points.easting[0] - single['place_center'].x, points.northing[0] - single['place_center'].y)
+    assert features.place_distance[5] == pytest.approx(expected) and features.place_distance[3] > features.place_distance[5]
+    assert features.place_distance[5] < 1500 and np.isnan(features.place_distance[2])
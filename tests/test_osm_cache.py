@@ -0,0 +1,65 @@
+import os
+import threading
+
+from adslib.benchmark import stub_geometry_source
+from adslib.osm_cache import TileCache
+
+TAGS = {'amenity': True}
+
+def test_hits_defer_writing_the_index(tmp_path, monkeypatch):
+    cache = TileCache(str(tmp_path), source = stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 10, pois = 50))
+    cache.geometries_from_bbox(52.2, 52.16, 0.14, 0.06, TAGS)
+    index_file = os.path.join(str(tmp_path), 'index.json')
+    modified = os.stat(index_file).st_mtime_ns
+    saves = []
+    save_index = TileCache.__save_index__
+    monkeypatch.setattr(TileCache, '__save_index__', lambda self: saves.append(1) or save_index(self))
+    for _ in range(20):
+        cache.geometries_from_bbox(52.2, 52.16, 0.14, 0.06, TAGS)
+    assert len(saves) == 0 and os.stat(index_file).st_mtime_ns == modified
+    cache.flush()
+    assert len(saves) == 1
+    # The flushed access times are read back by a new cache
+    assert TileCache(str(tmp_path)).__index__ == cache.__index__
+
+def test_hits_and_misses_are_counted_across_threads(tmp_path):
+    cache = TileCache(str(tmp_path), source = stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 10, pois = 50))
+    tiles = len(cache.tiles_for_bbox(52.2, 52.16, 0.14, 0.06))
+    cache.geometries_from_bbox(52.2, 52.16, 0.14, 0.06, TAGS)
+    def query():
+        for _ in range(25):
+            cache.geometries_from_bbox(52.2, 52.16, 0.14, 0.06, TAGS)
+    threads = [threading.Thread(target = query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.misses == tiles
+    assert cache.hits == 100 * tiles
+
+def test_a_tile_evicted_by_another_process_is_downloaded_again(tmp_path):
+    cache = TileCache(str(tmp_path), source = stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 10, pois = 50))
+    expected = cache.geometries_from_bbox(52.2, 52.16, 0.14, 0.06, TAGS)
+    tiles = len(cache.tiles_for_bbox(52.2, 52.16, 0.14, 0.06))
+    # Another process removes the files, which this cache still lists in its index
+    for file in os.listdir(str(tmp_path)):
+        if file.endswith('.parquet'):
+            os.remove(os.path.join(str(tmp_path), file))
+    features = cache.geometries_from_bbox(52.2, 52.16, 0.14, 0.06, TAGS)
+    assert sorted(features.index) == sorted(expected.index)
+    assert cache.misses == 2 * tiles and cache.hits == 0
+
+def test_caches_sharing_a_directory_merge_their_indexes(tmp_path):
+    source = stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 10, pois = 50)
+    first, second = TileCache(str(tmp_path), source = source), TileCache(str(tmp_path), source = source)
+    first.geometries_from_bbox(52.2, 52.16, 0.1, 0.06, TAGS)
+    second.geometries_from_bbox(52.2, 52.16, 0.2, 0.15, TAGS)
+    tiles = set(first.__index__) | set(second.__index__)
+    assert set(TileCache(str(tmp_path)).__index__) == tiles
+    # Tiles removed by one cache are not written back by the other
+    removed = set(first.__index__)
+    first.clear()
+    second.geometries_from_bbox(52.2, 52.16, 0.2, 0.15, TAGS)
+    second.flush()
+    assert set(TileCache(str(tmp_path)).__index__) == set(second.__index__)
+    assert len(second.__index__) > 0 and removed.isdisjoint(second.__index__)
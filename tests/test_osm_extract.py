@@ -0,0 +1,58 @@
+import pyarrow.parquet as pq
+
+from adslib.osm_extract import ExtractGeometrySource
+from adslib.benchmark import synthetic_osm_features
+
+# A small OSM XML extract: two amenities, a closed building way, an open road and an untagged node
+EXTRACT = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" version="1" lat="52.2000" lon="0.1200"><tag k="amenity" v="school"/><tag k="name" v="School"/></node>
+  <node id="2" version="1" lat="52.2100" lon="0.1300"><tag k="amenity" v="pub"/></node>
+  <node id="3" version="1" lat="52.2050" lon="0.1250"/>
+  <node id="10" version="1" lat="52.1900" lon="0.1000"/>
+  <node id="11" version="1" lat="52.1900" lon="0.1010"/>
+  <node id="12" version="1" lat="52.1910" lon="0.1010"/>
+  <node id="13" version="1" lat="52.1910" lon="0.1000"/>
+  <node id="20" version="1" lat="52.1800" lon="0.0800"/>
+  <node id="21" version="1" lat="52.1850" lon="0.0900"/>
+  <way id="100" version="1"><nd ref="10"/><nd ref="11"/><nd ref="12"/><nd ref="13"/><nd ref="10"/><tag k="building" v="house"/></way>
+  <way id="101" version="1"><nd ref="20"/><nd ref="21"/><tag k="highway" v="residential"/></way>
+</osm>
+'''
+
+def test_an_osm_extract_is_parsed_into_tagged_geometries(tmp_path):
+    file_location = str(tmp_path / 'extract.osm')
+    with open(file_location, 'w') as file:
+        file.write(EXTRACT)
+    source = ExtractGeometrySource.from_file(file_location)
+    features = source.features
+    assert sorted(features.index) == [('node', 1), ('node', 2), ('way', 100), ('way', 101)]
+    assert features.geometry[('way', 100)].geom_type == 'Polygon'
+    assert features.geometry[('way', 101)].geom_type == 'LineString'
+    assert features.geometry[('node', 1)].coords[0] == (0.12, 52.2)
+    assert features.loc[('node', 1), 'name'] == 'School'
+
+    schools = source.geometries_from_bbox(52.25, 52.15, 0.2, 0.05, {'amenity': 'school'})
+    assert list(schools.index) == [('node', 1)] and 'building' not in schools.columns
+    amenities = source.geometries_from_bbox(52.25, 52.15, 0.2, 0.05, {'amenity': True, 'building': True})
+    assert sorted(amenities.index) == [('node', 1), ('node', 2), ('way', 100)]
+    assert len(source.geometries_from_bbox(52.205, 52.195, 0.125, 0.115, {'amenity': True})) == 1
+    # Only elements with one of the given keys are kept
+    assert sorted(ExtractGeometrySource.from_file(file_location, keys = ['highway']).features.index) == [('way', 101)]
+
+def test_a_stored_extract_can_be_read_for_an_area(tmp_path):
+    source = ExtractGeometrySource(synthetic_osm_features(52.4, 52.0, 0.4, -0.2, buildings = 3000, pois = 2000, seed = 0))
+    file_location = str(tmp_path / 'extract.parquet')
+    source.to_parquet(file_location, row_group_size = 500)
+    tags = {'amenity': True, 'building': True}
+    whole = ExtractGeometrySource.from_parquet(file_location)
+    assert sorted(whole.features.index) == sorted(source.features.index)
+    assert list(whole.features.columns) == list(source.features.columns)
+
+    bbox = (52.22, 52.18, 0.15, 0.1)
+    area = ExtractGeometrySource.from_parquet(file_location, bbox = bbox)
+    expected = source.geometries_from_bbox(*bbox, tags)
+    assert sorted(area.geometries_from_bbox(*bbox, tags).index) == sorted(expected.index)
+    # Only the features of the area are read
+    assert len(area.features) == len(expected) and len(area.features) < len(source.features) / 20
+    assert pq.ParquetFile(file_location).num_row_groups > 1
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from adslib import access_load, load_from_osm
+from adslib.benchmark import stub_geometry_source
+from adslib.pipeline import ScoringPipeline
+
+''' A preprocessor and a model standing in for fitted ones, predicting twice the number of schools
+'''
+class __SchoolCount__:
+    def transform(self, data, drop_outliers = True):
+        return data[['school_count']].to_numpy(dtype = float)
+
+    def predict(self, design_matrix):
+        return 2 * design_matrix[:, 0]
+
+def __properties__(rows, seed = 0):
+    generator = np.random.default_rng(seed)
+    return pd.DataFrame({'latitude': generator.uniform(51, 53, rows), 'longitude': generator.uniform(-1, 1, rows),
+                         'price': generator.integers(100000, 900000, rows)})
+
+def test_streamed_input_is_partitioned_like_a_frame(tmp_path):
+    data = __properties__(5003)
+    pipeline = ScoringPipeline(str(tmp_path), {}, None, None, partition_size = 1000)
+    names = pipeline.partition(data.iloc[start:start + 700].reset_index(drop = True) for start in range(0, len(data), 700))
+    partitions = [pd.read_parquet(os.path.join(str(tmp_path), 'partitions', name, 'input.parquet')) for name in names]
+    assert [len(partition) for partition in partitions] == [1000] * 5 + [3]
+    # The rows are renumbered in stream order, and sorted by band of latitude, then by longitude
+    order = np.lexsort([data.longitude.to_numpy(), np.floor(data.latitude.to_numpy() / 0.1)])
+    assert (pd.concat(partitions).index.to_numpy() == order).all()
+    assert not os.path.exists(os.path.join(str(tmp_path), 'partitions', 'spill'))
+
+def test_existing_partitions_require_resume(tmp_path):
+    pipeline = ScoringPipeline(str(tmp_path), {}, None, None, partition_size = 1000)
+    names = pipeline.partition(__properties__(2500))
+    with pytest.raises(ValueError):
+        pipeline.partition(__properties__(2500, seed = 1))
+    assert pipeline.partition(__properties__(2500, seed = 1), resume = True) == names
+    assert pipeline.partition(None, resume = True) == names
+
+def test_access_load_chunks_are_scored(tmp_path, price_database):
+    conn, _, _ = price_database
+    previous = load_from_osm.set_geometry_source(stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 100, pois = 200))
+    try:
+        pipeline = ScoringPipeline(str(tmp_path), {'school': {'tags': {'amenity': 'school'}, 'radius': 500}},
+                                   __SchoolCount__(), __SchoolCount__(), partition_size = 700, chunk_size = 300, max_workers = 2)
+        pipeline.run(access_load.iter_price_coord_data_between_years(conn, chunk_size = 300))
+    finally:
+        load_from_osm.set_geometry_source(previous)
+    assert pipeline.failures == {}
+    predictions = pipeline.predictions()
+    assert len(predictions) == 2000 and 'lattitude' in predictions.columns
+    assert (predictions.prediction == 2 * predictions.school_count).all()
+    assert predictions.property_type.dtype == 'category'
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from adslib import access_load, access_store, query_cache
+from adslib.query_cache import QueryCache, use_query_cache
+
+def test_reloading_a_table_invalidates_the_queries_on_it(price_database, tmp_path):
+    conn, _, postcode_file = price_database
+    with use_query_cache(QueryCache(str(tmp_path))) as cache:
+        postcodes = access_load.get_row_sample(conn, 'postcode_data', limit = 10, seed = 1)
+        prices = access_load.get_price_coord_data_between_years(conn, limit = 10, seed = 1)
+        assert access_load.get_row_sample(conn, 'postcode_data', limit = 10, seed = 1) == postcodes
+        assert (cache.hits, cache.misses) == (1, 2)
+        # The reloaded rows get new keys, which the cached sample does not have
+        access_store.save_local_data_in_table(conn, 'postcode_data', postcode_file, method = 'chunked')
+        reloaded = access_load.get_row_sample(conn, 'postcode_data', limit = 10, seed = 1)
+        assert [row[-1] for row in reloaded] != [row[-1] for row in postcodes]
+        assert access_load.get_price_coord_data_between_years(conn, limit = 10, seed = 1) == prices
+        assert (cache.hits, cache.misses) == (1, 4)
+        # Queries on other tables are still served, from disk by a new cache
+        with use_query_cache(QueryCache(str(tmp_path))) as other:
+            assert access_load.get_row_sample(conn, 'postcode_data', limit = 10, seed = 1) == reloaded
+            assert access_load.get_row_sample(conn, 'pp_data', limit = 10, seed = 1) is not None
+            assert (other.hits, other.misses) == (1, 1)
+
+def test_results_expire_after_their_time_to_live(price_database, tmp_path, monkeypatch):
+    conn, _, _ = price_database
+    now = [1000.0]
+    monkeypatch.setattr(query_cache, 'time', SimpleNamespace(time = lambda: now[0]))
+    with use_query_cache(QueryCache(str(tmp_path), ttl = 60)) as cache:
+        access_load.get_row_sample(conn, 'pp_data', limit = 10, seed = 1)
+        now[0] += 59
+        access_load.get_row_sample(conn, 'pp_data', limit = 10, seed = 1)
+        assert (cache.hits, cache.misses) == (1, 1)
+        now[0] += 2
+        access_load.get_row_sample(conn, 'pp_data', limit = 10, seed = 1)
+        assert (cache.hits, cache.misses) == (1, 2)
+        # The expired entry was replaced, and the new one also expires on disk
+        now[0] += 61
+        with use_query_cache(QueryCache(str(tmp_path), ttl = 60)) as other:
+            access_load.get_row_sample(conn, 'pp_data', limit = 10, seed = 1)
+            assert (other.hits, other.misses) == (0, 1)
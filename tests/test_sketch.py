@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from adslib import assess
+from adslib import access_load
+from adslib.sketch import KLLSketch
+
+# The rank error bound documented by KLLSketch, as a fraction of the rows
+K = 200
+ERROR_BOUND = 1.7 / K
+
+QUANTILES = np.array([0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+
+''' The fraction of the values smaller than or equal to each estimate
+'''
+def __ranks__(values, estimates):
+    return np.searchsorted(np.sort(values), estimates, side = 'right') / len(values)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sketch_quantiles_are_within_the_error_bound(seed):
+    values = np.random.default_rng(seed).lognormal(12, 0.6, 200000)
+    sketch = KLLSketch(k = K, random_state = seed)
+    for chunk in np.array_split(values, 20):
+        sketch.update(chunk)
+    assert np.max(np.abs(__ranks__(values, sketch.quantile(QUANTILES)) - QUANTILES)) <= ERROR_BOUND
+    # The sketch keeps O(k) values
+    assert len(sketch) < 5 * K
+
+def test_merged_sketches_are_within_the_error_bound():
+    values = np.random.default_rng(0).normal(size = 200000)
+    sketches = [KLLSketch(k = K, random_state = seed).update(part) for seed, part in enumerate(np.array_split(values, 8))]
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    assert merged.n == len(values)
+    assert np.max(np.abs(__ranks__(values, merged.quantile(QUANTILES)) - QUANTILES)) <= ERROR_BOUND
+
+def test_streaming_outlier_bounds_match_the_exact_ones():
+    data = pd.DataFrame({'price': np.random.default_rng(1).lognormal(12, 0.6, 100000)})
+    chunks = [data.iloc[start:start + 10000] for start in range(0, len(data), 10000)]
+    exact_lower, exact_upper = assess.outlier_bounds(data, ['price'])['price']
+    lower, upper = assess.outlier_bounds_streaming(chunks, ['price'], k = K, random_state = 0)['price']
+    # The quartiles are within the rank error, which moves the bounds by a few percent of the interquartile range at most
+    iqr = (exact_upper - exact_lower) / 4
+    assert abs(lower - exact_lower) < 0.1 * iqr
+    assert abs(upper - exact_upper) < 0.1 * iqr
+
+def test_database_outlier_bounds_reject_unknown_columns(price_database):
+    conn, _, _ = price_database
+    with pytest.raises(ValueError):
+        access_load.get_outlier_bounds.__wrapped__(conn, column = 'price` FROM pp_data; DROP TABLE pp_data; --')
+    with pytest.raises(ValueError):
+        access_load.get_outlier_bounds.__wrapped__(conn, group_by = 'town_city')
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+
+from adslib import load_from_osm
+from adslib.spatial import ProjectedPoints, as_projected_points
+from adslib.benchmark import stub_geometry_source
+
+def __properties__(rows = 200, seed = 0):
+    generator = np.random.default_rng(seed)
+    return pd.DataFrame({'latitude': generator.uniform(52.17, 52.23, rows), 'longitude': generator.uniform(0.07, 0.18, rows)},
+                        index = generator.permutation(rows) + 1000)
+
+def test_projected_points_match_the_geopandas_projection():
+    data = __properties__()
+    points = ProjectedPoints.from_dataframe(data)
+    expected = gpd.GeoSeries(gpd.points_from_xy(data.longitude, data.latitude), index = data.index, crs = 4326).to_crs(27700)
+    assert points.index.equals(data.index) and len(points) == len(data)
+    np.testing.assert_allclose(points.xy, np.column_stack([expected.x, expected.y]))
+    assert points.geoseries.crs == expected.crs and points.geoseries.index.equals(data.index)
+    np.testing.assert_allclose(points.geoseries.distance(expected), 0, atol = 1e-6)
+    # The points are prepared once, and frames from the database spell the column 'lattitude'
+    assert as_projected_points(points) is points
+    np.testing.assert_array_equal(as_projected_points(data.rename(columns = {'latitude': 'lattitude'})).xy, points.xy)
+    with pytest.raises(ValueError):
+        as_projected_points(data.drop(columns = 'latitude'))
+
+def test_projected_points_can_replace_the_dataframe():
+    data = __properties__()
+    points = ProjectedPoints.from_dataframe(data)
+    previous = load_from_osm.set_geometry_source(stub_geometry_source(52.25, 52.15, 0.2, 0.05, buildings = 300, pois = 200))
+    tags = {'amenity': True}
+    try:
+        for function, args in [(load_from_osm.extract_number_features_batch, (300, tags)),
+                               (load_from_osm.extract_distance_to_closest_feature_batch, (tags,)),
+                               (load_from_osm.extract_distance_to_closest_feature_in_box, (tags,))]:
+            pd.testing.assert_series_equal(function(points, *args), function(data, *args))
+        spec = {'poi': {'tags': tags, 'radius': 400}}
+        pd.testing.assert_frame_equal(load_from_osm.build_feature_matrix(points, spec), load_from_osm.build_feature_matrix(data, spec))
+    finally:
+        load_from_osm.set_geometry_source(previous)